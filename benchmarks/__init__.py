@@ -0,0 +1,5 @@
+__all__ = [
+	"benchlib",
+	"snp_loading",
+	"suite_runs",
+]
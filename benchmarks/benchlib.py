@@ -0,0 +1,195 @@
+"""
+Benchmark machinery: run a piece of work with nothing cached, measuring
+the queries it issues (and the rows they return), its wall time and its
+peak memory; write the results as JSON; and compare them with a stored
+baseline, flagging regressions.
+"""
+import sys
+import json
+import time
+import resource
+from collections import OrderedDict
+
+from shared import datatest
+
+### Globals ###
+
+# how much slower (or bigger) than the baseline a benchmark may be before it
+# is flagged, as a fraction, and the differences always taken as noise
+TIME_TOLERANCE = 0.2
+TIME_FLOOR = 0.002		# seconds
+MEMORY_TOLERANCE = 0.2
+MEMORY_FLOOR_KB = 1024
+
+### Classes ###
+
+class Benchmark(object):
+	"""
+	A named piece of work to time: run is a function taking no
+	arguments, and detail says what it works on (e.g. the SNP ID)
+	"""
+
+	def __init__(self, name, run, detail=None):
+		self.name = name
+		self.run = run
+		self.detail = detail
+
+	def measure(self, repeat):
+		"""
+		Run the benchmark repeat times, starting each with no
+		cached query results or SNP data.  Returns its
+		measurements: the queries and rows of one run, the
+		fastest and median seconds, and the most the peak
+		memory use grew (in KB) in any run.
+		"""
+		times = []
+		peak = 0
+		for i in range(repeat):
+			resetCaches()
+			datatest.QUERIES.drain()
+			before = startMemory()
+			start = time.time()
+			self.run()
+			times.append(time.time() - start)
+			peak = max(peak, peakMemory() - before)
+			records = datatest.QUERIES.drain()
+
+		times.sort()
+		return OrderedDict([
+			('detail', self.detail),
+			('queries', len(records)),
+			('rows', sum([ record[3] for record in records ])),
+			('seconds', round(times[0], 6)),
+			('medianSeconds', round(times[len(times) // 2], 6)),
+			('peakKB', max(peak, 0)),
+			])
+
+### methods ###
+
+def resetCaches():
+	"""
+	Forget the query results and SNP data held in memory, so the
+	next run does all of its work
+	"""
+	datatest.RESULTS.clear()
+	snplib = sys.modules.get('snp_tests.snplib')
+	if snplib is not None:
+		snplib.clearCaches()
+
+def startMemory():
+	"""
+	Reset the process's peak memory (where Linux allows it) and
+	return its current memory use, in KB
+	"""
+	try:
+		fp = open('/proc/self/clear_refs', 'w')
+		fp.write('5')
+		fp.close()
+	except (IOError, OSError):
+		pass
+	return _status('VmRSS') or peakMemory()
+
+def peakMemory():
+	"""
+	Return the process's peak memory use (since the last
+	startMemory, where Linux allows resetting it), in KB
+	"""
+	return _status('VmHWM') or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def runAll(benchmarks, repeat, stream=None):
+	"""
+	Measure each of benchmarks, writing a line for each to stream
+	(if given) as it finishes.  Returns the results, ready to be
+	written as JSON.
+	"""
+	results = OrderedDict()
+	for benchmark in benchmarks:
+		results[benchmark.name] = benchmark.measure(repeat)
+		if stream:
+			writeLine(stream, benchmark.name, results[benchmark.name])
+	return OrderedDict([
+		('created', time.strftime('%Y-%m-%d %H:%M:%S')),
+		('backend', datatest.getBackend().describe()),
+		('repeat', repeat),
+		('benchmarks', results),
+		])
+
+def writeHeader(stream):
+	stream.write('%-45s %8s %9s %10s %10s %9s\n' % ('benchmark', 'queries', 'rows',
+		'ms', 'median ms', 'peak KB'))
+
+def writeLine(stream, name, measured):
+	stream.write('%-45s %8d %9d %10.1f %10.1f %9d\n' % (name, measured['queries'],
+		measured['rows'], measured['seconds'] * 1000, measured['medianSeconds'] * 1000,
+		measured['peakKB']))
+
+def save(results, path):
+	"""
+	Write results (from runAll) to path as JSON
+	"""
+	fp = open(path, 'w')
+	json.dump(results, fp, indent=1)
+	fp.write('\n')
+	fp.close()
+
+def load(path):
+	"""
+	Read results written by save
+	"""
+	fp = open(path)
+	results = json.load(fp, object_pairs_hook=OrderedDict)
+	fp.close()
+	return results
+
+def compare(results, baseline, timeTolerance=TIME_TOLERANCE,
+		memoryTolerance=MEMORY_TOLERANCE):
+	"""
+	Compare results with baseline (both as from runAll).  Returns
+	(regressions, skipped), each a list of (benchmark, message):
+	the regressions are any increase in queries or rows, and time
+	or peak memory more than the tolerance (a fraction) above the
+	baseline's; skipped are the benchmarks not compared because
+	they ran on something other than the baseline's did.
+	"""
+	regressions = []
+	skipped = []
+	old = baseline['benchmarks']
+	for (name, new) in results['benchmarks'].items():
+		if name not in old:
+			skipped.append((name, 'not in the baseline'))
+			continue
+		if old[name].get('detail') != new.get('detail'):
+			skipped.append((name, 'ran on %s, the baseline on %s' % \
+				(new.get('detail'), old[name].get('detail'))))
+			continue
+		for metric in [ 'queries', 'rows' ]:
+			if new[metric] > old[name][metric]:
+				regressions.append((name, '%s %d -> %d' % (metric, old[name][metric], new[metric])))
+		if new['seconds'] > old[name]['seconds'] * (1 + timeTolerance) and \
+				new['seconds'] - old[name]['seconds'] > TIME_FLOOR:
+			regressions.append((name, 'time %.1fms -> %.1fms (+%d%%)' % (old[name]['seconds'] * 1000,
+				new['seconds'] * 1000, _percent(old[name]['seconds'], new['seconds']))))
+		if new['peakKB'] > old[name]['peakKB'] * (1 + memoryTolerance) and \
+				new['peakKB'] - old[name]['peakKB'] > MEMORY_FLOOR_KB:
+			regressions.append((name, 'peak memory %dKB -> %dKB (+%d%%)' % (old[name]['peakKB'],
+				new['peakKB'], _percent(old[name]['peakKB'], new['peakKB']))))
+	return (regressions, skipped)
+
+def _status(field):
+	# a memory figure (in KB) from /proc/self/status, or None (not on Linux)
+	try:
+		fp = open('/proc/self/status')
+		try:
+			for line in fp:
+				if line.startswith(field + ':'):
+					return int(line.split()[1])
+		finally:
+			fp.close()
+	except (IOError, OSError):
+		pass
+	return None
+
+def _percent(old, new):
+	if not old:
+		return 100
+	return int(round((new - old) * 100.0 / old))
@@ -0,0 +1,130 @@
+"""
+Benchmarks of loading SNPs with snplib, for SNPs of different shapes
+(many sub SNPs, several coordinates, many markers, a sub SNP, and a simple
+consensus SNP), and of DataTestCase.assertQueryCount.
+
+Each SNP is loaded and then written out (to nowhere) by the serializer,
+so every part of its object graph is loaded, however lazily.  The SNPs
+are picked from candidate IDs (by default those the test suites use) by
+their shape.
+"""
+import unittest
+from collections import OrderedDict
+
+from shared import datatest
+from snp_tests import snplib
+from snp_tests import serializer
+from benchmarks.benchlib import Benchmark
+
+### Globals ###
+
+# shapes of SNP benchmarked, in order
+SHAPES = [ 'many sub SNPs', 'multi-coordinate', 'many markers', 'sub SNP', 'simple' ]
+
+### Classes ###
+
+class NullStream(object):
+	"""
+	Output that is thrown away
+	"""
+
+	def write(self, s):
+		pass
+
+class AssertionProbe(unittest.TestCase, datatest.DataTestCase):
+	"""
+	A test case whose assertions are called directly (not run as
+	a test), to time them
+	"""
+
+	def __init__(self):
+		unittest.TestCase.__init__(self)
+		self.hints = []
+
+	def runTest(self):
+		pass
+
+### methods ###
+
+def walk(snp):
+	"""
+	Write snp out to nowhere, loading all of it
+	"""
+	serializer.serialize([ snp ], NullStream(), 'json')
+
+def chooseIDs(candidates):
+	"""
+	Return an OrderedDict of shape (from SHAPES) : the SNP ID of
+	candidates that best has that shape (shapes no candidate has
+	are left out)
+	"""
+	snps = snplib.getSnpsByIDs(candidates)
+	consensus = []
+	subSnps = []
+	for accID in candidates:
+		snp = snps[accID]
+		if isinstance(snp, snplib.ConsensusSnp):
+			markers = sum([ len(location.markers) for location in snp.locations ])
+			consensus.append((accID, len(snp.subSnps), len(snp.locations), markers))
+		elif isinstance(snp, snplib.SubSnp):
+			subSnps.append(accID)
+
+	chosen = OrderedDict()
+	for (shape, i) in [ ('many sub SNPs', 1), ('multi-coordinate', 2), ('many markers', 3) ]:
+		best = max(consensus + [ None ], key=lambda snp: snp and snp[i] or 0)
+		if best and (best[i] > 1 or (shape == 'many markers' and best[i] > 0)):
+			chosen[shape] = best[0]
+	if subSnps:
+		chosen['sub SNP'] = subSnps[0]
+	if consensus:
+		chosen['simple'] = min(consensus, key=lambda snp: snp[1] + snp[2] + snp[3])[0]
+	return chosen
+
+def collect(candidates):
+	"""
+	Return the Benchmarks of loading SNPs, chosen from
+	candidates (SNP IDs), and of assertQueryCount
+	"""
+	chosen = chooseIDs(candidates)
+	found = [ accID for accID in candidates if snplib.getSnpByID(accID) is not None ]
+	keys = OrderedDict([ (shape, snplib.getSnpByID(accID).consensusSnpKey)
+		for (shape, accID) in chosen.items()
+		if isinstance(snplib.getSnpByID(accID), snplib.ConsensusSnp) ])
+
+	tests = []
+	for (shape, accID) in chosen.items():
+		tests.append(Benchmark('getSnpByID: %s' % shape,
+			lambda accID=accID: walk(snplib.getSnpByID(accID)), accID))
+	for (shape, key) in keys.items():
+		tests.append(Benchmark('ConsensusSnp (lazy): %s' % shape,
+			lambda key=key: walk(snplib.ConsensusSnp(key)), chosen[shape]))
+	if found:
+		tests.append(Benchmark('getSnpsByIDs: %d SNPs' % len(found),
+			lambda: [ walk(snp) for snp in snplib.getSnpsByIDs(found).values() ],
+			','.join(found)))
+
+	probe = AssertionProbe()
+	if 'simple' in chosen:
+		def countSubSnps(accID=chosen['simple']):
+			try:
+				probe.assertQueryCount(1, '''select 1
+					from snp_subsnp ss, snp_accession a
+					where a._MGIType_key = 30
+						and a.accID = %s
+						and a._Object_key = ss._ConsensusSnp_key''', params=[accID])
+			except AssertionError:
+				pass
+		tests.append(Benchmark('assertQueryCount: sub SNPs of a SNP', countSubSnps,
+			chosen['simple']))
+	def countVocabulary():
+		try:
+			probe.assertQueryCount(0, '''select 1
+				from snp_consensussnp s
+				where not exists (select 1 from voc_term t, voc_vocab v
+					where t._Term_key = s._VarClass_key
+						and t._Vocab_key = v._Vocab_key
+						and v.name = 'SNP Variation Class')''', exact=True)
+		except AssertionError:
+			pass
+	tests.append(Benchmark('assertQueryCount: exact, whole table', countVocabulary))
+	return tests
@@ -0,0 +1,38 @@
+"""
+Benchmarks of running the test suites (see testProdDatabase.SUITES): each
+suite on its own, then all of them, as testProdDatabase runs them in one
+process.  Whether the tests pass does not matter here.
+"""
+import sys
+import unittest
+
+from benchmarks.benchlib import Benchmark
+
+### methods ###
+
+def runSuites(names):
+	"""
+	Build and run the named suites (all, if names is empty),
+	resolving the SNP IDs they declare first, as
+	testProdDatabase does
+	"""
+	import testProdDatabase
+	suite = testProdDatabase.master_suite(names)
+	if 'snp_tests.snplib' in sys.modules:
+		sys.modules['snp_tests.snplib'].RESOLVER.resolve()
+	suite.run(unittest.TestResult())
+
+def collect(names=None):
+	"""
+	Return the Benchmarks of running each of the named suites
+	(default: all of them), and of running them all together
+	"""
+	import testProdDatabase
+	names = [ name.rsplit('.', 1)[-1] for name in testProdDatabase.selectSuites(names) ]
+	tests = []
+	for name in names:
+		tests.append(Benchmark('suite: %s' % name, lambda name=name: runSuites([ name ])))
+	if len(names) > 1:
+		tests.append(Benchmark('suites: %d together' % len(names),
+			lambda: runSuites(names), ','.join(names)))
+	return tests
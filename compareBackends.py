@@ -0,0 +1,114 @@
+#!/usr/local/bin/python
+"""
+Load SNPs through each of several backends (see shared/backends.py) and
+	compare, for each SNP ID, the loader's round trips (queries), rows
+	fetched and time taken, and whether the data loaded is the same.
+
+Each backend is one of: postgres (DATATEST_DBSERVER..DATATEST_DBNAME),
+	postgres:server..database, snapshot:DIR, fixtures:DIR, sqlite:FILE
+
+Usage: compareBackends.py [--repeat N] [--ids ID,ID...] backend [backend ...]
+	--repeat N	load each SNP N times per backend and report the
+			fastest (default 3); nothing is cached between loads
+	--ids		SNP IDs to load (default: those the test suites use)
+"""
+
+import sys
+import time
+import hashlib
+import StringIO
+from optparse import OptionParser
+
+from shared import datatest
+from snp_tests import snplib
+from snp_tests import serializer
+
+###--- Globals ---###
+
+# kinds of backend (see datatest.makeBackend)
+BACKENDS = [ 'postgres', 'snapshot', 'fixtures', 'sqlite' ]
+
+###--- Functions ---###
+
+def suiteIDs():
+	# returns the SNP IDs declared by the test suites
+	import testProdDatabase
+	testProdDatabase.master_suite([])
+	return sorted(snplib.RESOLVER.pending)
+
+def timeLoad(accID, repeat):
+	# returns (queries, rows, fastest seconds, digest of the data) for loading 'accID'
+	# with nothing cached, on the current backend
+	best = None
+	for i in range(repeat):
+		datatest.RESULTS.clear()
+		snplib.clearCaches()
+		datatest.QUERIES.drain()
+		start = time.time()
+		snp = snplib.getSnpByID(accID)
+		elapsed = time.time() - start
+		records = datatest.QUERIES.drain()
+		if (best is None) or (elapsed < best):
+			best = elapsed
+	out = StringIO.StringIO()
+	if snp is not None:
+		serializer.serialize([ snp ], out, 'json')
+	return (len(records), sum([ record[3] for record in records ]), best,
+		hashlib.md5(out.getvalue()).hexdigest())
+
+def compare(specs, accIDs, repeat):
+	# load each of 'accIDs' on each backend in 'specs' and print a line per ID;
+	# returns True if every backend loaded the same data for every ID
+	names = [ spec.split(':', 1)[0] for spec in specs ]
+	results = {}		# (spec, accID) : (queries, rows, seconds, digest)
+	for spec in specs:
+		datatest.setBackend(datatest.makeBackend(spec))
+		sys.stdout.write('%s: %s\n' % (spec, datatest.getBackend().describe()))
+		for accID in accIDs:
+			results[(spec, accID)] = timeLoad(accID, repeat)
+
+	sys.stdout.write('\n%-14s' % 'SNP ID')
+	for name in names:
+		sys.stdout.write(' | %-25s' % ('%s: queries/rows/ms' % name))
+	sys.stdout.write(' | same data\n')
+
+	allSame = True
+	totals = [ [ 0, 0, 0.0 ] for spec in specs ]
+	for accID in accIDs:
+		sys.stdout.write('%-14s' % accID)
+		for (i, spec) in enumerate(specs):
+			(queries, rows, seconds, digest) = results[(spec, accID)]
+			sys.stdout.write(' | %-25s' % ('%d / %d / %.1f' % (queries, rows, seconds * 1000)))
+			totals[i][0] += queries
+			totals[i][1] += rows
+			totals[i][2] += seconds
+		same = len(set([ results[(spec, accID)][3] for spec in specs ])) == 1
+		allSame = allSame and same
+		sys.stdout.write(' | %s\n' % (same and 'yes' or 'NO'))
+
+	sys.stdout.write('%-14s' % 'total')
+	for (queries, rows, seconds) in totals:
+		sys.stdout.write(' | %-25s' % ('%d / %d / %.1f' % (queries, rows, seconds * 1000)))
+	sys.stdout.write(' | %s\n' % (allSame and 'yes' or 'NO'))
+	return allSame
+
+###--- Main Program ---###
+
+if __name__ == '__main__':
+	parser = OptionParser(usage = 'Usage: %prog [--repeat N] [--ids ID,ID...] backend [backend ...]')
+	parser.add_option('-r', '--repeat', type = 'int', default = 3,
+		help = 'loads of each SNP per backend; the fastest is reported (default 3)')
+	parser.add_option('--ids', help = 'comma-separated SNP IDs (default: those the suites use)')
+	(options, specs) = parser.parse_args()
+	if not specs:
+		parser.error('no backends given')
+	for spec in specs:
+		if spec.partition(':')[0] not in BACKENDS:
+			parser.error('unknown backend %s (expected one of: %s)' % (spec, ', '.join(BACKENDS)))
+
+	if options.ids:
+		accIDs = options.ids.replace(',', ' ').split()
+	else:
+		accIDs = suiteIDs()
+
+	sys.exit(not compare(specs, accIDs, max(options.repeat, 1)))
@@ -0,0 +1,89 @@
+#!/usr/local/bin/python
+"""
+Time loading SNPs of different shapes with snplib, DataTestCase assertions,
+	and runs of the test suites, reporting for each the queries issued,
+	rows fetched, wall time and peak memory (see benchmarks/).
+
+Usage: runBenchmarks.py [--repeat N] [--ids ID,ID...] [--backend BACKEND]
+		[--no-suites] [--output FILE] [--compare BASELINE] [suite ...]
+	suite		time only the named suites (default: all)
+	--repeat N	run each benchmark N times and report the fastest
+			(and median) time (default 5)
+	--ids		SNP IDs to choose the SNPs timed from (default:
+			those the test suites use)
+	--backend	where queries go, as for compareBackends.py (default:
+			as for testProdDatabase.py)
+	--no-suites	do not time the test suites
+	--output FILE	write the results to FILE as JSON
+	--compare BASELINE
+			compare the results with BASELINE (a file written by
+			--output), listing regressions; exits with status 1
+			if there are any
+	--tolerance F	fraction by which time or peak memory may exceed
+			the baseline's before it is a regression (default 0.2)
+"""
+
+import sys
+from optparse import OptionParser
+
+from shared import datatest
+from snp_tests import snplib
+from benchmarks import benchlib
+from benchmarks import snp_loading
+from benchmarks import suite_runs
+
+if __name__ == '__main__':
+	parser = OptionParser(usage = 'Usage: %prog [--repeat N] [--ids ID,ID...] [--backend BACKEND] ' + \
+		'[--no-suites] [--output FILE] [--compare BASELINE] [suite ...]')
+	parser.add_option('-r', '--repeat', type = 'int', default = 5,
+		help = 'runs of each benchmark; the fastest is reported (default 5)')
+	parser.add_option('--ids', help = 'comma-separated SNP IDs to choose from (default: those the suites use)')
+	parser.add_option('--backend', help = 'postgres[:server..database], snapshot:DIR, fixtures:DIR or sqlite:FILE')
+	parser.add_option('--no-suites', dest = 'suites', action = 'store_false', default = True,
+		help = 'do not time the test suites')
+	parser.add_option('-o', '--output', metavar = 'FILE', help = 'write the results to FILE as JSON')
+	parser.add_option('--compare', metavar = 'BASELINE', help = 'flag regressions against BASELINE')
+	parser.add_option('--tolerance', type = 'float', default = benchlib.TIME_TOLERANCE,
+		help = 'allowed fraction above the baseline for time and memory (default %s)' % \
+			benchlib.TIME_TOLERANCE)
+	(options, names) = parser.parse_args()
+
+	if options.backend:
+		try:
+			datatest.setBackend(datatest.makeBackend(options.backend))
+		except ValueError, e:
+			parser.error(str(e))
+	try:
+		suites = options.suites and suite_runs.collect(names) or []
+	except KeyError, e:
+		parser.error('unknown suite %s' % e)
+	baseline = options.compare and benchlib.load(options.compare)
+
+	if options.ids:
+		candidates = options.ids.replace(',', ' ').split()
+	else:
+		import testProdDatabase
+		testProdDatabase.master_suite([])
+		candidates = sorted(snplib.RESOLVER.pending)
+
+	benchlib.writeHeader(sys.stdout)
+	results = benchlib.runAll(snp_loading.collect(candidates) + suites,
+		max(options.repeat, 1), sys.stdout)
+	sys.stdout.write('Ran on %s\n' % results['backend'])
+
+	if options.output:
+		benchlib.save(results, options.output)
+		sys.stdout.write('Results written to %s\n' % options.output)
+
+	if baseline:
+		(regressions, skipped) = benchlib.compare(results, baseline,
+			options.tolerance, options.tolerance)
+		sys.stdout.write('\nCompared with %s (%s, on %s):\n' % (options.compare,
+			baseline['created'], baseline['backend']))
+		for (name, msg) in skipped:
+			sys.stdout.write('  not compared: %s: %s\n' % (name, msg))
+		for (name, msg) in regressions:
+			sys.stdout.write('  REGRESSION: %s: %s\n' % (name, msg))
+		if not regressions:
+			sys.stdout.write('  no regressions\n')
+		sys.exit(bool(regressions))
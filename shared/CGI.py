@@ -6,6 +6,7 @@ import sys
 import os
 import cgi
 import types
+import StringIO
 
 class CGI:
 	# Concept:
@@ -13,7 +14,11 @@ class CGI:
 	#	      handling
 	#	HAS:  an error log and some parameters passed in
 	#	DOES: parses parameters, logs messages, wraps main "program"
-	#	      (method) in error handling
+	#	      (method) in error handling.  main() writes the page to
+	#	      self.out (e.g. print >> self.out, ...), a buffer of its
+	#	      own while go() or wsgi() runs it, so the same script can
+	#	      also serve requests in a long-lived WSGI process (see
+	#	      wsgiApplication below).
 	# Implementation:
 
 	def __init__ (self,
@@ -42,6 +47,10 @@ class CGI:
 				self.logfd = None
 		self.fields = {}
 		self.contentType = 'text/html'
+		self.status = '200 OK'
+		self.headers = []		# (name, value) sent after Content-type
+		self.environ = os.environ	# CGI environment (or WSGI environ)
+		self.out = sys.stdout		# where main() writes the page
 		return
 
 	def log (self,
@@ -56,9 +65,9 @@ class CGI:
 		#	script name: [date & time] [client IP] message\n
 
 		if self.logfd is not None:
-			cginame = os.path.basename (os.environ['SCRIPT_NAME'])
+			cginame = os.path.basename (self.environ['SCRIPT_NAME'])
 			datetime = time.asctime (time.localtime (time.time()))
-			ip = os.environ['REMOTE_ADDR']
+			ip = self.environ['REMOTE_ADDR']
 			self.logfd.write ('%s: [%s] [client %s] %s\n' % \
 				(cginame, datetime, ip, message))
 		return
@@ -81,7 +90,11 @@ class CGI:
 		#	fields) or a list of strings (for multi-valued
 		#	fields).
 
-		fs = cgi.FieldStorage()
+		if self.environ is os.environ:
+			fs = cgi.FieldStorage()
+		else:
+			fs = cgi.FieldStorage (fp = self.environ['wsgi.input'],
+				environ = self.environ)
 		for key in fs.keys():
 			if type(fs[key]) == types.ListType:
 				self.fields[key] = []
@@ -91,22 +104,70 @@ class CGI:
 				self.fields[key] = fs[key].value
 		return self.fields
 
-	def go (self):
+	def go (self,
+		out = None		# file-like object; sys.stdout by default
+		):
 		# Purpose: wraps the main() method in exception handling
 		# Returns: nothing
 		# Assumes: nothing
-		# Effects: runs the main() method and outputs an explanatory
-		#	HTML page if an error occurs
-		# Throws: nothing
+		# Effects: runs the main() method, then writes the headers
+		#	(including any set by main()) and the page main()
+		#	wrote to 'out'
+		# Throws: propagates exceptions other than SystemExit
+
+		out = out or sys.stdout
+		body = self.run()
+
+		if self.status != '200 OK':
+			out.write ('Status: %s\n' % self.status)
+		out.write ('Content-type: %s\n' % self.contentType)
+		for (name, value) in self.headers:
+			out.write ('%s: %s\n' % (name, value))
+		out.write ('\n')
+		out.write (body)
+		return
 
-		print 'Content-type: %s' % self.contentType
-		print
+	def run (self):
+		# Purpose: run the main() method, collecting the page it
+		#	writes to self.out so headers can still be set while
+		#	it runs
+		# Returns: string; the body of the response
+		# Assumes: nothing
+		# Effects: sets self.out to a buffer for this request
+		# Throws: propagates exceptions other than SystemExit
 
+		self.out = StringIO.StringIO()
 		try:
 			self.main()
 		except SystemExit:
 			pass
-		return
+		body = self.out.getvalue()
+		if type(body) == types.UnicodeType:
+			body = body.encode ('utf-8')
+		return body
+
+	def wsgi (self,
+		environ,		# dict; WSGI environment of the request
+		start_response		# WSGI start_response callable
+		):
+		# Purpose: handle one request as a WSGI application, the
+		#	way go() handles one as a CGI script
+		# Returns: list containing the body of the response
+		# Assumes: nothing
+		# Effects: runs the main() method, collecting what it writes
+		#	to self.out
+		# Throws: propagates exceptions other than SystemExit
+
+		self.environ = environ
+		self.fields = {}
+
+		body = self.run()
+
+		start_response (self.status, [
+			('Content-type', self.contentType),
+			('Content-length', str(len(body))),
+			] + self.headers)
+		return [ body ]
 
 	def main (self):
 		# Purpose: abstract method.  Conceptually, this is the "main
@@ -134,3 +195,46 @@ class CGI:
 		self.contentType = contentType
 		return
 
+	def setStatus (self,
+		status			# string; e.g. '304 Not Modified'
+		):
+		# Purpose: change the HTTP status of the response ('200 OK'
+		#	by default)
+		# Returns: nothing
+		# Assumes: called from main()
+		# Effects: updates the status sent to the client
+		# Throws: nothing
+
+		self.status = status
+		return
+
+	def addHeader (self,
+		name,			# string; header name
+		value			# string; header value
+		):
+		# Purpose: send an extra header (after Content-type)
+		# Returns: nothing
+		# Assumes: called from main()
+		# Effects: adds to the headers sent to the client
+		# Throws: nothing
+
+		self.headers.append ((name, value))
+		return
+
+def wsgiApplication (
+	cgiClass,		# class; a CGI subclass
+	*args			# arguments for each new instance of cgiClass
+	):
+	# Purpose: make a WSGI application that serves each request with a
+	#	new instance of cgiClass.  Module-level state (database
+	#	connections, caches) lives on between requests.
+	# Returns: WSGI application (callable)
+	# Assumes: nothing
+	# Effects: nothing
+	# Throws: nothing
+	# Notes: each request writes to a buffer of its own, so nothing
+	#	written to sys.stdout (e.g. by other threads) reaches it
+
+	def application (environ, start_response):
+		return cgiClass(*args).wsgi (environ, start_response)
+	return application
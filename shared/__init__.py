@@ -1,4 +1,7 @@
 __all__ = [
 	"datatest",
 	"CGI",
+	"importprofile",
+	"snapshot",
+	"backends",
 ]
@@ -0,0 +1,273 @@
+"""
+Backends: where the queries issued through datatest.runQuery and
+streamQuery (and so by snplib and every suite) are run.
+
+datatest.PostgresBackend runs them on a server..database (the default).
+SqliteBackend runs them on a SQLite database, in memory unless a file is
+given, which can be filled from fixture files (see loadFixtures) or from a
+snapshot (see snapshot.Store), so the suites run with no database server:
+
+	DATATEST_FIXTURES=DIR testProdDatabase.py [suite ...]
+
+Fixture files are a directory of <table>.json files, each holding
+{ "columns" : [ name, ... ], "rows" : [ [ value, ... ], ... ] }, plus an
+optional schema.sql (otherwise SCHEMA, the SNP/vocabulary subset of the
+MGI schema that the suites and snplib read, is used).  Write them from a
+database with "testProdDatabase.py --fixtures DIR".
+"""
+import os
+import re
+import glob
+import json
+import threading
+from contextlib import contextmanager
+
+### Globals ###
+
+# tables (and the columns read) of the MGI schema used by snplib and the suites
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# rows fetched at a time by SqliteBackend.stream
+FETCH_SIZE = 10000
+
+# string_agg(value, 'separator' order by key), as rewritten by toSqlite
+STRING_AGG = re.compile(r"string_agg\(\s*([^,()]+?)\s*,\s*('(?:[^']|'')*')\s+order\s+by\s+([^()]+?)\s*\)", re.I)
+
+### Classes ###
+
+class Backend(object):
+	"""
+	Where queries go.  datatest uses only these methods and
+	attributes, so anything implementing them can stand in for
+	the database (see datatest.setBackend).
+	"""
+
+	name = None
+	login = None		# (server, database), or a stand-in for one
+	concurrent = False	# whether runConcurrently may query from several threads
+	explains = False	# whether PlanLog can explain queries (Postgres syntax)
+
+	def execute(self, query, params=None):
+		"""
+		Run query, with its %s placeholders filled in from
+		params (a list value is an array, for "= any(%s)").
+		Returns the rows as dictionaries keyed by the column
+		names as spelled in query.
+		"""
+		raise NotImplementedError
+
+	def stream(self, query, params, columns, batchSize):
+		"""
+		Run query, generating lists of up to batchSize rows,
+		each a tuple of the named columns.  (By default the
+		results are fetched all at once with execute.)
+		"""
+		results = self.execute(query, params)
+		for i in range(0, len(results), batchSize):
+			yield [ tuple([ row[column] for column in columns ]) \
+				for row in results[i:i + batchSize] ]
+
+	@contextmanager
+	def checkout(self):
+		"""
+		Hold a connection for this thread for the duration of
+		the block, if the backend has any to hold
+		"""
+		yield None
+
+	def describe(self):
+		"""
+		Return what the queries run on, for the end-of-run report
+		"""
+		return '%s..%s' % self.login
+
+	def close(self):
+		"""
+		Release any connections (the backend is being replaced)
+		"""
+		pass
+
+class SqliteBackend(Backend):
+	"""
+	Queries run on a SQLite database (the file at path, or one in
+	memory), optionally loaded from fixture files on first use.
+	Queries are rewritten from the Postgres dialect (see toSqlite)
+	and run one at a time.
+	"""
+
+	name = 'sqlite'
+
+	def __init__(self, path=':memory:', fixtures=None):
+		self.path = path
+		self.fixtures = fixtures
+		if fixtures:
+			self.login = ('fixtures', os.path.abspath(fixtures))
+		else:
+			self.login = ('sqlite', path)
+		self.connection = None
+		self.lock = threading.Lock()
+
+	def connect(self):
+		"""
+		Return the SQLite connection, opening (and loading) it
+		the first time
+		"""
+		if self.connection is None:
+			import sqlite3
+			connection = sqlite3.connect(self.path, check_same_thread=False)
+			connection.text_factory = str		# byte strings, as from pg_db
+			connection.create_aggregate('string_agg', 2, StringAggregate)
+			connection.create_aggregate('string_agg', 3, StringAggregate)
+			self.load(connection)
+			connection.commit()
+			self.connection = connection
+		return self.connection
+
+	def load(self, connection):
+		"""
+		Fill the newly opened database
+		"""
+		if self.fixtures:
+			loadFixtures(connection, self.fixtures)
+
+	def execute(self, query, params=None):
+		(text, values) = toSqlite(query, params)
+		with self.lock:
+			cursor = self.connect().cursor()
+			try:
+				cursor.execute(text, values)
+				if cursor.description is None:
+					return []
+				columns = self._columns(query, cursor)
+				return [ dict(zip(columns, row)) for row in cursor.fetchall() ]
+			finally:
+				cursor.close()
+
+	def stream(self, query, params, columns, batchSize):
+		(text, values) = toSqlite(query, params)
+		with self.lock:
+			cursor = self.connect().cursor()
+			try:
+				cursor.execute(text, values)
+				names = self._columns(query, cursor)
+				order = [ names.index(column) for column in columns ]
+				rows = cursor.fetchmany(min(batchSize, FETCH_SIZE))
+				batch = []
+				while rows:
+					batch.extend([ tuple([ row[i] for i in order ]) for row in rows ])
+					if len(batch) >= batchSize:
+						yield batch[:batchSize]
+						batch = batch[batchSize:]
+					rows = cursor.fetchmany(min(batchSize, FETCH_SIZE))
+				if batch:
+					yield batch
+			finally:
+				cursor.close()
+
+	def describe(self):
+		if self.fixtures:
+			return 'SQLite fixtures %s' % self.fixtures
+		return 'SQLite database %s' % self.path
+
+	def close(self):
+		if self.connection is not None:
+			self.connection.close()
+			self.connection = None
+
+	def _columns(self, query, cursor):
+		# column names as Postgres (and pg_db) would give them
+		from shared import datatest
+		return datatest.restoreColumnCase(query,
+			[ column[0].lower() for column in cursor.description ])
+
+class StringAggregate(object):
+	"""
+	Postgres's string_agg(value, separator [order by key]) for
+	SQLite, where toSqlite makes the sort key a third argument
+	"""
+
+	def __init__(self):
+		self.values = []	# (sort key, value)
+		self.separator = ''
+
+	def step(self, value, separator, key=None):
+		if value is not None:
+			self.values.append((key, value))
+			self.separator = separator
+
+	def finalize(self):
+		if not self.values:
+			return None
+		self.values.sort(key=lambda item: item[0])
+		return self.separator.join([ value for (key, value) in self.values ])
+
+### methods ###
+
+def toSqlite(query, params):
+	"""
+	Return (query, params) rewritten for SQLite: "= any(%s)" becomes
+	"in (...)" with the list's values written out, each other %s
+	becomes ?, %% becomes %, and the order by of a string_agg
+	becomes its third argument (see StringAggregate)
+	"""
+	from shared import datatest
+	query = STRING_AGG.sub(r'string_agg(\1, \2, \3)', query)
+	params = list(params or [])
+	values = []
+	parts = re.split(r'(%%|=\s*any\s*\(\s*%s\s*\)|%s)', query, flags=re.I)
+	count = 0
+	for i in range(1, len(parts), 2):
+		if parts[i] == '%%':
+			parts[i] = '%'
+			continue
+		value = params[count]
+		count += 1
+		if parts[i] == '%s':
+			parts[i] = '?'
+			values.append(value)
+		else:
+			parts[i] = 'in (%s)' % ', '.join([ datatest.sqlLiteral(item) for item in value ])
+	return (''.join(parts), values)
+
+def loadFixtures(connection, directory):
+	"""
+	Create the schema (directory/schema.sql, or SCHEMA) in the
+	SQLite connection and load each directory/<table>.json into
+	its table
+	"""
+	schema = os.path.join(directory, 'schema.sql')
+	if not os.path.exists(schema):
+		schema = SCHEMA
+	fp = open(schema)
+	connection.executescript(fp.read())
+	fp.close()
+
+	for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+		table = os.path.splitext(os.path.basename(path))[0]
+		fp = open(path)
+		fixture = json.load(fp)
+		fp.close()
+		connection.executemany('insert into %s (%s) values (%s)' % (table,
+			', '.join(fixture['columns']), ', '.join([ '?' ] * len(fixture['columns']))),
+			[ [ _encode(value) for value in row ] for row in fixture['rows'] ])
+	indexKeys(connection)
+
+def indexKeys(connection):
+	"""
+	Index every key and accession ID column of the SQLite
+	connection's tables
+	"""
+	tables = [ row[0] for row in connection.execute(
+		"select name from sqlite_master where type = 'table'") ]
+	for table in tables:
+		for row in connection.execute('pragma table_info(%s)' % table).fetchall():
+			column = row[1]
+			if column.lower().endswith('_key') or column.lower() == 'accid':
+				connection.execute('create index if not exists %s_%s on %s (%s)' % \
+					(table, column, table, column))
+
+def _encode(value):
+	# fixture values come back from json as unicode; store byte strings, as pg_db returns
+	if isinstance(value, unicode):
+		return value.encode('utf-8')
+	return value
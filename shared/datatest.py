@@ -1,27 +1,391 @@
 """
 datatest classes
 """
+import functools
 import logging
 import os
+import json
+import hashlib
+import re
+import sys
+import threading
+import time
+import Queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from shared import backends
 
 if 'PYTHONPATH' in os.environ:
-	import sys
 	sys.path.insert(0, os.environ['PYTHONPATH'])
 
-import pg_db
+# pg_db, and psycopg2 when it is available, are imported when the first
+# PostgresBackend is made (see configure), so importing this module does no
+# database setup.
+# (pg_db is built on psycopg2; with psycopg2 we keep our own pool of
+# connections rather than letting pg_db manage one per call.)
+pg_db = None
+psycopg2 = None
 
 ### Globals ###
 # For tests that failed, keep track of any hints for suggested fixes.
 HINTS = set([])
 
-### initialize database settings ###
-pg_db.set_sqlUser('mgd_public')
-pg_db.set_sqlPassword('mgdpub')
-pg_db.set_sqlServer( os.environ['DATATEST_DBSERVER'] )
-pg_db.set_sqlDatabase( os.environ['DATATEST_DBNAME'] )
+# Functions that each return a string (or None) to be included in the
+# end-of-run report.  (see addReporter)
+REPORTERS = []
+
+# reporter : function returning the counts it reports, for those whose
+# counts can be summed over worker processes (see addReporter)
+COUNTERS = {}
+
+DB_USER = 'mgd_public'
+DB_PASSWORD = 'mgdpub'
+
+# maximum number of pooled connections, and seconds a connection may sit
+# idle before it is checked with a trivial query on checkout
+POOL_SIZE = int(os.environ.get('DATATEST_POOLSIZE', '4'))
+POOL_HEALTHCHECK_INTERVAL = 60
+
+# maximum number of prepared statements kept on each pooled connection
+MAX_PREPARED = 200
+
+# longest query shape listed when assertMaxQueries fails
+MAX_SHAPE_LENGTH = 200
+
+# rows fetched at a time by streamQuery
+STREAM_BATCH_SIZE = 50000
+
+# the backends.Backend that runQuery, streamQuery (and so snplib) use,
+# chosen by configure() unless setBackend is called
+BACKEND = None
+
+# threads used by runConcurrently (one per pooled connection), created on
+# first use in each process
+THREADS = None
+THREADS_PID = None
+
+# per-thread state: the test a runConcurrently thread is working for, and
+# whether the thread is one of THREADS
+THREAD_CONTEXT = threading.local()
+
+# directory for the query logs (none are written if not set), and the
+# number of seconds above which a query goes in the slow query log
+LOGDIR = os.environ.get('DATATEST_LOGDIR')
+SLOW_QUERY_SECONDS = float(os.environ.get('DATATEST_SLOWQUERY', '1.0'))
+
+# opt-in capture of EXPLAIN plans for each query shape, and the estimated
+# table size above which a sequential scan is flagged
+EXPLAIN = os.environ.get('DATATEST_EXPLAIN', '0') == '1'
+SEQSCAN_ROWS = int(os.environ.get('DATATEST_SEQSCAN_ROWS', '100000'))
+
+# maximum number of query results remembered by runQuery (0 to disable), and
+# the largest result (in rows) worth remembering
+QUERY_CACHE_SIZE = int(os.environ.get('DATATEST_QUERYCACHE_SIZE', '1000'))
+QUERY_CACHE_MAX_ROWS = 10000
+
+# directory for data saved between runs, such as the SNP coordinate index
+# (nothing is saved if not set)
+CACHEDIR = os.environ.get('DATATEST_CACHEDIR')
+
+# directory of a snapshot (see snapshot.py), or of fixture files (see
+# backends.py), to answer queries from in place of the database
+SNAPSHOT_DIR = os.environ.get('DATATEST_SNAPSHOT')
+FIXTURES_DIR = os.environ.get('DATATEST_FIXTURES')
+
+# (server, database) that runQuery uses: from DATATEST_DBSERVER and
+# DATATEST_DBNAME (see configure), unless a tool like the SNP viewer calls
+# setLogin itself.  (A stand-in for one with other backends.)
+LOGIN = None
+
+# whether configure() has run, and the lock making sure it runs only once
+CONFIGURED = False
+CONFIGURE_LOCK = threading.Lock()
 
 ### Classes ###
 
+class ConnectionPool(object):
+	"""
+	A bounded pool of psycopg2 connections to one server..database
+
+	A thread checks out one connection and keeps it for the
+	duration of the checkout() block (nested blocks and queries
+	in the same thread reuse it).  Connections are created on
+	demand up to size; when all are checked out, other threads
+	wait for one to be returned.  Idle connections are checked
+	before reuse and replaced if they have gone bad.
+
+	Queries run with parameters are prepared on the server the
+	first time each connection sees them, and later runs only
+	execute the saved plan.
+
+	A forked child starts over with its own connections.  It
+	keeps (in orphaned) but never uses or closes those it
+	inherited: closing one, or letting it be garbage collected,
+	would end the parent's session on the shared socket.
+	"""
+
+	def __init__(self, server, database, size=POOL_SIZE,
+		healthCheckInterval=POOL_HEALTHCHECK_INTERVAL):
+		self.server = server
+		self.database = database
+		self.size = size
+		self.healthCheckInterval = healthCheckInterval
+
+		self.idle = Queue.LifoQueue()	# (connection, time returned)
+		self.created = 0
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.pid = os.getpid()
+		self.statements = {}	# id(connection) : { query : statement name }
+		self.orphaned = []	# connections inherited from the parent process
+
+	def connect(self):
+		conn = psycopg2.connect(host=self.server, database=self.database,
+			user=DB_USER, password=DB_PASSWORD)
+		conn.autocommit = True
+		return conn
+
+	@contextmanager
+	def checkout(self):
+		"""
+		Check out a connection for this thread for the
+		duration of the block
+		"""
+		self._checkFork()
+		if getattr(self.local, 'conn', None) is not None:
+			self.local.depth += 1
+			try:
+				yield self.local.conn
+			finally:
+				self.local.depth -= 1
+			return
+
+		conn = self._acquire()
+		self.local.conn = conn
+		self.local.depth = 1
+		try:
+			yield conn
+		finally:
+			self._checkFork()	# (orphaning conn if forked meanwhile)
+			self.local.conn = None
+			self.local.depth = 0
+			self._release(conn)
+
+	def execute(self, query, params=None):
+		"""
+		Run query on this thread's connection, returning
+		the rows as dictionaries (as pg_db.sql does).
+		If params is given, query has a %s placeholder for
+		each one and runs as a prepared statement.
+		"""
+		with self.checkout() as conn:
+			cursor = conn.cursor()
+			try:
+				if params is None:
+					cursor.execute(query)
+				else:
+					name = self._prepare(conn, cursor, query)
+					cursor.execute('execute %s (%s)' % (name,
+						', '.join([ '%s' ] * len(params))), params)
+				if cursor.description is None:
+					return []
+				columns = restoreColumnCase(query,
+					[ column[0] for column in cursor.description ])
+				return [ dict(zip(columns, row)) for row in cursor.fetchall() ]
+			finally:
+				cursor.close()
+
+	def stream(self, query, params=None, batchSize=STREAM_BATCH_SIZE):
+		"""
+		Run query through a server-side cursor on this thread's
+		connection, generating first the list of column names and
+		then lists of up to batchSize rows (as tuples)
+		"""
+		with self.checkout() as conn:
+			# a named cursor only lives as long as its transaction
+			conn.autocommit = False
+			cursor = conn.cursor('datatest_stream_%d' % id(conn))
+			try:
+				cursor.itersize = batchSize
+				cursor.execute(query, params)
+				rows = cursor.fetchmany(batchSize)
+				yield restoreColumnCase(query,
+					[ column[0] for column in cursor.description ])
+				while rows:
+					yield rows
+					rows = cursor.fetchmany(batchSize)
+			finally:
+				cursor.close()
+				conn.rollback()
+				conn.autocommit = True
+
+	def closeAll(self):
+		"""
+		Close the idle connections (checked out ones are
+		closed when they are returned)
+		"""
+		while True:
+			try:
+				(conn, returned) = self.idle.get_nowait()
+			except Queue.Empty:
+				break
+			self._discard(conn)
+
+	def _acquire(self):
+		while True:
+			try:
+				(conn, returned) = self.idle.get_nowait()
+			except Queue.Empty:
+				conn = None
+
+			if conn is None:
+				with self.lock:
+					canCreate = self.created < self.size
+					if canCreate:
+						self.created += 1
+				if canCreate:
+					try:
+						return self.connect()
+					except:
+						with self.lock:
+							self.created -= 1
+						raise
+				(conn, returned) = self.idle.get()
+
+			if self._isHealthy(conn, returned):
+				return conn
+			self._discard(conn)
+
+	def _release(self, conn):
+		if [ orphan for orphan in self.orphaned if orphan is conn ]:
+			return		# checked out before a fork; the parent's
+		if conn.closed or (self.pid != os.getpid()) or \
+			(self.server, self.database) != LOGIN:
+			self._discard(conn)
+		else:
+			self.idle.put((conn, time.time()))
+
+	def _prepare(self, conn, cursor, query):
+		# return the name of the statement prepared for query
+		# on conn, preparing it if this is the first time
+		statements = self.statements.setdefault(id(conn), {})
+		if query not in statements:
+			if len(statements) >= MAX_PREPARED:
+				cursor.execute('deallocate all')
+				statements.clear()
+			name = 'datatest_%d' % len(statements)
+			cursor.execute('prepare %s as %s' % (name, numberPlaceholders(query)))
+			statements[query] = name
+		return statements[query]
+
+	def _discard(self, conn):
+		with self.lock:
+			self.created -= 1
+		self.statements.pop(id(conn), None)
+		if self.pid != os.getpid():
+			self.orphaned.append(conn)
+			return
+		try:
+			conn.close()
+		except psycopg2.Error:
+			pass
+
+	def _isHealthy(self, conn, returned):
+		if conn.closed:
+			return False
+		if time.time() - returned < self.healthCheckInterval:
+			return True
+		try:
+			cursor = conn.cursor()
+			cursor.execute('select 1')
+			cursor.close()
+			return True
+		except psycopg2.Error:
+			return False
+
+	def _checkFork(self):
+		# a forked child (e.g. a testProdDatabase worker) must not
+		# share its parent's sockets; start over with new connections,
+		# keeping the parent's (unclosed) in orphaned
+		if self.pid != os.getpid():
+			while True:
+				try:
+					(conn, returned) = self.idle.get_nowait()
+				except Queue.Empty:
+					break
+				self.orphaned.append(conn)
+			conn = getattr(self.local, 'conn', None)
+			if conn is not None:
+				self.orphaned.append(conn)
+			self.idle = Queue.LifoQueue()
+			self.created = 0
+			self.lock = threading.Lock()
+			self.local = threading.local()
+			self.pid = os.getpid()
+			self.statements = {}
+
+class PostgresBackend(backends.Backend):
+	"""
+	Queries run on a Postgres server..database: through a
+	ConnectionPool when psycopg2 is available, otherwise through
+	pg_db.  With no server given, pg_db's default login is used.
+	"""
+
+	name = 'postgres'
+	explains = True
+
+	def __init__(self, server=None, database=None):
+		importDrivers()
+		self.pool = None
+		if server is None:
+			self.login = None
+		else:
+			self.login = (server, database)
+			pg_db.set_sqlLogin(DB_USER, DB_PASSWORD, server, database)
+			if psycopg2 is not None:
+				self.pool = ConnectionPool(server, database)
+		self.concurrent = self.pool is not None
+
+	def execute(self, query, params=None):
+		if self.pool is None:
+			return pg_db.sql(interpolate(query, params), 'auto')
+		return self.pool.execute(query, params)
+
+	def stream(self, query, params, columns, batchSize):
+		if self.pool is None:
+			for batch in backends.Backend.stream(self, query, params, columns, batchSize):
+				yield batch
+			return
+		batches = self.pool.stream(query, params, batchSize)
+		names = batches.next()
+		if names == list(columns):
+			order = None
+		else:
+			order = [ names.index(column) for column in columns ]
+		for batch in batches:
+			if order is not None:
+				batch = [ tuple([ row[i] for i in order ]) for row in batch ]
+			yield batch
+
+	@contextmanager
+	def checkout(self):
+		if self.pool is None:
+			yield None
+		else:
+			with self.pool.checkout() as conn:
+				yield conn
+
+	def describe(self):
+		if self.login is None:
+			return 'the pg_db default database'
+		return '%s..%s' % self.login
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.closeAll()
+
 class DataTestCase(object):
 	"""
 	datatest Test Case
@@ -32,17 +396,27 @@ class DataTestCase(object):
 
 	hints = []
 
-	def assertQueryCount(self, count, query, msg=None, hint=None):
+	def assertQueryCount(self, count, query, msg=None, hint=None, exact=False,
+		cache=True, params=None):
 		"""
 		Assert that the query returns count number of results
+
+		The rows are counted by the database, so only a single
+		integer is returned.  Unless exact is True, counting stops
+		after count+1 rows (enough to know the assertion failed).
+		Pass cache=False to bypass the run's query result cache.
+		params are values for the %s placeholders in query.
 		"""
-		results = runQuery(query)
+		if exact:
+			actual = countQuery(query, cache=cache, params=params)
+		else:
+			actual = countQuery(query, count + 1, cache=cache, params=params)
 		
 		try:
-			self.assertEquals(count, len(results), msg)
+			self.assertEquals(count, actual, msg)
 		except AssertionError, ae:
-			self._recordAssertionFailure()
 			self._addHint(hint)
+			self._recordAssertionFailure()
 			raise
 
 	def assertDataEquals(self, expected, actual, msg=None, hint=None):
@@ -52,8 +426,8 @@ class DataTestCase(object):
 		try:
 			self.assertEquals(expected, actual, msg)
 		except AssertionError, ae:
-			self._recordAssertionFailure()
 			self._addHint(hint)
+			self._recordAssertionFailure()
 			raise
 
 	def assertDataTrue(self, booleanValue, msg=None, hint=None):
@@ -63,8 +437,8 @@ class DataTestCase(object):
 		try:
 			self.assertTrue(booleanValue, msg)
 		except AssertionError, ae:
-			self._recordAssertionFailure()
 			self._addHint(hint)
+			self._recordAssertionFailure()
 			raise
 		
 	def assertNotEmpty(self, collection, msg=None, hint=None):
@@ -74,10 +448,69 @@ class DataTestCase(object):
 		try:
 			self.assertTrue(len(collection) > 0, msg)
 		except AssertionError, ae:
+			self._addHint(hint)
 			self._recordAssertionFailure()
+			raise
+
+	def assertCheck(self, kind, expectations, msg=None, hint=None):
+		"""
+		Assert that each of expectations (tuples of values, in
+		the order of kind's columns) holds, per the CheckKind
+		kind.  All of them are checked by a single query (see
+		compileCheck), so adding expectations adds no queries.
+		On failure, lists each expectation that does not hold.
+		"""
+		mismatches = runCheck(kind, expectations)
+		try:
+			if mismatches:
+				lines = [ '%s: %d of %d expectations do not hold' % \
+					(msg or kind.name, len(mismatches), len(expectations)) ]
+				for row in mismatches:
+					lines.append('\t' + kind.message % row)
+				self.fail('\n'.join(lines))
+		except AssertionError, ae:
+			self._addHint(hint or kind.hint)
+			self._recordAssertionFailure()
+			raise
+
+	@contextmanager
+	def assertMaxQueries(self, count, msg=None, hint=None):
+		"""
+		Assert that the block issues at most count queries
+		(through runQuery or streamQuery, so including snplib's)
+		for this test, counting those run for it on other
+		threads by runConcurrently.  Answers from the run's
+		result cache are not queries.  On failure, lists the
+		shapes of the queries issued (see fingerprint), the most
+		repeated first.
+		"""
+		test = currentTest()
+		records = QUERIES.records
+		start = len(records)
+		yield
+		issued = records[start:]
+		if QUERIES.records is not records:
+			issued = issued + QUERIES.records	# drained meanwhile
+		shapes = {}
+		for record in issued:
+			if record[4] == test:
+				shapes[record[0]] = shapes.get(record[0], 0) + 1
+		total = sum(shapes.values())
+
+		try:
+			if total > count:
+				lines = [ '%s: %d queries issued, more than the %d allowed' % \
+					(msg or 'Query budget exceeded', total, count) ]
+				for (repeats, shape) in sorted([ (-n, shape) for (shape, n) in shapes.items() ]):
+					if len(shape) > MAX_SHAPE_LENGTH:
+						shape = shape[:MAX_SHAPE_LENGTH] + '...'
+					lines.append('\t%4d x %s' % (-repeats, shape))
+				self.fail('\n'.join(lines))
+		except AssertionError, ae:
 			self._addHint(hint)
+			self._recordAssertionFailure()
 			raise
-		
+
 	def _recordAssertionFailure(self):
 		global HINTS
 		HINTS.update(self.hints)
@@ -86,20 +519,716 @@ class DataTestCase(object):
 		if hint and (hint not in self.hints):
 			self.hints.append(hint)
 
+class QueryLog(object):
+	"""
+	Record of every query issued through runQuery in this run
+
+	For each query keeps the wall time, row count, issuing test
+	method, and fingerprint.  Queries slower than slowSeconds are
+	appended to slowQueries.log as the run goes; writeReport()
+	ranks the whole run in queryReport.log.
+	"""
+
+	def __init__(self, logDir=LOGDIR, slowSeconds=SLOW_QUERY_SECONDS):
+		self.logDir = logDir
+		self.slowSeconds = slowSeconds
+		self.records = []	# (fingerprint, query, seconds, rows, test ID)
+		self.lock = threading.Lock()
+
+	def record(self, query, seconds, rowCount):
+		test = currentTest()
+		entry = (fingerprint(query), normalizeQuery(query), seconds, rowCount, test)
+		self.records.append(entry)
+		if seconds >= self.slowSeconds and self.logDir:
+			with self.lock:
+				fp = open(os.path.join(self.logDir, 'slowQueries.log'), 'a')
+				fp.write('%s\t%.3fs\t%d rows\t%s\t%s\n' % \
+					(time.strftime('%Y-%m-%d %H:%M:%S'),
+					seconds, rowCount, test, entry[1]))
+				fp.close()
+
+	def drain(self):
+		"""
+		Return the records so far, and forget them
+		(used to pass a worker's records to the parent)
+		"""
+		records = self.records
+		self.records = []
+		return records
+
+	def summary(self):
+		totalTime = sum([ r[2] for r in self.records ])
+		totalRows = sum([ r[3] for r in self.records ])
+		return 'Queries: %d (%d rows) in %.3fs' % \
+			(len(self.records), totalRows, totalTime)
+
+	def writeReport(self, top=25):
+		"""
+		Write the slowest queries, total time per test, and
+		duplicate query counts to queryReport.log.
+		Returns the path written, or None.
+		"""
+		if not (self.logDir and self.records):
+			return None
+
+		lines = [ self.summary(), '' ]
+
+		lines.append('Slowest queries:')
+		lines.append('%10s %8s  %-50s %s' % ('seconds', 'rows', 'test', 'query'))
+		slowest = sorted(self.records, key=lambda r: r[2], reverse=True)
+		for (fprint, query, seconds, rows, test) in slowest[:top]:
+			lines.append('%10.3f %8d  %-50s %s' % (seconds, rows, test, query))
+		lines.append('')
+
+		lines.append('Time per test:')
+		lines.append('%10s %8s  %s' % ('seconds', 'queries', 'test'))
+		perTest = {}
+		for (fprint, query, seconds, rows, test) in self.records:
+			(total, count) = perTest.get(test, (0.0, 0))
+			perTest[test] = (total + seconds, count + 1)
+		for (test, (total, count)) in sorted(perTest.items(),
+				key=lambda item: item[1][0], reverse=True):
+			lines.append('%10.3f %8d  %s' % (total, count, test))
+		lines.append('')
+
+		lines.append('Duplicate queries (same text issued more than once):')
+		lines.append('%8s %10s  %s' % ('count', 'seconds', 'query'))
+		byText = {}
+		for (fprint, query, seconds, rows, test) in self.records:
+			(total, count) = byText.get(query, (0.0, 0))
+			byText[query] = (total + seconds, count + 1)
+		duplicates = [ (count, total, query) for (query, (total, count)) \
+			in byText.items() if count > 1 ]
+		duplicates.sort(reverse=True)
+		for (count, total, query) in duplicates[:top]:
+			lines.append('%8d %10.3f  %s' % (count, total, query))
+		lines.append('')
+
+		lines.append('Query shapes (by fingerprint):')
+		lines.append('%8s %10s  %s' % ('count', 'seconds', 'fingerprint'))
+		byShape = {}
+		for (fprint, query, seconds, rows, test) in self.records:
+			(total, count) = byShape.get(fprint, (0.0, 0))
+			byShape[fprint] = (total + seconds, count + 1)
+		shapes = [ (total, count, fprint) for (fprint, (total, count)) \
+			in byShape.items() ]
+		shapes.sort(reverse=True)
+		for (total, count, fprint) in shapes[:top]:
+			lines.append('%8d %10.3f  %s' % (count, total, fprint))
+
+		path = os.path.join(self.logDir, 'queryReport.log')
+		fp = open(path, 'w')
+		fp.write('\n'.join(lines) + '\n')
+		fp.close()
+		return path
+
+# queries issued in this run
+QUERIES = QueryLog()
+
+class PlanLog(object):
+	"""
+	Opt-in capture of the EXPLAIN plan for each query shape
+	issued through runQuery
+
+	Plans are written as JSON to plans/ in the log directory.
+	Sequential scans of tables estimated to hold at least
+	seqScanRows rows are appended to seqScans.log as found.
+	"""
+
+	def __init__(self, enabled=EXPLAIN, logDir=LOGDIR, seqScanRows=SEQSCAN_ROWS):
+		self.enabled = enabled and bool(logDir)
+		self.logDir = logDir
+		self.seqScanRows = seqScanRows
+		self.seen = set()	# fingerprints already explained
+		self.tableRows = {}	# table name : estimated rows (pg_class)
+		self.alerts = []	# (table, estimated rows, test, query)
+		self.lock = threading.Lock()
+
+	def capture(self, query):
+		"""
+		Explain query, unless its shape was already explained
+		"""
+		if not self.enabled or not getBackend().explains:
+			return
+		shape = fingerprint(query)
+		if not shape.startswith(('select', 'with')):
+			return
+		with self.lock:
+			if shape in self.seen:
+				return
+			self.seen.add(shape)
+
+		results = _execute('explain (format json) %s' % query)
+		plan = results[0].values()[0]
+		if isinstance(plan, basestring):
+			plan = json.loads(plan)
+
+		test = currentTest()
+		planDir = os.path.join(self.logDir, 'plans')
+		if not os.path.isdir(planDir):
+			try:
+				os.makedirs(planDir)
+			except OSError:
+				pass	# created by another worker
+		fp = open(os.path.join(planDir,
+			hashlib.md5(shape).hexdigest()[:16] + '.json'), 'w')
+		json.dump({ 'test' : test, 'query' : normalizeQuery(query),
+			'fingerprint' : shape, 'plan' : plan }, fp, indent=2)
+		fp.close()
+
+		for table in seqScans(plan):
+			rows = self._estimatedRows(table)
+			if rows >= self.seqScanRows:
+				alert = (table, rows, test, normalizeQuery(query))
+				self.alerts.append(alert)
+				with self.lock:
+					fp = open(os.path.join(self.logDir, 'seqScans.log'), 'a')
+					fp.write('Seq Scan on %s (~%d rows)\t%s\t%s\n' % alert)
+					fp.close()
+
+	def counters(self):
+		return { 'shapes' : len(self.seen), 'scans' : len(self.alerts) }
+
+	def summary(self, counts=None):
+		if not self.enabled:
+			return None
+		counts = counts or self.counters()
+		return 'Plans: %d query shapes explained, %d sequential scans of large tables' % \
+			(counts['shapes'], counts['scans'])
+
+	def _estimatedRows(self, table):
+		if table not in self.tableRows:
+			results = _execute('''select reltuples::bigint as reltuples
+				from pg_class
+				where relname = '%s' ''' % table.lower())
+			if results:
+				self.tableRows[table] = int(results[0]['reltuples'])
+			else:
+				self.tableRows[table] = 0
+		return self.tableRows[table]
+
+# plans for queries issued in this run (if DATATEST_EXPLAIN is on)
+PLANS = PlanLog()
+REPORTERS.append(PLANS.summary)
+COUNTERS[PLANS.summary] = PLANS.counters
+
+class ResultCache(object):
+	"""
+	Read-through cache of query results for the run, keyed on
+	server..database and the normalized query text
+
+	Holds up to maxSize results (least recently used are dropped
+	first); results over maxRows rows are not kept.  Rows are
+	copied in and out, so callers may change the rows they get.
+	"""
+
+	def __init__(self, maxSize=QUERY_CACHE_SIZE, maxRows=QUERY_CACHE_MAX_ROWS):
+		self.maxSize = maxSize
+		self.maxRows = maxRows
+		self.results = OrderedDict()	# key : list of rows
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		"""
+		Return the cached rows for key, or None
+		"""
+		with self.lock:
+			if key in self.results:
+				self.hits += 1
+				rows = self.results.pop(key)
+				self.results[key] = rows
+				return [ dict(row) for row in rows ]
+			self.misses += 1
+			return None
+
+	def put(self, key, rows):
+		if self.maxSize <= 0 or rows is None or len(rows) > self.maxRows:
+			return
+		with self.lock:
+			self.results.pop(key, None)
+			self.results[key] = [ dict(row) for row in rows ]
+			while len(self.results) > self.maxSize:
+				self.results.popitem(last=False)
+
+	def clear(self):
+		"""
+		Forget all cached results (e.g. after a new build is loaded)
+		"""
+		with self.lock:
+			self.results.clear()
+
+	def counters(self):
+		return { 'hits' : self.hits, 'misses' : self.misses }
+
+	def summary(self, counts=None):
+		counts = counts or self.counters()
+		lookups = counts['hits'] + counts['misses']
+		if not lookups:
+			return None
+		return 'Query cache: %d hits, %d misses (%.1f%% hit rate)' % \
+			(counts['hits'], counts['misses'], 100.0 * counts['hits'] / lookups)
+
+# results of queries issued in this run
+RESULTS = ResultCache()
+REPORTERS.append(RESULTS.summary)
+COUNTERS[RESULTS.summary] = RESULTS.counters
+
+class CheckKind(object):
+	"""
+	A kind of table-driven check (see DataTestCase.assertCheck)
+
+	columns are the (name, SQL type) of each expectation.  query
+	selects, from the expectations (the relation "expected",
+	with those columns) joined against the real tables, the
+	expectations that do not hold, with any actual values found
+	alongside.  message is formatted with each such row (a
+	dictionary) to describe its mismatch, and hint is given
+	when any are found.
+	"""
+
+	def __init__(self, name, columns, query, message, hint=None):
+		self.name = name
+		self.columns = columns
+		self.query = query
+		self.message = message
+		self.hint = hint
+
 ### methods ###
 
-def runQuery(query):
-	return pg_db.sql(query, 'auto')
+def configure():
+	"""
+	Choose the backend queries go to, once, before the first query
+	or login: the snapshot in DATATEST_SNAPSHOT, else the fixture
+	files in DATATEST_FIXTURES, else Postgres (DATATEST_DBSERVER..
+	DATATEST_DBNAME, if set).
+	"""
+	global CONFIGURED
+	if CONFIGURED:
+		return
+	with CONFIGURE_LOCK:
+		if CONFIGURED:
+			return
+		if SNAPSHOT_DIR:
+			from shared import snapshot
+			backend = snapshot.Store(SNAPSHOT_DIR)
+		elif FIXTURES_DIR:
+			backend = backends.SqliteBackend(fixtures=FIXTURES_DIR)
+		elif 'DATATEST_DBSERVER' in os.environ:
+			backend = PostgresBackend(os.environ['DATATEST_DBSERVER'],
+				os.environ['DATATEST_DBNAME'])
+		else:
+			backend = PostgresBackend()
+		_useBackend(backend)
+		CONFIGURED = True
+
+def importDrivers():
+	"""
+	Import pg_db (and psycopg2, if available), once
+	"""
+	global pg_db, psycopg2
+	if pg_db is not None:
+		return
+	import pg_db
+	try:
+		import psycopg2
+	except ImportError:
+		psycopg2 = None
+	pg_db.set_sqlUser(DB_USER)
+	pg_db.set_sqlPassword(DB_PASSWORD)
+
+def getBackend():
+	"""
+	Return the backend queries go to
+	"""
+	configure()
+	return BACKEND
+
+def setBackend(backend):
+	"""
+	Send all further queries to backend (a backends.Backend), in
+	place of the one chosen by configure()
+	"""
+	global CONFIGURED
+	with CONFIGURE_LOCK:
+		_useBackend(backend)
+		CONFIGURED = True
+
+def makeBackend(spec):
+	"""
+	Return a new backend described by spec, one of:
+	postgres (DATATEST_DBSERVER..DATATEST_DBNAME),
+	postgres:server..database, snapshot:DIR, fixtures:DIR, or
+	sqlite:FILE.  Raises ValueError for anything else.
+	"""
+	(kind, sep, where) = spec.partition(':')
+	if kind == 'postgres' and not where:
+		return PostgresBackend(os.environ.get('DATATEST_DBSERVER'),
+			os.environ.get('DATATEST_DBNAME'))
+	if kind == 'postgres' and '..' in where:
+		return PostgresBackend(*where.split('..', 1))
+	if kind == 'snapshot' and where:
+		from shared import snapshot
+		return snapshot.Store(where)
+	if kind == 'fixtures' and where:
+		return backends.SqliteBackend(fixtures=where)
+	if kind == 'sqlite' and where:
+		return backends.SqliteBackend(where)
+	raise ValueError('Unknown backend: %s' % spec)
+
+def _useBackend(backend):
+	global BACKEND, LOGIN
+	if BACKEND is not None and BACKEND is not backend:
+		BACKEND.close()
+	BACKEND = backend
+	LOGIN = backend.login
+
+def getLogin():
+	"""
+	Return the (server, database) queries go to, or None if
+	there is none yet
+	"""
+	configure()
+	return LOGIN
+
+def setLogin(server, database):
+	"""
+	Point runQuery (and pg_db) at server..database.
+	Pooled connections are only replaced if these changed.
+	(Ignored when queries go to a snapshot or fixtures, which
+	stand in for any server..database.)
+	"""
+	configure()
+	if LOGIN == (server, database) or not isinstance(BACKEND, PostgresBackend):
+		return
+	setBackend(PostgresBackend(server, database))
+
+def getPool():
+	"""
+	Return the connection pool for the current login, or None
+	if queries do not go through one (no psycopg2, or not Postgres)
+	"""
+	return getattr(getBackend(), 'pool', None)
+
+@contextmanager
+def connection():
+	"""
+	Hold one connection for this thread for the duration of
+	the block, so a run of queries reuses it.  (Does nothing
+	when the backend has no pool of connections.)
+	"""
+	with getBackend().checkout() as conn:
+		yield conn
+
+def runQuery(query, params=None, cache=True):
+	"""
+	Run query, returning the rows as dictionaries.
+	params, if given, is a list of values for the %s placeholders
+	in query (a list value becomes an array, for "= any(%s)").
+	The database plans each such query once per connection.
+	An identical query already run against the same database
+	is answered from the run's result cache, unless cache is False.
+	"""
+	text = interpolate(query, params)
+	if cache:
+		key = (getLogin(), normalizeQuery(text))
+		results = RESULTS.get(key)
+		if results is not None:
+			return results
+
+	start = time.time()
+	results = _execute(query, params)
+	QUERIES.record(text, time.time() - start, len(results or []))
+	PLANS.capture(text)
+
+	if cache:
+		RESULTS.put(key, results)
+	return results
+
+def runConcurrently(calls):
+	"""
+	Run each of calls (functions taking no arguments) at the same
+	time on the shared thread pool, each thread querying through
+	its own pooled connection.  Returns their results, in order,
+	once all have finished (re-raising the first exception).
+	Without a connection pool (pg_db has a single connection, and
+	other backends take one query at a time), or when called from
+	one of the pool's threads, the calls run one after another in
+	this thread.
+	"""
+	if len(calls) < 2 or not getBackend().concurrent or \
+			getattr(THREAD_CONTEXT, 'inPool', False):
+		return [ call() for call in calls ]
+
+	test = currentTest()
+	def run(call):
+		THREAD_CONTEXT.inPool = True
+		THREAD_CONTEXT.test = test
+		try:
+			return call()
+		finally:
+			THREAD_CONTEXT.test = None
+	return getThreadPool().map(run, calls)
+
+def getThreadPool():
+	"""
+	Return the thread pool used by runConcurrently (threads do not
+	survive a fork, so each process has its own)
+	"""
+	global THREADS, THREADS_PID
+	if THREADS is None or THREADS_PID != os.getpid():
+		THREADS = ThreadPool(POOL_SIZE)
+		THREADS_PID = os.getpid()
+	return THREADS
+
+def streamQuery(query, columns, params=None, batchSize=STREAM_BATCH_SIZE):
+	"""
+	Run a query whose results are too large to hold as dictionaries,
+	generating lists of up to batchSize rows.  Each row is a tuple
+	of the named columns, in that order.  Results are not cached.
+	"""
+	text = interpolate(query, params)
+	start = time.time()
+	rowCount = 0
+	try:
+		for batch in getBackend().stream(query, params, columns, batchSize):
+			rowCount += len(batch)
+			yield batch
+	finally:
+		QUERIES.record(text, time.time() - start, rowCount)
+
+def _execute(query, params=None):
+	# run query without recording it
+	return getBackend().execute(query, params)
+
+def interpolate(query, params):
+	"""
+	Return query with its %s placeholders replaced by params,
+	as SQL literals (for pg_db, and for logging)
+	"""
+	if params is None:
+		return query
+	return query % tuple([ sqlLiteral(value) for value in params ])
+
+def sqlLiteral(value):
+	"""
+	Return value as a SQL literal
+	"""
+	if value is None:
+		return 'null'
+	if isinstance(value, bool):
+		return value and 'true' or 'false'
+	if isinstance(value, (int, long, float)):
+		return repr(value).rstrip('L')
+	if isinstance(value, (list, tuple, set, frozenset)):
+		if not value:
+			return "'{}'"
+		return 'array[%s]' % ','.join([ sqlLiteral(item) for item in value ])
+	if not isinstance(value, basestring):
+		value = str(value)
+	return "'%s'" % value.replace("'", "''")
+
+def numberPlaceholders(query):
+	"""
+	Convert the %s placeholders in query to the $1, $2, ...
+	form used by prepare (and %% back to %)
+	"""
+	parts = re.split(r'(%%|%s)', query)
+	count = 0
+	for i in range(1, len(parts), 2):
+		if parts[i] == '%%':
+			parts[i] = '%'
+		else:
+			count += 1
+			parts[i] = '$%d' % count
+	return ''.join(parts)
+
+def seqScans(plan):
+	"""
+	Return the names of tables read by sequential scans in
+	plan (as returned by explain (format json))
+	"""
+	tables = []
+	nodes = [ entry['Plan'] for entry in plan ]
+	while nodes:
+		node = nodes.pop()
+		if node.get('Node Type') == 'Seq Scan' and 'Relation Name' in node:
+			tables.append(node['Relation Name'])
+		nodes.extend(node.get('Plans', []))
+	return tables
+
+def normalizeQuery(query):
+	"""
+	Return query with its whitespace collapsed
+	"""
+	return ' '.join(query.split())
+
+def fingerprint(query):
+	"""
+	Return the shape of query: normalized, lower case, with
+	literal values (and lists of them) replaced by ?
+	"""
+	shape = normalizeQuery(query).lower()
+	shape = re.sub(r"'(?:[^']|'')*'", '?', shape)
+	shape = re.sub(r'\b\d+(\.\d+)?\b', '?', shape)
+	shape = re.sub(r'\?(\s*,\s*\?)+', '?', shape)
+	return shape
+
+def currentTest():
+	"""
+	Return the ID of the test method that is running in this
+	thread (found on the call stack, or passed on by
+	runConcurrently), or '-' if none
+	"""
+	frame = sys._getframe(1)
+	while frame is not None:
+		obj = frame.f_locals.get('self')
+		if obj is not None and hasattr(obj, '_testMethodName'):
+			return obj.id()
+		frame = frame.f_back
+	return getattr(THREAD_CONTEXT, 'test', None) or '-'
+
+def restoreColumnCase(query, columns):
+	"""
+	Postgres folds unquoted column names to lower case; give each
+	column back the spelling used in the query text (as pg_db does),
+	so rows can be read as row['_ConsensusSnp_key'], etc.
+	"""
+	spellings = {}
+	for word in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', query):
+		spellings.setdefault(word.lower(), word)
+	return [ spellings.get(column, column) for column in columns ]
+
+def databaseVersion(cache=True):
+	"""
+	Return a string identifying the current build of the database
+	(from mgi_dbinfo), so data saved between runs can be checked
+	against it.  A long-lived process should pass cache=False to
+	notice a new build.
+	"""
+	results = runQuery('select * from mgi_dbinfo', cache=cache)
+	if not results:
+		return None
+	return '|'.join([ '%s=%s' % item for item in sorted(results[0].items()) ])
+
+def countQuery(query, limit=None, cache=True, params=None):
+	"""
+	Return the number of rows that query returns, counted
+	server-side.  If limit is given, counting stops after
+	that many rows.
+	"""
+	query = query.strip().rstrip(';')
+	if limit is not None:
+		query = 'select 1 from (%s) as limited limit %d' % (query, limit)
+	results = runQuery('select count(*) as cnt from (%s) as counted' % query,
+		params, cache)
+	return int(results[0]['cnt'])
+
+def compileCheck(kind, expectations):
+	"""
+	Return (query, params) to check expectations (tuples of
+	values, in the order of the columns of the CheckKind kind):
+	one query, in which the expectations are a VALUES list
+	named "expected", returning the rows of those that do not
+	hold
+	"""
+	names = [ name for (name, sqlType) in kind.columns ]
+	row = '(%s)' % ', '.join([ 'cast(%%s as %s)' % sqlType
+		for (name, sqlType) in kind.columns ])
+	params = []
+	for expectation in expectations:
+		if len(expectation) != len(names):
+			raise ValueError('%s: expected (%s), got %r' % (kind.name,
+				', '.join(names), expectation))
+		params.extend(expectation)
+	query = 'with expected (%s) as (values %s)\n%s' % (', '.join(names),
+		', '.join([ row ] * len(expectations)), kind.query)
+	return (query, params)
+
+def runCheck(kind, expectations, cache=True):
+	"""
+	Return the rows (as dictionaries) of expectations that do not
+	hold, per the CheckKind kind, using one query (see compileCheck)
+	"""
+	if not expectations:
+		return []
+	(query, params) = compileCheck(kind, expectations)
+	return runQuery(query, params, cache)
+
+def maxQueries(count, msg=None, hint=None):
+	"""
+	Decorator for DataTestCase test methods: the test fails if
+	it issues more than count queries (see assertMaxQueries)
+	"""
+	def decorate(method):
+		@functools.wraps(method)
+		def budgeted(self, *args, **kwargs):
+			with self.assertMaxQueries(count, msg, hint):
+				return method(self, *args, **kwargs)
+		return budgeted
+	return decorate
 
 
 def log(msg):
 	print msg
 
-def reportFailures():
+def addReporter(reporter, counters=None):
+	"""
+	Register a function to be called by reportFailures.
+	It takes no arguments and returns a string to log (or None).
+	If counters is given, it returns the numbers reporter reports
+	(as a dictionary), and reporter also takes such a dictionary
+	(summed over worker processes) to report in place of its own.
+	"""
+	if reporter not in REPORTERS:
+		REPORTERS.append(reporter)
+	if counters is not None:
+		COUNTERS[reporter] = counters
+
+def reporterCounts():
+	"""
+	Return the counts of each reporter that has counters, keyed
+	by its position in REPORTERS (the same in worker processes
+	forked from this one)
+	"""
+	return dict([ (i, COUNTERS[reporter]()) for (i, reporter) in enumerate(REPORTERS)
+		if reporter in COUNTERS ])
+
+def addCounts(total, counts, sign=1):
 	"""
-	Report any test failures
+	Add counts (from reporterCounts) into total (likewise), or
+	subtract them if sign is -1.  Returns total.
+	"""
+	for (i, numbers) in counts.items():
+		summed = total.setdefault(i, {})
+		for (name, value) in numbers.items():
+			summed[name] = summed.get(name, 0) + sign * value
+	return total
+
+def reportFailures(counts=None):
 	"""
-	log('Tested %s..%s' % (os.environ['DATATEST_DBSERVER'], os.environ['DATATEST_DBNAME'] ))
+	Report any test failures.  If the tests ran in worker
+	processes, counts are the reporters' counts summed over the
+	workers (see reporterCounts); they are reported in place of
+	this process's own, and reporters without counts are left out.
+	"""
+	log('Tested %s' % getBackend().describe())
+	for (i, reporter) in enumerate(REPORTERS):
+		if counts is None:
+			msg = reporter()
+		elif i in counts:
+			msg = reporter(counts[i])
+		else:
+			continue
+		if msg:
+			log(msg)
+
+	log(QUERIES.summary())
+	path = QUERIES.writeReport()
+	if path:
+		log('Query report written to %s' % path)
+
 	if HINTS:
 
 		msg = """The following hints may help identify what to fix:\n"""
@@ -0,0 +1,100 @@
+"""
+Time taken to import each module, for finding what makes a script slow
+to start (like python3's -X importtime).
+
+	from shared import importprofile
+	importprofile.start()
+	...imports...
+	importprofile.report()
+"""
+import __builtin__
+import sys
+import time
+
+### Globals ###
+
+# the __import__ replaced while profiling (None when not profiling)
+ORIGINAL_IMPORT = None
+
+# (module name, nesting depth, self seconds, cumulative seconds), in the
+# order the imports finished
+TIMINGS = []
+
+# seconds spent in nested imports, for each import in progress
+NESTED = []
+
+### methods ###
+
+def start():
+	"""
+	Start timing imports of modules not yet loaded
+	"""
+	global ORIGINAL_IMPORT
+	if ORIGINAL_IMPORT is None:
+		ORIGINAL_IMPORT = __builtin__.__import__
+		__builtin__.__import__ = _timedImport
+
+def stop():
+	"""
+	Stop timing imports
+	"""
+	global ORIGINAL_IMPORT
+	if ORIGINAL_IMPORT is not None:
+		__builtin__.__import__ = ORIGINAL_IMPORT
+		ORIGINAL_IMPORT = None
+
+def report(stream=None, minimum=0.0):
+	"""
+	Stop timing, and write one line per module imported (taking
+	at least minimum seconds, cumulative) to stream (default:
+	stderr), followed by the total
+	"""
+	stop()
+	stream = stream or sys.stderr
+	stream.write('import time:  self [ms] | cumulative [ms] | module\n')
+	total = 0.0
+	for (name, depth, selfTime, cumulative) in TIMINGS:
+		if depth == 0:
+			total += cumulative
+		if cumulative >= minimum:
+			stream.write('import time: %10.1f | %15.1f | %s%s\n' % \
+				(selfTime * 1000, cumulative * 1000, '  ' * depth, name))
+	stream.write('import time: %d modules in %.1fms\n' % (len(TIMINGS), total * 1000))
+
+def _timedImport(name, globals=None, locals=None, fromlist=None, level=-1):
+	# __import__, noting the time taken when it loads a new module
+	candidates = _candidates(name, globals, level)
+	loaded = [ candidate for candidate in candidates if sys.modules.get(candidate) is not None ]
+	start = time.time()
+	NESTED.append(0.0)
+	try:
+		return ORIGINAL_IMPORT(name, globals, locals, fromlist, level)
+	finally:
+		cumulative = time.time() - start
+		nested = NESTED.pop()
+		if NESTED:
+			NESTED[-1] += cumulative
+		if not loaded:
+			for candidate in candidates:
+				if sys.modules.get(candidate) is not None:
+					TIMINGS.append((candidate, len(NESTED), cumulative - nested, cumulative))
+					break
+
+def _candidates(name, globals, level):
+	# full names the module imported as name could have: relative to the
+	# importing module's package (python 2 tries this first), then absolute
+	globals = globals or {}
+	package = globals.get('__package__')
+	if package is None and '__name__' in globals:
+		if '__path__' in globals:
+			package = globals['__name__']
+		else:
+			package = globals['__name__'].rpartition('.')[0]
+	if package and level != 0:
+		for i in range(1, max(level, 1)):
+			package = package.rpartition('.')[0]
+		relative = name and '%s.%s' % (package, name) or package
+		if level > 0:
+			return [ relative ]
+		return [ relative, name ]
+	return [ name ]
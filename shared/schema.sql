@@ -0,0 +1,199 @@
+-- The subset of the MGI schema read by snplib and the test suites, as SQLite
+-- tables, for fixture files (see backends.loadFixtures).  Types follow the
+-- Postgres columns; only the columns the code reads (and the keys) are here.
+
+-- SNPs
+
+create table snp_accession (
+	_Accession_key integer,
+	accID text,
+	prefixPart text,
+	numericPart integer,
+	_LogicalDB_key integer,
+	_Object_key integer,
+	_MGIType_key integer
+);
+
+create table snp_consensussnp (
+	_ConsensusSnp_key integer,
+	_VarClass_key integer,
+	alleleSummary text,
+	iupacCode text,
+	buildCreated text,
+	buildUpdated text
+);
+
+create table snp_flank (
+	_ConsensusSnp_key integer,
+	flank text,
+	sequenceNum integer,
+	is5prime integer
+);
+
+create table snp_consensussnp_strainallele (
+	_ConsensusSnp_key integer,
+	_mgdStrain_key integer,
+	allele text,
+	isConflict integer
+);
+
+create table snp_coord_cache (
+	_Coord_Cache_key integer,
+	_ConsensusSnp_key integer,
+	chromosome text,
+	sequenceNum integer,
+	startCoordinate real,
+	isMultiCoord integer,
+	strand text,
+	_VarClass_key integer,
+	alleleSummary text,
+	iupacCode text
+);
+
+create table snp_consensussnp_marker (
+	_ConsensusSnp_Marker_key integer,
+	_ConsensusSnp_key integer,
+	_Marker_key integer,
+	_Fxn_key integer,
+	_Coord_Cache_key integer,
+	_Transcript_Protein_key integer,
+	contig_allele text,
+	residue text,
+	aa_position text,
+	reading_frame text,
+	distance_from integer,
+	distance_direction text
+);
+
+create table snp_transcript_protein (
+	_Transcript_Protein_key integer,
+	transcriptID text,
+	proteinID text
+);
+
+create table snp_subsnp (
+	_SubSnp_key integer,
+	_ConsensusSnp_key integer,
+	_SubHandle_key integer,
+	_VarClass_key integer,
+	orientation text,
+	isExemplar integer,
+	alleleSummary text
+);
+
+create table snp_subsnp_strainallele (
+	_SubSnp_key integer,
+	_mgdStrain_key integer,
+	_Population_key integer,
+	allele text
+);
+
+create table snp_population (
+	_Population_key integer,
+	subHandle text,
+	name text
+);
+
+-- strains and markers
+
+create table prb_strain (
+	_Strain_key integer,
+	strain text
+);
+
+create table mrk_marker (
+	_Marker_key integer,
+	_Organism_key integer,
+	symbol text,
+	name text,
+	chromosome text
+);
+
+create table acc_accession (
+	_Accession_key integer,
+	accID text,
+	prefixPart text,
+	numericPart integer,
+	_LogicalDB_key integer,
+	_Object_key integer,
+	_MGIType_key integer,
+	private integer,
+	preferred integer
+);
+
+-- vocabularies
+
+create table voc_vocab (
+	_Vocab_key integer,
+	_LogicalDB_key integer,
+	isSimple integer,
+	isPrivate integer,
+	name text
+);
+
+create table voc_vocabdag (
+	_Vocab_key integer,
+	_DAG_key integer
+);
+
+create table voc_term (
+	_Term_key integer,
+	_Vocab_key integer,
+	term text,
+	abbreviation text,
+	sequenceNum integer,
+	isObsolete integer
+);
+
+create table mgi_translation (
+	_Translation_key integer,
+	_TranslationType_key integer,
+	_Object_key integer,
+	badName text,
+	sequenceNum integer
+);
+
+create table mgi_synonymtype (
+	_SynonymType_key integer,
+	_MGIType_key integer,
+	synonymType text
+);
+
+create table mgi_synonym (
+	_Synonym_key integer,
+	_Object_key integer,
+	_MGIType_key integer,
+	_SynonymType_key integer,
+	synonym text
+);
+
+create table mgi_notetype (
+	_NoteType_key integer,
+	_MGIType_key integer,
+	noteType text
+);
+
+create table mgi_note (
+	_Note_key integer,
+	_Object_key integer,
+	_MGIType_key integer,
+	_NoteType_key integer
+);
+
+create table mgi_notechunk (
+	_Note_key integer,
+	sequenceNum integer,
+	note text
+);
+
+-- the build (see datatest.databaseVersion)
+
+create table mgi_dbinfo (
+	public_version text,
+	product_name text,
+	schema_version text,
+	snp_schema_version text,
+	snp_data_version text,
+	lastdump_date text,
+	modification_date text
+);
@@ -0,0 +1,385 @@
+"""
+Snapshots: the rows the test suites read, copied out of the database into
+a directory holding one NumPy .npz file per table (one array per column)
+and a manifest.json recording the source server..database and build.
+
+	testProdDatabase.py --snapshot DIR [suite ...]		(see extract)
+	DATATEST_SNAPSHOT=DIR testProdDatabase.py [suite ...]	(see Store)
+
+A Store (a backends.SqliteBackend) loads a snapshot into an in-memory
+SQLite database, which then answers runQuery in place of the real
+database, so the suites can run (and be timed) without one.  Only the
+SNPs the suites name are kept, with one row for each distinct value of
+the columns checked across whole tables, so checks over whole tables see
+every value but not every row.
+"""
+import os
+import json
+import time
+from collections import OrderedDict
+
+from shared import backends
+from shared import datatest
+
+### Globals ###
+
+# numpy is imported (by loadNumpy) only when a snapshot is written or read
+numpy = None
+
+MANIFEST = 'manifest.json'
+
+# MGI types of the accession IDs kept
+CONSENSUS_SNP_TYPE = 30
+SUB_SNP_TYPE = 31
+MARKER_TYPE = 2
+TERM_TYPE = 13
+
+# vocabularies whose terms are all kept
+VOCABULARIES = [ 'SNP Variation Class', 'SNP Function Class', 'Sequence Ontology' ]
+
+# mgi_translation types kept (raw SNP function class to SNP Function Class)
+TRANSLATION_TYPES = [ 1014 ]
+
+# (table, column) for which one row per distinct value is kept, for the
+# checks over whole tables (location_test, vocab_term_test)
+DISTINCT_VALUES = [
+	('snp_coord_cache', 'chromosome'),
+	('snp_consensussnp', '_varclass_key'),
+	('snp_coord_cache', '_varclass_key'),
+	('snp_consensussnp_marker', '_fxn_key'),
+	('snp_subsnp', '_varclass_key'),
+	]
+
+# how values of each Postgres column type are stored (anything else is
+# stored as a string)
+KINDS = {
+	'smallint' : 'int',
+	'integer' : 'int',
+	'bigint' : 'int',
+	'numeric' : 'float',
+	'real' : 'float',
+	'double precision' : 'float',
+	'boolean' : 'bool',
+	}
+
+# SQLite column type for each kind
+SQLITE_TYPES = { 'int' : 'integer', 'float' : 'real', 'bool' : 'integer', 'str' : 'text' }
+
+### Classes ###
+
+class Extractor(object):
+	"""
+	The rows of a snapshot, collected table by table from the
+	database (duplicates are kept once)
+	"""
+
+	def __init__(self):
+		self.columns = OrderedDict()	# table : [ (column, kind), ... ]
+		self.rows = {}			# table : OrderedDict of row tuple : None
+
+	def add(self, table, where, params=None):
+		"""
+		Keep the rows of table matching the where clause.
+		Returns them, as dictionaries keyed by lower-case
+		column name.
+		"""
+		return self._keep(table, 'select * from %s where %s' % (table, where), params)
+
+	def addDistinct(self, table, column):
+		"""
+		Keep one row of table for each distinct value in column
+		"""
+		return self._keep(table, 'select distinct on (%s) * from %s order by %s' % \
+			(column, table, column))
+
+	def values(self, table, column):
+		"""
+		Return the set of (non-null) values kept in table.column
+		"""
+		names = [ name for (name, kind) in self.describe(table) ]
+		i = names.index(column)
+		return set([ row[i] for row in self.rows[table] if row[i] is not None ])
+
+	def describe(self, table):
+		"""
+		Return the (column, kind) pairs of table, in order
+		"""
+		if table not in self.columns:
+			results = datatest.runQuery('''select column_name, data_type
+				from information_schema.columns
+				where table_name = %s
+					and table_schema not in ('pg_catalog', 'information_schema')
+				order by ordinal_position''', [table], cache=False)
+			columns = OrderedDict()
+			for row in results:
+				name = row['column_name'].lower()
+				if name not in columns:
+					columns[name] = KINDS.get(row['data_type'], 'str')
+			if not columns:
+				raise Exception('Unknown table: %s' % table)
+			self.columns[table] = columns.items()
+			self.rows[table] = OrderedDict()
+		return self.columns[table]
+
+	def write(self, directory, manifest):
+		"""
+		Write the tables kept to directory (one .npz file each),
+		then manifest.json with manifest plus the table layouts
+		"""
+		if not loadNumpy():
+			raise Exception('snapshots require numpy')
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		tables = OrderedDict()
+		for (table, columns) in self.columns.items():
+			rows = self.rows[table].keys()
+			arrays = {}
+			for (i, (name, kind)) in enumerate(columns):
+				values = [ row[i] for row in rows ]
+				nulls = [ value is None for value in values ]
+				arrays[name] = _toArray(values, kind)
+				if True in nulls:
+					arrays[name + '.null'] = numpy.array(nulls, dtype = numpy.bool_)
+			numpy.savez_compressed(os.path.join(directory, table + '.npz'), **arrays)
+			tables[table] = OrderedDict([ ('rows', len(rows)),
+				('columns', [ list(column) for column in columns ]) ])
+
+		manifest = OrderedDict(manifest)
+		manifest['tables'] = tables
+		fp = open(os.path.join(directory, MANIFEST), 'w')
+		json.dump(manifest, fp, indent = 1)
+		fp.close()
+
+	def writeFixtures(self, directory):
+		"""
+		Write the tables kept to directory as fixture files for
+		backends.SqliteBackend: schema.sql, creating them, and
+		one <table>.json each
+		"""
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		fp = open(os.path.join(directory, 'schema.sql'), 'w')
+		for (table, columns) in self.columns.items():
+			fp.write('create table %s (\n\t%s\n);\n\n' % (table,
+				',\n\t'.join([ '%s %s' % (name, SQLITE_TYPES[kind]) for (name, kind) in columns ])))
+		fp.close()
+
+		for (table, columns) in self.columns.items():
+			rows = [ [ _toJson(value, kind) for (value, (name, kind)) in zip(row, columns) ]
+				for row in self.rows[table] ]
+			fp = open(os.path.join(directory, table + '.json'), 'w')
+			json.dump(OrderedDict([ ('columns', [ name for (name, kind) in columns ]),
+				('rows', rows) ]), fp)
+			fp.close()
+
+	def _keep(self, table, query, params=None):
+		names = [ name for (name, kind) in self.describe(table) ]
+		results = datatest.runQuery(query, params, cache=False)
+		kept = self.rows[table]
+		lowered = []
+		for row in results:
+			row = dict([ (name.lower(), value) for (name, value) in row.items() ])
+			kept[tuple([ row.get(name) for name in names ])] = None
+			lowered.append(row)
+		return lowered
+
+class Store(backends.SqliteBackend):
+	"""
+	A snapshot (written by extract), loaded into an in-memory SQLite
+	database on first use, that runs queries in place of the real
+	database
+	"""
+
+	name = 'snapshot'
+
+	def __init__(self, directory):
+		backends.SqliteBackend.__init__(self)
+		self.directory = directory
+		self.login = ('snapshot', os.path.abspath(directory))
+		fp = open(os.path.join(directory, MANIFEST))
+		self.manifest = json.load(fp, object_pairs_hook = OrderedDict)
+		fp.close()
+
+	def source(self):
+		"""
+		Return the server..database the snapshot was taken from
+		"""
+		return self.manifest['source']
+
+	def describe(self):
+		return 'snapshot %s (of %s)' % (self.directory, self.source())
+
+	def load(self, connection):
+		"""
+		Load the tables (and index their key columns)
+		"""
+		if not loadNumpy():
+			raise Exception('snapshots require numpy')
+
+		for (table, layout) in self.manifest['tables'].items():
+			columns = [ (name, kind) for (name, kind) in layout['columns'] ]
+			connection.execute('create table %s (%s)' % (table,
+				', '.join([ '%s %s' % (name, SQLITE_TYPES[kind]) for (name, kind) in columns ])))
+
+			arrays = numpy.load(os.path.join(self.directory, table + '.npz'))
+			data = []
+			for (name, kind) in columns:
+				values = _fromArray(arrays[name], kind)
+				if (name + '.null') in arrays.files:
+					for (i, isNull) in enumerate(arrays[name + '.null']):
+						if isNull:
+							values[i] = None
+				data.append(values)
+			arrays.close()
+			connection.executemany('insert into %s values (%s)' % (table, ', '.join([ '?' ] * len(columns))),
+				zip(*data))
+		backends.indexKeys(connection)
+
+### methods ###
+
+def extract(directory, accIDs, suites, fixtures=False):
+	"""
+	Copy the rows read by the named suites, which use the SNPs
+	identified by accIDs, from the current database to a snapshot
+	in directory (or, if fixtures is True, to fixture files)
+	"""
+	start = time.time()
+	snapshot = Extractor()
+
+	# the named SNPs, their sub SNPs, and the consensus SNPs of named sub SNPs
+	consensusKeys = set()
+	subKeys = set()
+	for row in snapshot.add('snp_accession', '_MGIType_key = any(%s) and accID = any(%s)',
+			[ [ CONSENSUS_SNP_TYPE, SUB_SNP_TYPE ], sorted(accIDs) ]):
+		if row['_mgitype_key'] == CONSENSUS_SNP_TYPE:
+			consensusKeys.add(row['_object_key'])
+		else:
+			subKeys.add(row['_object_key'])
+	for row in snapshot.add('snp_subsnp', '_SubSnp_key = any(%s)', [ sorted(subKeys) ]):
+		consensusKeys.add(row['_consensussnp_key'])
+	for row in snapshot.add('snp_subsnp', '_ConsensusSnp_key = any(%s)', [ sorted(consensusKeys) ]):
+		subKeys.add(row['_subsnp_key'])
+
+	snapshot.add('snp_accession', '_MGIType_key = %s and _Object_key = any(%s)',
+		[ CONSENSUS_SNP_TYPE, sorted(consensusKeys) ])
+	snapshot.add('snp_accession', '_MGIType_key = %s and _Object_key = any(%s)',
+		[ SUB_SNP_TYPE, sorted(subKeys) ])
+	for table in [ 'snp_consensussnp', 'snp_flank', 'snp_consensussnp_strainallele',
+			'snp_coord_cache', 'snp_consensussnp_marker' ]:
+		snapshot.add(table, '_ConsensusSnp_key = any(%s)', [ sorted(consensusKeys) ])
+	snapshot.add('snp_subsnp_strainallele', '_SubSnp_key = any(%s)', [ sorted(subKeys) ])
+
+	# one row per distinct value of the columns checked across whole tables
+	for (table, column) in DISTINCT_VALUES:
+		snapshot.addDistinct(table, column)
+
+	# the strains, populations, markers and transcripts those rows refer to
+	strainKeys = snapshot.values('snp_consensussnp_strainallele', '_mgdstrain_key') | \
+		snapshot.values('snp_subsnp_strainallele', '_mgdstrain_key')
+	snapshot.add('prb_strain', '_Strain_key = any(%s)', [ sorted(strainKeys) ])
+	snapshot.add('snp_population', '_Population_key = any(%s)',
+		[ sorted(snapshot.values('snp_subsnp_strainallele', '_population_key')) ])
+	markerKeys = snapshot.values('snp_consensussnp_marker', '_marker_key')
+	snapshot.add('mrk_marker', '_Marker_key = any(%s)', [ sorted(markerKeys) ])
+	snapshot.add('acc_accession', '_MGIType_key = %s and _Object_key = any(%s)',
+		[ MARKER_TYPE, sorted(markerKeys) ])
+	snapshot.add('snp_transcript_protein', '_Transcript_Protein_key = any(%s)',
+		[ sorted(snapshot.values('snp_consensussnp_marker', '_transcript_protein_key')) ])
+
+	# vocabularies: every term referred to, and all terms of VOCABULARIES
+	termKeys = set()
+	for (table, column) in DISTINCT_VALUES:
+		if column.endswith('_key'):
+			termKeys.update(snapshot.values(table, column))
+	snapshot.add('voc_vocab', '1 = 1')
+	snapshot.add('voc_vocabdag', '1 = 1')
+	snapshot.add('voc_term', '''_Term_key = any(%s)
+		or _Vocab_key in (select _Vocab_key from voc_vocab where name = any(%s))''',
+		[ sorted(termKeys), VOCABULARIES ])
+	snapshot.add('mgi_translation', '_TranslationType_key = any(%s)', [ TRANSLATION_TYPES ])
+
+	# IDs, synonyms and notes of the vocabularies' terms (so_vocab_test)
+	termKeys = sorted(snapshot.values('voc_term', '_term_key'))
+	snapshot.add('acc_accession', '_MGIType_key = %s and _Object_key = any(%s)', [ TERM_TYPE, termKeys ])
+	snapshot.add('mgi_synonymtype', '_MGIType_key = %s', [ TERM_TYPE ])
+	snapshot.add('mgi_synonym', '_SynonymType_key = any(%s) and _Object_key = any(%s)',
+		[ sorted(snapshot.values('mgi_synonymtype', '_synonymtype_key')), termKeys ])
+	snapshot.add('mgi_notetype', '_MGIType_key = %s', [ TERM_TYPE ])
+	snapshot.add('mgi_note', '_NoteType_key = any(%s) and _Object_key = any(%s)',
+		[ sorted(snapshot.values('mgi_notetype', '_notetype_key')), termKeys ])
+	snapshot.add('mgi_notechunk', '_Note_key = any(%s)',
+		[ sorted(snapshot.values('mgi_note', '_note_key')) ])
+
+	# the build, for data saved between runs (see databaseVersion)
+	snapshot.add('mgi_dbinfo', '1 = 1')
+
+	if fixtures:
+		snapshot.writeFixtures(directory)
+		return snapshot
+	snapshot.write(directory, [
+		('source', '%s..%s' % datatest.getLogin()),
+		('version', datatest.databaseVersion(cache=False)),
+		('created', time.strftime('%Y-%m-%d %H:%M:%S')),
+		('seconds', round(time.time() - start, 1)),
+		('suites', suites),
+		('accIDs', sorted(accIDs)),
+		])
+	return snapshot
+
+def loadNumpy():
+	"""
+	Import numpy (once); returns False if it is not installed
+	"""
+	global numpy
+	if numpy is None:
+		try:
+			import numpy
+		except ImportError:
+			return False
+	return True
+
+def _toArray(values, kind):
+	# a column's values (None for null) as a numpy array of the kind's type
+	if kind == 'int':
+		return numpy.array([ value or 0 for value in values ], dtype = numpy.int64)
+	if kind == 'float':
+		return numpy.array([ value is None and numpy.nan or float(value) for value in values ],
+			dtype = numpy.float64)
+	if kind == 'bool':
+		return numpy.array([ bool(value) for value in values ], dtype = numpy.bool_)
+	strings = []
+	for value in values:
+		if value is None:
+			value = u''
+		elif isinstance(value, str):
+			value = value.decode('utf-8')
+		elif not isinstance(value, unicode):
+			value = unicode(value)
+		strings.append(value)
+	return numpy.array(strings, dtype = numpy.unicode_)
+
+def _toJson(value, kind):
+	# a column value as written to a fixture file
+	if value is None:
+		return None
+	if kind == 'int':
+		return int(value)
+	if kind == 'float':
+		return float(value)
+	if kind == 'bool':
+		return bool(value)
+	if isinstance(value, str):
+		return value.decode('utf-8')
+	return unicode(value)
+
+def _fromArray(array, kind):
+	# a stored column as a list of Python values, as pg_db would return them
+	if kind == 'int':
+		return [ int(value) for value in array ]
+	if kind == 'float':
+		return [ float(value) for value in array ]
+	if kind == 'bool':
+		return [ bool(value) for value in array ]
+	return [ value.encode('utf-8') for value in array ]
@@ -1,15 +1,39 @@
 #!/usr/local/bin/python
 """
-Take a SNP ID (Consensus SNP or Sub SNP), look up the data in the database,
-	and print it out in a simple format.
+Take one or more SNP IDs (Consensus SNP or Sub SNP), look up the data in the
+	database, and print it out in a simple format.
+
+Usage: showSnpByID.py [--format text|json|ndjson] [--import-profile] snpID [snpID ...]
 """
 
 import sys
+
+# start timing before anything else is imported (optparse takes any unambiguous
+# prefix of an option, e.g. --import, so look for those too)
+if __name__ == '__main__' and [ arg for arg in sys.argv[1:]
+		if len(arg) > 2 and '--import-profile'.startswith(arg) ]:
+	from shared import importprofile
+	importprofile.start()
+
+from optparse import OptionParser
 from snp_tests import snplib
+from snp_tests import serializer
 
 if __name__ == '__main__':
-	snp = snplib.getSnpByID(sys.argv[1])
-	if not snp:
-		raise Exception('Uknown SNP ID: %s' % sys.argv[1])
+	parser = OptionParser(usage = 'Usage: %prog [--format text|json|ndjson] [--import-profile] snpID [snpID ...]')
+	parser.add_option('-f', '--format', choices = serializer.FORMATS, default = 'text',
+		help = 'output format: %s (default text)' % ', '.join(serializer.FORMATS))
+	parser.add_option('--import-profile', action = 'store_true', default = False,
+		help = 'report the time taken to import each module')
+	(options, snpIDs) = parser.parse_args()
+
+	if options.import_profile:
+		from shared import importprofile
+		importprofile.report()
+
+	snps = snplib.getSnpsByIDs(snpIDs)
+	for snpID in snpIDs:
+		if not snps[snpID]:
+			raise Exception('Uknown SNP ID: %s' % snpID)
 
-	snplib.printVerbose(snp)
\ No newline at end of file
+	serializer.serialize([ snps[snpID] for snpID in snpIDs ], sys.stdout, options.format)
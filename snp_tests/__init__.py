@@ -5,4 +5,5 @@ __all__ = [
 	"vocab_term_test",
 	"ss_id_test",
 	"consensus_alleles_test",
+	"genome_calls_test",
 ]
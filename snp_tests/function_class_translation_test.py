@@ -3,6 +3,8 @@ Test that translations from raw function classes to the MGI vocabulary are valid
 """
 
 import unittest
+import snplib
+import snpchecks
 from shared.datatest import DataTestCase, runQuery
 
 # constants
@@ -33,33 +35,16 @@ class FunctionClassTranslationTestCase(unittest.TestCase, DataTestCase):
 		"""
 		
 		for (rawFxnClass, snpID) in pairs:
-			cmd = '''select 1
-				from snp_accession
-				where _MGIType_key = 30
-					and accID = '%s'
-				limit 1''' % snpID
-			self.assertQueryCount(1, cmd, 'Unknown SNP ID : %s' % snpID, 'SNP data out of date?')
+			self.assertDataTrue(snplib.RESOLVER.exists(snpID, snplib.CONSENSUS_SNP_TYPE),
+				'Unknown SNP ID : %s' % snpID, 'SNP data out of date?')
 
-			cmd = '''select 1
-				from mgi_translation
-				where _TranslationType_key = 1014
-					and badName = '%s'
-				limit 1''' % rawFxnClass
-			self.assertQueryCount(1, cmd, 'Could not find translation record for: %s' % rawFxnClass, 'Missing a translation record?')
-			
-			cmd = '''select 1
-				from snp_accession a, snp_consensussnp_marker c, voc_term t, mgi_translation x
-				where a._MGIType_key = 30
-					and a.accID = '%s'
-					and a._Object_key = c._ConsensusSnp_key
-					and c._Fxn_key = t._Term_key
-					and t._Term_key = x._Object_key
-					and x._TranslationType_key = 1014
-					and x.badName = '%s'
-					limit 1''' % (snpID, rawFxnClass)
-			self.assertQueryCount(1, cmd, 'Function class mismatch for %s : %s' % (snpID, rawFxnClass))
+		# one query for all the pairs, of each kind
+		self.assertCheck(snpchecks.TRANSLATED_FUNCTION_CLASS, [ (rawFxnClass,) for (rawFxnClass, snpID) in pairs ])
+		self.assertCheck(snpchecks.SNP_FUNCTION_CLASS, pairs)
 
 def suite():
+	snplib.declareIDs([ snpID for (rawFxnClass, snpID) in pairs ])
+
 	suite = unittest.TestSuite()
 	suite.addTest(unittest.makeSuite(FunctionClassTranslationTestCase))
 	return suite
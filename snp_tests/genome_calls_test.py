@@ -0,0 +1,52 @@
+"""
+Genome-wide checks of the consensus SNP allele calls (see genomecalls.py).
+These read every call in the release, so they only run when DATATEST_GENOME_CALLS=1
+(and numpy is available).
+"""
+
+import os
+import unittest
+import genomecalls
+from shared import datatest
+from shared.datatest import DataTestCase
+
+###--- Globals ---###
+
+ENABLED = os.environ.get('DATATEST_GENOME_CALLS', '0') == '1'
+
+###--- Classes ---###
+
+class GenomeCallsTestCase(unittest.TestCase, DataTestCase):
+
+	def setUp(self):
+		if not ENABLED:
+			self.skipTest('set DATATEST_GENOME_CALLS=1 to run')
+		if not genomecalls.loadNumpy():
+			self.skipTest('numpy is not installed')
+
+	def testGenomeWideAlleleCalls(self):
+		"""
+		No SNP should lack Sanger calls, have only a C57BL/6J call, or have
+		more than genomecalls.MAX_DISTINCT_ALLELES distinct alleles.
+		"""
+		validator = genomecalls.GenomeCallValidator()
+		validator.run()
+		for line in validator.report():
+			datatest.log(line)
+		validator.writeReport()
+
+		failed = [ '%s: %d (e.g. %s)' % (check, validator.violations[check],
+				', '.join([ str(s) for s in validator.samples[check] ]))
+			for (check, description) in genomecalls.CHECKS if validator.violations[check] ]
+		self.assertDataTrue(not failed, 'Genome-wide allele call violations: %s' % '; '.join(failed),
+			'SNP data out of date?')
+
+###--- Functions ---###
+
+def suite():
+	suite = unittest.TestSuite()
+	suite.addTest(unittest.makeSuite(GenomeCallsTestCase))
+	return suite
+
+if __name__ == '__main__':
+	unittest.main()
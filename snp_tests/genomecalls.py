@@ -0,0 +1,328 @@
+# Name: genomecalls.py
+# Purpose: genome-wide checks of the consensus SNP allele calls.  The calls for
+#	one chromosome at a time are streamed from snp_consensussnp_strainallele
+#	into a NumPy matrix (one row per SNP, one column per strain in
+#	SANGER_STRAINS order), and each check runs over the whole matrix at once.
+# Usage: genomecalls.py [chromosome ...]
+#	prints the summary for the given chromosomes (default: all), and writes
+#	it to ${DATATEST_LOGDIR}/genomeCalls.json
+
+import os
+import sys
+import json
+import time
+
+# numpy is only needed here, so the rest of the tests can run without it.  It
+# is imported (by loadNumpy) when the checks run rather than with this module.
+numpy = None
+
+if __name__ == '__main__':
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared import datatest
+import snplib
+
+###--- constants ---###
+
+# SNPs with more distinct alleles than this (across the Sanger strains) are reported
+MAX_DISTINCT_ALLELES = 4
+
+# number of violating SNP IDs kept as a sample for each check
+SAMPLE_SIZE = 20
+
+# the checks, in report order, with a description of what each flags
+CHECKS = [
+	('noCalls', 'SNPs with no allele calls for any Sanger strain'),
+	('b6Only', 'SNPs whose only call is for C57BL/6J'),
+	('tooManyAlleles', 'SNPs with more than %d distinct alleles' % MAX_DISTINCT_ALLELES),
+	]
+
+# each consensus SNP is counted once, on the chromosome of its first location
+FIRST_LOCATION = '''c.chromosome = %s
+	and not exists (select 1
+		from snp_coord_cache p
+		where p._ConsensusSnp_key = c._ConsensusSnp_key
+			and p.sequenceNum < c.sequenceNum)'''
+
+###--- classes ---###
+
+class ChromosomeCalls:
+	# Is: the allele calls of the consensus SNPs on one chromosome
+	# Has: the sorted _ConsensusSnp_keys, a SNP x strain matrix of allele
+	#	codes (0 where there is no call), a matching matrix of conflict
+	#	flags, and the number of calls for strains outside SANGER_STRAINS
+	# Does: loads itself from the database in batches, without building
+	#	a Python object per call
+
+	def __init__ (self, chromosome, strainKeys, alleleCodes):
+		# 'strainKeys' is a sorted array of the _Strain_keys of SANGER_STRAINS
+		# and 'alleleCodes' maps each allele seen so far to its code (1-255);
+		# both are shared by all chromosomes
+		self.chromosome = chromosome
+		self.snpKeys = None
+		self.alleles = None
+		self.conflicts = None
+		self.otherStrainCalls = 0
+
+		self._load(strainKeys, alleleCodes)
+		return
+
+	def _load (self, strainKeys, alleleCodes):
+		cmd0 = '''select c._ConsensusSnp_key
+			from snp_coord_cache c
+			where ''' + FIRST_LOCATION
+		keys = []
+		for batch in datatest.streamQuery(cmd0, [ '_ConsensusSnp_key' ], [ self.chromosome ]):
+			keys.extend([ row[0] for row in batch ])
+		self.snpKeys = numpy.unique(numpy.array(keys, dtype = numpy.int64))
+		del keys
+
+		shape = (len(self.snpKeys), len(snplib.SANGER_STRAINS))
+		self.alleles = numpy.zeros(shape, dtype = numpy.uint8)
+		self.conflicts = numpy.zeros(shape, dtype = numpy.bool_)
+
+		# strainKeys is in SANGER_STRAINS order; columns maps its sorted order back
+		sortedStrains = numpy.argsort(strainKeys)
+		sortedKeys = strainKeys[sortedStrains]
+
+		cmd1 = '''select a._ConsensusSnp_key, a._mgdStrain_key, a.allele, a.isConflict
+			from snp_consensussnp_strainallele a, snp_coord_cache c
+			where a._ConsensusSnp_key = c._ConsensusSnp_key
+				and ''' + FIRST_LOCATION
+		columns = [ '_ConsensusSnp_key', '_mgdStrain_key', 'allele', 'isConflict' ]
+		for batch in datatest.streamQuery(cmd1, columns, [ self.chromosome ]):
+			(snpKeys, strains, alleles, conflicts) = zip(*batch)
+
+			# keep only the calls for SANGER_STRAINS
+			strains = numpy.array(strains, dtype = numpy.int64)
+			position = numpy.searchsorted(sortedKeys, strains).clip(0, len(sortedKeys) - 1)
+			isSanger = sortedKeys[position] == strains
+			self.otherStrainCalls = self.otherStrainCalls + int((~isSanger).sum())
+
+			rows = numpy.searchsorted(self.snpKeys, numpy.array(snpKeys, dtype = numpy.int64))[isSanger]
+			cols = sortedStrains[position[isSanger]]
+
+			# code each distinct allele in the batch once, then map the whole batch
+			(distinct, inverse) = numpy.unique(numpy.array(alleles, dtype = object).astype(str),
+				return_inverse = True)
+			codes = numpy.array([ _alleleCode(allele, alleleCodes) for allele in distinct ],
+				dtype = numpy.uint8)
+
+			self.alleles[rows, cols] = codes[inverse][isSanger]
+			self.conflicts[rows, cols] = numpy.array(conflicts, dtype = numpy.bool_)[isSanger]
+		return
+
+class GenomeCallValidator:
+	# Is: a genome-wide validation of the consensus SNP allele calls
+	# Has: for each check, the number of violating SNPs (in total and by
+	#	chromosome) and a sample of their keys; call and conflict counts
+	#	per strain; and the time taken
+	# Does: loads each chromosome's calls as a ChromosomeCalls matrix, runs
+	#	the vectorized checks over it, then resolves the sampled keys to
+	#	RefSNP IDs with one query and reports the results
+
+	def __init__ (self, sampleSize = SAMPLE_SIZE):
+		if not loadNumpy():
+			raise Exception('genome-wide call checks require numpy')
+
+		self.sampleSize = sampleSize
+		self.snpCount = 0
+		self.chromosomes = []
+		self.violations = {}		# check : number of violating SNPs
+		self.byChromosome = {}		# check : { chromosome : number of violating SNPs }
+		self.samples = {}		# check : list of _ConsensusSnp_keys (later, RefSNP IDs)
+		for (check, description) in CHECKS:
+			self.violations[check] = 0
+			self.byChromosome[check] = {}
+			self.samples[check] = []
+
+		self.callsPerStrain = numpy.zeros(len(snplib.SANGER_STRAINS), dtype = numpy.int64)
+		self.conflictsPerStrain = numpy.zeros(len(snplib.SANGER_STRAINS), dtype = numpy.int64)
+		self.otherStrainCalls = 0
+		self.seconds = 0.0
+
+		self.strainKeys = None
+		self.alleleCodes = {}
+		return
+
+	def run (self, chromosomes = None):
+		# check the given chromosomes (default: all of them)
+		start = time.time()
+		if self.strainKeys is None:
+			self.strainKeys = getStrainKeys()
+		if chromosomes is None:
+			chromosomes = getChromosomes()
+
+		for chromosome in chromosomes:
+			self.check(ChromosomeCalls(chromosome, self.strainKeys, self.alleleCodes))
+		self._resolveSamples()
+
+		self.seconds = self.seconds + time.time() - start
+		return
+
+	def check (self, calls):
+		# run every check over one ChromosomeCalls matrix
+		called = calls.alleles != 0
+		callCounts = called.sum(axis = 1)
+		b6 = snplib.SANGER_STRAINS.index('C57BL/6J')
+
+		# distinct non-zero codes per row: sort each row, then count the places a value first appears
+		ordered = numpy.sort(calls.alleles, axis = 1)
+		firsts = numpy.ones(ordered.shape, dtype = numpy.bool_)
+		firsts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+		distinctAlleles = (firsts & (ordered != 0)).sum(axis = 1)
+
+		flagged = {
+			'noCalls' : callCounts == 0,
+			'b6Only' : (callCounts == 1) & called[:, b6],
+			'tooManyAlleles' : distinctAlleles > MAX_DISTINCT_ALLELES,
+			}
+		for (check, description) in CHECKS:
+			violators = calls.snpKeys[flagged[check]]
+			self.violations[check] = self.violations[check] + len(violators)
+			self.byChromosome[check][calls.chromosome] = len(violators)
+			room = self.sampleSize - len(self.samples[check])
+			if room > 0:
+				self.samples[check].extend([ int(key) for key in violators[:room] ])
+
+		self.snpCount = self.snpCount + len(calls.snpKeys)
+		self.chromosomes.append(calls.chromosome)
+		self.callsPerStrain += called.sum(axis = 0)
+		self.conflictsPerStrain += (calls.conflicts & called).sum(axis = 0)
+		self.otherStrainCalls = self.otherStrainCalls + calls.otherStrainCalls
+		return
+
+	def _resolveSamples (self):
+		# replace the sampled keys with RefSNP IDs
+		keys = []
+		for (check, description) in CHECKS:
+			keys.extend([ key for key in self.samples[check] if not isinstance(key, basestring) ])
+		if not keys:
+			return
+
+		cmd0 = '''select _Object_key, accID
+			from snp_accession
+			where _MGIType_key = %s
+				and _LogicalDB_key = %s
+				and _Object_key = any(%s)'''
+		accIDs = {}
+		for row in datatest.runQuery(cmd0, [ snplib.CONSENSUS_SNP_TYPE, snplib.REFSNP_LDB, keys ]):
+			accIDs.setdefault(row['_Object_key'], row['accID'])
+
+		for (check, description) in CHECKS:
+			self.samples[check] = [ accIDs.get(key, key) for key in self.samples[check] ]
+		return
+
+	def conflictRate (self):
+		# fraction of Sanger strain calls flagged as conflicts
+		calls = self.callsPerStrain.sum()
+		if not calls:
+			return 0.0
+		return float(self.conflictsPerStrain.sum()) / calls
+
+	def summary (self):
+		# returns the results as a dictionary (as written to genomeCalls.json)
+		strains = []
+		for (i, strain) in enumerate(snplib.SANGER_STRAINS):
+			calls = int(self.callsPerStrain[i])
+			conflicts = int(self.conflictsPerStrain[i])
+			strains.append({
+				'strain' : strain,
+				'calls' : calls,
+				'conflicts' : conflicts,
+				'conflictRate' : calls and float(conflicts) / calls or 0.0,
+				})
+
+		checks = []
+		for (check, description) in CHECKS:
+			checks.append({
+				'check' : check,
+				'description' : description,
+				'violations' : self.violations[check],
+				'byChromosome' : self.byChromosome[check],
+				'sample' : self.samples[check],
+				})
+
+		return {
+			'snps' : self.snpCount,
+			'chromosomes' : self.chromosomes,
+			'seconds' : round(self.seconds, 3),
+			'conflictRate' : self.conflictRate(),
+			'otherStrainCalls' : self.otherStrainCalls,
+			'checks' : checks,
+			'strains' : strains,
+			}
+
+	def report (self):
+		# returns the summary as lines of text
+		lines = [ 'Genome-wide allele calls: %d SNPs on %d chromosomes in %.1fs' % (
+			self.snpCount, len(self.chromosomes), self.seconds) ]
+		for (check, description) in CHECKS:
+			lines.append('\t%s: %d' % (description, self.violations[check]))
+			if self.samples[check]:
+				lines.append('\t\te.g. %s' % ', '.join([ str(s) for s in self.samples[check] ]))
+		lines.append('\tconflict rate: %.4f%% of %d calls' % (
+			100.0 * self.conflictRate(), self.callsPerStrain.sum()))
+		return lines
+
+	def writeReport (self, logDir = datatest.LOGDIR):
+		# write the summary to genomeCalls.json in 'logDir'; returns the path, or None
+		if not logDir:
+			return None
+		path = os.path.join(logDir, 'genomeCalls.json')
+		fp = open(path, 'w')
+		json.dump(self.summary(), fp, indent = 1, sort_keys = True)
+		fp.close()
+		return path
+
+###--- functions ---###
+
+def loadNumpy():
+	# imports numpy (once); returns False if it is not installed
+	global numpy
+	if numpy is None:
+		try:
+			import numpy
+		except ImportError:
+			return False
+	return True
+
+def getChromosomes():
+	# returns the chromosomes with consensus SNP locations
+	cmd0 = '''select distinct chromosome
+		from snp_coord_cache
+		order by chromosome'''
+	return [ row['chromosome'] for row in datatest.runQuery(cmd0) ]
+
+def getStrainKeys():
+	# returns an array of the _Strain_keys of SANGER_STRAINS, in the same order
+	cmd0 = '''select _Strain_key, strain
+		from prb_strain
+		where strain = any(%s)'''
+	keys = {}
+	for row in datatest.runQuery(cmd0, [ snplib.SANGER_STRAINS ]):
+		keys[row['strain']] = row['_Strain_key']
+
+	missing = [ strain for strain in snplib.SANGER_STRAINS if strain not in keys ]
+	if missing:
+		raise Exception('Unknown strains: %s' % ', '.join(missing))
+	return numpy.array([ keys[strain] for strain in snplib.SANGER_STRAINS ], dtype = numpy.int64)
+
+def _alleleCode(allele, alleleCodes):
+	# returns the code (1-255) for 'allele', assigning the next one if it is new
+	if allele not in alleleCodes:
+		if len(alleleCodes) >= 255:
+			raise Exception('More than 255 distinct alleles')
+		alleleCodes[allele] = len(alleleCodes) + 1
+	return alleleCodes[allele]
+
+###--- main program ---###
+
+if __name__ == '__main__':
+	validator = GenomeCallValidator()
+	validator.run(sys.argv[1:] or None)
+	for line in validator.report():
+		print line
+	path = validator.writeReport()
+	if path:
+		print 'Written to %s' % path
@@ -2,9 +2,46 @@
 Tests involving SNP locations (chromosome + coordinate)
 """
 
+import os
 import unittest
-from shared.datatest import DataTestCase, runQuery
+from shared.datatest import DataTestCase
 import snplib
+import snpchecks
+
+# constants
+
+# checking the genome-wide coordinate index (snplib.COORDINATES) means building it, with a
+# pass over all of snp_coord_cache, so it only runs when DATATEST_COORDINATE_INDEX=1
+COORDINATE_INDEX = os.environ.get('DATATEST_COORDINATE_INDEX', '0') == '1'
+
+# (RefSNP ID, expected chromosome)
+chromosomeSnps = [
+	('rs584021049', '19'),
+	('rs214952642', '19'),
+	('rs580281772', '19'),
+	('rs218600550', '19'),
+	('rs587592675', '19'),
+	('rs587462797', '19'),
+	('rs217725902', '19'),
+	('rs49051912', '19'),
+	('rs13460870', '19'),
+	('rs586861309', '19'),
+	('rs581684779', '19'),
+	('rs587233094', '19'),
+	('rs234882546', '19'),
+	('rs228894858', '19'),
+	('rs52155783', '19'),
+	('rs586195285', '18'),
+	('rs247969879', '18'),
+	('rs45734785', '19'),
+	]
+
+# (RefSNP ID, expected chromosome, expected start coordinate)
+coordinateSnps = [
+	('rs586195285', '18', 3000024),
+	('rs247969879', '18', 3000323),
+	('rs45734785', '19', 53244501),
+	]
 
 class LocationTestCase(unittest.TestCase, DataTestCase):
 	def testChromosomesHaveSnps(self):
@@ -17,37 +54,21 @@ class LocationTestCase(unittest.TestCase, DataTestCase):
 		# doing the query this way rather than iterating over chromosomes is only 1 table scan
 		cmd = '''select distinct chromosome
 				from snp_coord_cache
-				where chromosome in ('%s')''' % "', '".join(chromosomes)
+				where chromosome = any(%s)'''
 		
-		self.assertQueryCount(len(chromosomes), cmd, 'Some chromosomes do not have SNPs', 'Missing data files?')
+		self.assertQueryCount(len(chromosomes), cmd, 'Some chromosomes do not have SNPs', 'Missing data files?',
+			params=[chromosomes])
 			
 	def testJustChromosomes(self):
 		"""
 		For a certain specified set of SNPs, ensure that they are on the expected chromosome.
 		"""
-		snps = [
-			('rs584021049', '19'),
-			('rs214952642', '19'),
-			('rs580281772', '19'),
-			('rs218600550', '19'),
-			('rs587592675', '19'),
-			('rs587462797', '19'),
-			('rs217725902', '19'),
-			('rs49051912', '19'),
-			('rs13460870', '19'),
-			('rs586861309', '19'),
-			('rs581684779', '19'),
-			('rs587233094', '19'),
-			('rs234882546', '19'),
-			('rs228894858', '19'),
-			('rs52155783', '19'),
-			('rs586195285', '18'),
-			('rs247969879', '18'),
-			('rs45734785', '19'),
-			]
-		
+		snps = chromosomeSnps
+
+		with self.assertMaxQueries(snplib.MAX_LOAD_QUERIES, 'Loading SNPs is not set-based'):
+			snpsByID = snplib.getSnpsByIDs([snpID for (snpID, chromosome) in snps], include = ('locations',))
 		for (snpID, chromosome) in snps:
-			snp = snplib.getSnpByID(snpID)
+			snp = snpsByID[snpID]
 			self.assertDataTrue(snp != None, 'Unknown SNP ID: %s' % snpID, 'SNP data out of date?')
 			
 			# ensure the SNP has at least one location
@@ -64,28 +85,52 @@ class LocationTestCase(unittest.TestCase, DataTestCase):
 		"""
 		For a certain specified set of SNPs, check chromosome + coordinate assignments.
 		"""
-		snps = [
-			('rs586195285', '18', 3000024),
-			('rs247969879', '18', 3000323),
-			('rs45734785', '19', 53244501),
-			]
-
-		for (snpID, chrom, coord) in snps:
-			snp = snplib.getSnpByID(snpID)
-			self.assertDataTrue(snp != None, 'Unknown SNP ID: %s' % snpID, 'SNP data out of date?')
-			
-			# ensure the SNP has at least one location
-			self.assertNotEmpty(snp.locations, 'SNP has no locations: %s' % snpID)
-			
-			found = False
-			for location in snp.locations:
-				if location.chromosome == chrom:
-					if int(location.startCoordinate) == coord:
-						found = True
-					
-			self.assertDataTrue(found, 'SNP %s is not at Chr%s:%d' % (snpID, chrom, coord))
+		for (snpID, chrom, coord) in coordinateSnps:
+			self.assertDataTrue(snplib.RESOLVER.exists(snpID, snplib.CONSENSUS_SNP_TYPE),
+				'Unknown SNP ID: %s' % snpID, 'SNP data out of date?')
+
+		self.assertCheck(snpchecks.SNP_COORDINATE, coordinateSnps)
+
+	def testRegions(self):
+		"""
+		For the same SNPs, check that region and nearest-SNP queries find each one, using a
+		coordinate index of just their chromosomes.
+		"""
+		index = snplib.CoordinateIndex(chromosomes = [ chrom for (snpID, chrom, coord) in coordinateSnps ])
+		for (snpID, chrom, coord) in coordinateSnps:
+			objKey = snplib.RESOLVER.lookup(snpID)
+			self.assertDataTrue(objKey != None, 'Unknown SNP ID: %s' % snpID, 'SNP data out of date?')
+
+			keys = [ key for (coordinate, key) in snplib.snpsInRegion(chrom, coord - 1, coord + 1, index) ]
+			self.assertDataTrue(objKey[1] in keys, 'Region query does not find %s at Chr%s:%d' % (snpID, chrom, coord),
+				'SNP coordinate cache out of date?')
+			self.assertDataEquals(len(keys), snplib.countSnpsInRegion(chrom, coord - 1, coord + 1, index),
+				'Region count does not match the region query at Chr%s:%d' % (chrom, coord))
+
+			nearest = snplib.nearestSnps(chrom, coord, len(keys), index)
+			self.assertDataTrue(objKey[1] in [ key for (coordinate, key) in nearest ],
+				'%s is not nearest to Chr%s:%d' % (snpID, chrom, coord), 'SNP coordinate cache out of date?')
+
+	def testRegionIndex(self):
+		"""
+		For the same SNPs, check that the genome-wide coordinate index (snplib.COORDINATES)
+		finds each one.
+		"""
+		if not COORDINATE_INDEX:
+			self.skipTest('set DATATEST_COORDINATE_INDEX=1 to run')
+
+		for (snpID, chrom, coord) in coordinateSnps:
+			objKey = snplib.RESOLVER.lookup(snpID)
+			self.assertDataTrue(objKey != None, 'Unknown SNP ID: %s' % snpID, 'SNP data out of date?')
+
+			keys = [ key for (coordinate, key) in snplib.snpsInRegion(chrom, coord - 1, coord + 1) ]
+			self.assertDataTrue(objKey[1] in keys, 'Region query does not find %s at Chr%s:%d' % (snpID, chrom, coord),
+				'SNP coordinate cache out of date?')
 
 def suite():
+	snplib.declareIDs([ snpID for (snpID, chromosome) in chromosomeSnps ])
+	snplib.declareIDs([ snpID for (snpID, chrom, coord) in coordinateSnps ])
+
 	suite = unittest.TestSuite()
 	suite.addTest(unittest.makeSuite(LocationTestCase))
 	return suite
@@ -0,0 +1,349 @@
+# Name: serializer.py
+# Purpose: write ConsensusSnp and SubSnp objects (and the objects they contain)
+#	as text, JSON, or NDJSON (one JSON document per line).  Each class has an
+#	explicit list of the fields written, the object graph is walked with a
+#	stack rather than recursion, and output is collected in a buffer that is
+#	written out in large chunks.
+
+import sys
+import json
+import types
+from collections import OrderedDict
+import snplib
+
+###--- constants ---###
+
+FORMATS = [ 'text', 'json', 'ndjson' ]
+
+# characters collected before the buffer is written out
+BUFFER_SIZE = 65536
+
+# (label, attribute) of the fields written for each class, in order
+FIELDS = {
+	snplib.ConsensusSnp : [
+		('accID', 'accID'),
+		('consensusSnpKey', 'consensusSnpKey'),
+		('variationType', 'variationType'),
+		('alleleSummary', 'alleleSummary'),
+		('iupacCode', 'iupacCode'),
+		('createdInBuild', 'createdInBuild'),
+		('updatedInBuild', 'updatedInBuild'),
+		('orientation', 'orientation'),
+		('isMultiCoord', 'isMultiCoord'),
+		('flankBefore', 'flankBefore'),
+		('flankAfter', 'flankAfter'),
+		('alleleCalls', 'strainCalls'),
+		('locations', 'locations'),
+		('subSnps', 'subSnps'),
+		],
+	snplib.ConsensusSnpLocation : [
+		('coordCacheKey', 'coordCacheKey'),
+		('chromosome', 'chromosome'),
+		('startCoordinate', 'startCoordinate'),
+		('strand', 'strand'),
+		('isMultiCoord', 'isMultiCoord'),
+		('variationType', 'variationType'),
+		('alleleSummary', 'alleleSummary'),
+		('iupacCode', 'iupacCode'),
+		('markers', 'markers'),
+		],
+	snplib.ConsensusSnpMarker : [
+		('consensusSnpMarkerKey', 'consensusSnpMarkerKey'),
+		('markerKey', 'markerKey'),
+		('markerSymbol', 'markerSymbol'),
+		('markerID', 'markerID'),
+		('functionClass', 'functionClass'),
+		('contigAllele', 'contigAllele'),
+		('residue', 'residue'),
+		('aaPosition', 'aaPosition'),
+		('readingFrame', 'readingFrame'),
+		('distanceFrom', 'distanceFrom'),
+		('distanceDirection', 'distanceDirection'),
+		('transcriptID', 'transcriptID'),
+		('proteinID', 'proteinID'),
+		],
+	snplib.SubSnp : [
+		('accID', 'accID'),
+		('subSnpKey', 'subSnpKey'),
+		('variationType', 'variationType'),
+		('orientation', 'orientation'),
+		('isExemplar', 'isExemplar'),
+		('alleleSummary', 'alleleSummary'),
+		('alleleCalls', 'strainCalls'),
+		],
+	}
+
+# the section of a SNP (see snplib.SECTIONS) each optional field belongs to, by label;
+# fields of sections not included are left out (see Serializer)
+SECTION_FIELDS = {
+	'flankBefore' : 'flanks',
+	'flankAfter' : 'flanks',
+	'alleleCalls' : 'alleleCalls',
+	'locations' : 'locations',
+	'subSnps' : 'subSnps',
+	}
+
+# label for the detail value of each allele call, by the class owning the calls
+CALL_DETAILS = {
+	snplib.ConsensusSnp : 'isConflict',
+	snplib.SubSnp : 'population',
+	}
+
+# the json module's (C) string encoder
+_encodeString = json.encoder.encode_basestring_ascii
+
+SCALAR_TYPES = (types.NoneType, types.BooleanType, types.IntType, types.LongType,
+	types.FloatType, types.StringType, types.UnicodeType)
+
+# events produced by walk()
+SCALAR = 0
+OPEN = 1
+CLOSE = 2
+
+###--- classes ---###
+
+class BufferedWriter:
+	# Is: an output buffer
+	# Has: the stream written to, and the pieces written since the last flush
+	# Does: collects small writes and passes them to the stream in
+	#	chunks of at least 'size' characters
+
+	def __init__ (self, out, size = BUFFER_SIZE):
+		self.out = out
+		self.size = size
+		self.pieces = []
+		self.length = 0
+		return
+
+	def write (self, s):
+		if isinstance(s, types.UnicodeType):
+			s = s.encode('utf-8')
+		self.pieces.append(s)
+		self.length = self.length + len(s)
+		if self.length >= self.size:
+			self.flush()
+		return
+
+	def flush (self):
+		if self.pieces:
+			self.out.write(''.join(self.pieces))
+			self.pieces = []
+			self.length = 0
+		return
+
+class TextWriter:
+	# Is: the plain-text output format (used by printVerbose)
+	# Has: the sections of each SNP written (None for all)
+	# Does: writes one line per value, indented by nesting level
+
+	def __init__ (self, buffer, indentCount = 0, include = None):
+		self.buffer = buffer
+		self.indentCount = indentCount
+		self.include = include
+		self.depth = 0
+		return
+
+	def begin (self):
+		return
+
+	def write (self, obj, tail = ''):
+		write = self.buffer.write
+		for event in walk(obj, self.include):
+			indent = '\t' * (self.indentCount + self.depth)
+			if event[0] == SCALAR:
+				(kind, name, value) = event
+				if name is None:
+					write('%s%s,\n' % (indent, _text(value)))
+				else:
+					write('%s%s:  %s,\n' % (indent, name, _text(value)))
+			elif event[0] == OPEN:
+				(kind, name, opener) = event
+				if name is None:
+					write('%s%s\n' % (indent, opener))
+				else:
+					write('%s%s:  %s\n' % (indent, name, opener))
+				self.depth = self.depth + 1
+			else:
+				self.depth = self.depth - 1
+				if self.depth:
+					write('%s%s,\n' % ('\t' * (self.indentCount + self.depth), event[1]))
+				else:
+					write('%s%s%s\n' % ('\t' * self.indentCount, event[1], tail))
+		return
+
+	def end (self):
+		return
+
+class JsonWriter:
+	# Is: the JSON and NDJSON output formats
+	# Has: whether to write one document per line (NDJSON) or a single
+	#	JSON array of all objects written, and the sections of each SNP
+	#	written (None for all)
+	# Does: writes compact JSON, keeping a stack of "first item" flags
+	#	(in place of recursion) to know where commas go
+
+	def __init__ (self, buffer, lines = False, include = None):
+		self.buffer = buffer
+		self.lines = lines
+		self.include = include
+		self.count = 0
+		return
+
+	def begin (self):
+		if not self.lines:
+			self.buffer.write('[')
+		return
+
+	def write (self, obj, tail = ''):
+		write = self.buffer.write
+		if self.count and not self.lines:
+			write(',\n')
+		self.count = self.count + 1
+
+		labels = _LABELS
+		first = [ True ]
+		for event in walk(obj, self.include):
+			if event[0] == CLOSE:
+				first.pop()
+				write(event[1])
+				continue
+
+			if not first[-1]:
+				write(',')
+			first[-1] = False
+			if event[1] is not None:
+				if event[1] not in labels:
+					labels[event[1]] = _json(event[1]) + ':'
+				write(labels[event[1]])
+
+			if event[0] == SCALAR:
+				write(_json(event[2]))
+			else:
+				write(event[2])
+				first.append(True)
+
+		if self.lines:
+			write('\n')
+		return
+
+	def end (self):
+		if not self.lines:
+			self.buffer.write(']\n')
+		return
+
+class Serializer:
+	# Is: a writer of SNP objects in one of FORMATS
+	# Has: the buffered output stream and the writer for the format
+	# Does: writes each object given to write(); close() finishes the
+	#	document and flushes the buffer.  If 'include' lists SNP sections
+	#	(see snplib.SECTIONS), only those are written (so no others are
+	#	loaded to write them).
+
+	def __init__ (self, out = None, format = 'text', indentCount = 0, bufferSize = BUFFER_SIZE,
+			include = None):
+		if format not in FORMATS:
+			raise Exception('Unknown format: %s (expected one of %s)' % (format, ', '.join(FORMATS)))
+		self.buffer = BufferedWriter(out or sys.stdout, bufferSize)
+		if format == 'text':
+			self.writer = TextWriter(self.buffer, indentCount, include)
+		else:
+			self.writer = JsonWriter(self.buffer, format == 'ndjson', include)
+		self.writer.begin()
+		return
+
+	def write (self, obj, tail = ''):
+		self.writer.write(obj, tail)
+		return
+
+	def close (self):
+		self.writer.end()
+		self.buffer.flush()
+		return
+
+###--- functions ---###
+
+def serialize(objects, out = None, format = 'text', include = None):
+	# write each of 'objects' to 'out' (default: stdout) in the given format, with only
+	# the sections in 'include' (default: all)
+	serializer = Serializer(out, format, include = include)
+	for obj in objects:
+		serializer.write(obj)
+	serializer.close()
+	return
+
+def walk(obj, include = None):
+	# generates the events for writing 'obj', depth first and without recursion:
+	#	(SCALAR, label or None, value)
+	#	(OPEN, label or None, '{' or '[')
+	#	(CLOSE, '}' or ']')
+	# where the label is None for the top-level object and for list items.  Only
+	# the SNP sections in 'include' are written (default: all)
+	stack = [ (iter([ (None, obj) ]), None) ]
+	while stack:
+		(items, closer) = stack[-1]
+		try:
+			(name, value) = items.next()
+		except StopIteration:
+			stack.pop()
+			if closer:
+				yield (CLOSE, closer)
+			continue
+
+		if isinstance(value, SCALAR_TYPES):
+			yield (SCALAR, name, value)
+		elif type(value) in FIELDS:
+			yield (OPEN, name, '{')
+			stack.append( (_fields(value, include), '}') )
+		elif isinstance(value, (types.ListType, types.TupleType, types.GeneratorType)):
+			yield (OPEN, name, '[')
+			stack.append( (((None, item) for item in value), ']') )
+		elif isinstance(value, OrderedDict):
+			yield (OPEN, name, '{')
+			stack.append( (value.iteritems(), '}') )
+		elif isinstance(value, types.DictType):
+			yield (OPEN, name, '{')
+			stack.append( (iter(sorted(value.items())), '}') )
+		elif hasattr(value, '__dict__'):
+			# an object with no field list: its public, non-method attributes
+			yield (OPEN, name, '{')
+			stack.append( (iter([ (attr, attrValue) for (attr, attrValue) in sorted(vars(value).items())
+				if not attr.startswith('_') and not callable(attrValue) ]), '}') )
+		else:
+			yield (SCALAR, name, str(value))
+	return
+
+def _fields(obj, include = None):
+	# generates (label, value) for the fields of 'obj', per FIELDS, leaving out those
+	# of SNP sections not in 'include' (if given)
+	for (label, attr) in FIELDS[type(obj)]:
+		if (include is not None) and (label in SECTION_FIELDS) and \
+				(SECTION_FIELDS[label] not in include):
+			continue
+		value = getattr(obj, attr)
+		if isinstance(value, snplib.StrainCalls):
+			# one small dictionary per call, made only as it is written
+			detail = CALL_DETAILS[type(obj)]
+			yield (label, (OrderedDict([ ('strain', strain), ('allele', allele), (detail, callDetail) ])
+				for (strain, allele, callDetail) in value.items()))
+		else:
+			yield (label, value)
+	return
+
+def _text(value):
+	if value is None:
+		return 'null'
+	if isinstance(value, types.UnicodeType):
+		return value.encode('utf-8')
+	return str(value)
+
+# encoded "label": for each field label seen
+_LABELS = {}
+
+def _json(value):
+	if isinstance(value, types.StringTypes):
+		return _encodeString(value)
+	if isinstance(value, (types.BooleanType, types.NoneType, types.FloatType)):
+		return json.dumps(value)
+	if isinstance(value, (types.IntType, types.LongType)):
+		return str(value)
+	return _encodeString(str(value))
@@ -0,0 +1,82 @@
+# Name: snpchecks.py
+# Purpose: kinds of table-driven checks of SNP data, for DataTestCase.assertCheck.  Each
+#	checks a whole table of expectations with one query, returning only those that do
+#	not hold, so expectations can be added to a test without adding queries.
+
+from shared import datatest
+
+###--- check kinds ---###
+
+# (raw function class) : a translation to the MGI function class vocabulary exists
+TRANSLATED_FUNCTION_CLASS = datatest.CheckKind('Function class translations',
+	[ ('rawFxnClass', 'text') ],
+	'''select distinct e.rawFxnClass
+		from expected e
+		where not exists (select 1
+			from mgi_translation x
+			where x._TranslationType_key = 1014
+				and x.badName = e.rawFxnClass)''',
+	'Could not find translation record for: %(rawFxnClass)s',
+	'Missing a translation record?')
+
+# (raw function class, RefSNP ID) : the SNP has a marker association with the MGI function
+# class the raw one translates to
+SNP_FUNCTION_CLASS = datatest.CheckKind('Function classes of SNPs',
+	[ ('rawFxnClass', 'text'), ('snpID', 'text') ],
+	'''select distinct e.rawFxnClass, e.snpID
+		from expected e
+		where not exists (select 1
+			from snp_accession a, snp_consensussnp_marker c, voc_term t, mgi_translation x
+			where a._MGIType_key = 30
+				and a.accID = e.snpID
+				and a._Object_key = c._ConsensusSnp_key
+				and c._Fxn_key = t._Term_key
+				and t._Term_key = x._Object_key
+				and x._TranslationType_key = 1014
+				and x.badName = e.rawFxnClass)''',
+	'Function class mismatch for %(snpID)s : %(rawFxnClass)s')
+
+# (RefSNP ID, SS ID) : the consensus SNP has exactly one sub SNP, with the given ID
+SOLE_SUB_SNP = datatest.CheckKind('Sub SNPs of consensus SNPs',
+	[ ('consensusSnpID', 'text'), ('subSnpID', 'text') ],
+	'''select e.consensusSnpID, e.subSnpID, count(ss._SubSnp_key) as subSnps,
+			count(ssa._Object_key) as matching
+		from expected e
+		left outer join snp_accession a on (a._MGIType_key = 30
+			and a.accID = e.consensusSnpID)
+		left outer join snp_subsnp ss on (a._Object_key = ss._ConsensusSnp_key)
+		left outer join snp_accession ssa on (ss._SubSnp_key = ssa._Object_key
+			and ssa._MGIType_key = 31
+			and ssa.accID = e.subSnpID)
+		group by e.consensusSnpID, e.subSnpID
+		having count(ss._SubSnp_key) != 1
+			or count(ssa._Object_key) != 1''',
+	'%(consensusSnpID)s has %(subSnps)d sub SNP(s), %(matching)d of them %(subSnpID)s (expected only %(subSnpID)s)')
+
+# (RefSNP ID, chromosome, start coordinate) : the SNP has a location at that coordinate
+SNP_COORDINATE = datatest.CheckKind('Coordinates of SNPs',
+	[ ('snpID', 'text'), ('chromosome', 'text'), ('startCoordinate', 'integer') ],
+	'''select e.snpID, e.chromosome, e.startCoordinate, count(c._Coord_Cache_key) as locations
+		from expected e
+		left outer join snp_accession a on (a._MGIType_key = 30
+			and a.accID = e.snpID)
+		left outer join snp_coord_cache c on (a._Object_key = c._ConsensusSnp_key)
+		group by e.snpID, e.chromosome, e.startCoordinate
+		having sum(case when c.chromosome = e.chromosome
+			and c.startCoordinate = e.startCoordinate then 1 else 0 end) = 0''',
+	'SNP %(snpID)s is not at Chr%(chromosome)s:%(startCoordinate)d (it has %(locations)d location(s))')
+
+# (RefSNP ID, number of alleles) : the consensus SNP's allele calls have that many distinct
+# alleles (counting a null allele as one)
+ALLELE_COUNT = datatest.CheckKind('Allele counts of SNPs',
+	[ ('snpID', 'text'), ('alleleCount', 'integer') ],
+	'''select e.snpID, e.alleleCount, count(d.accID) as alleles
+		from expected e
+		left outer join (select distinct a.accID, s.allele
+			from expected x, snp_accession a, snp_consensussnp_strainallele s
+			where a._MGIType_key = 30
+				and a.accID = x.snpID
+				and a._Object_key = s._ConsensusSnp_key) d on (d.accID = e.snpID)
+		group by e.snpID, e.alleleCount
+		having count(d.accID) != e.alleleCount''',
+	'Wrong number of alleles for SNP ID : %(snpID)s (%(alleles)d, expected %(alleleCount)d)')
@@ -1,8 +1,16 @@
 # Name: snplib.py
 # Purpose: general-purpose functions and classes to aid writing SNP tests
 
+import os
+import sys
+import array
+import bisect
+import cPickle
+import hashlib
+import threading
 import types
-import pg_db
+from collections import OrderedDict
+from shared import datatest
 
 ###--- constants ---###
 
@@ -57,16 +65,198 @@ SANGER_STRAINS = [
 	'C57BL/6J',
 	]
 
+# load the sections of a set of SNPs (allele calls, locations, sub SNPs, etc.) at the same
+# time, each on its own pooled connection, rather than one after another
+CONCURRENT_LOADING = os.environ.get('DATATEST_SNP_CONCURRENT', '0') == '1'
+
+# most queries getSnpsByIDs issues, for any number of IDs: one to resolve the IDs and one
+# for each section of the SNPs (see _loadConsensusSnps and _loadSubSnps)
+MAX_LOAD_QUERIES = 10
+
+# optional sections of a SNP that getSnpsByIDs can load (see its 'include'), and the
+# attribute each fills in; sections not loaded are loaded lazily if used.  Allele calls
+# are those of the consensus SNPs and of any sub SNPs loaded.
+SECTIONS = [ 'flanks', 'alleleCalls', 'locations', 'subSnps' ]
+SECTION_ATTRIBUTES = {
+	'flanks' : 'flankBefore',
+	'alleleCalls' : 'strainCalls',
+	'locations' : 'locations',
+	'subSnps' : 'subSnps',
+	}
+
+# maximum number of accession IDs the AccessionResolver remembers
+MAX_RESOLVED = 100000
+
+# allele stored for a strain with no call
+NO_CALL = ' '
+
+# maximum number of SNP objects held in the run-scoped cache used by getSnpByID and
+# getSnpsByIDs; 0 disables caching
+DEFAULT_CACHE_SIZE = int(os.environ.get('DATATEST_SNP_CACHE_SIZE', '5000'))
+
 ###--- classes ---###
 
-class ConsensusSnp:
+class LazyAttribute (object):
+	# Is: a descriptor for an attribute of a SNP object that is only loaded
+	#	from the database when it is first accessed
+	# Has: the name of the attribute and of the method that loads it
+	# Does: on the first read, calls the loader method (which must set the
+	#	attribute on the object).  The loaded value then lives in the
+	#	object's own __dict__ and hides this descriptor, so later reads
+	#	(and values assigned directly, as by getSnpsByIDs) issue no queries.
+
+	def __init__ (self, name, loaderName):
+		self.name = name
+		self.loaderName = loaderName
+		return
+
+	def __get__ (self, obj, objType = None):
+		if obj is None:
+			return self
+		getattr(obj, self.loaderName)()
+		return obj.__dict__[self.name]
+
+class StrainIndex:
+	# Is: the mapping from strain name to position in a StrainCalls row
+	# Has: the strain names in position order; SANGER_STRAINS come first, in
+	#	order, and any other strain is given the next position when its
+	#	first call is loaded
+	# Does: converts between strain names and positions in constant time
+
+	def __init__ (self, strains):
+		self.names = []
+		self.positions = {}
+		self.lock = threading.Lock()	# for sections loading calls at the same time
+		for strain in strains:
+			self.position(strain, True)
+		return
+
+	def position (self, strain, add = False):
+		# returns the position of 'strain', or None if it has none (and 'add' is False)
+		if strain not in self.positions and add:
+			with self.lock:
+				if strain not in self.positions:
+					self.positions[strain] = len(self.names)
+					self.names.append(strain)
+		return self.positions.get(strain)
+
+class StrainCalls (object):
+	# Is: the allele calls of one SNP, one per strain
+	# Has: a bytearray with one single-character allele per STRAINS position
+	#	(NO_CALL where the strain has none), the rare longer alleles by
+	#	position, and an optional detail value per position (isConflict for
+	#	consensus SNPs, population for sub SNPs)
+	# Does: looks up a strain's allele in constant time and compares the
+	#	whole row against an expected string of alleles, without creating
+	#	an object per call.  A second call for the same strain replaces
+	#	the first.
+
+	__slots__ = ('alleles', 'longAlleles', 'details')
+
+	def __init__ (self):
+		self.alleles = bytearray(NO_CALL * len(STRAINS.names))
+		self.longAlleles = None		# position : allele, for alleles of other than one character
+						# (shown as '*' in the bytearray)
+		self.details = None		# list of detail values by position, once any is set
+		return
+
+	def set (self, strain, allele, detail = None):
+		# record the call of 'allele' for 'strain'
+		position = STRAINS.position(strain, True)
+		if position >= len(self.alleles):
+			self.alleles.extend(NO_CALL * (len(STRAINS.names) - len(self.alleles)))
+
+		if self.longAlleles and position in self.longAlleles:
+			del self.longAlleles[position]
+		if allele is not None and len(allele) == 1 and allele != NO_CALL and ord(allele) < 128:
+			self.alleles[position] = ord(allele)
+		else:
+			if self.longAlleles is None:
+				self.longAlleles = {}
+			self.longAlleles[position] = allele
+			self.alleles[position] = '*'
+
+		if (detail is not None) or self.details:
+			if self.details is None:
+				self.details = []
+			if position >= len(self.details):
+				self.details.extend([ None ] * (position + 1 - len(self.details)))
+			self.details[position] = detail
+		return
+
+	def get (self, strain, default = NO_CALL):
+		# returns the allele called for 'strain', or 'default' if there is no call
+		position = STRAINS.position(strain)
+		if (position is None) or (position >= len(self.alleles)) or \
+				(self.alleles[position] == ord(NO_CALL)):
+			return default
+		if self.longAlleles and position in self.longAlleles:
+			return self.longAlleles[position]
+		return chr(self.alleles[position])
+
+	def getDetail (self, strain):
+		# returns the detail value recorded with the call for 'strain', or None
+		position = STRAINS.position(strain)
+		if self.details and (position is not None) and (position < len(self.details)):
+			return self.details[position]
+		return None
+
+	def asString (self, count = len(SANGER_STRAINS)):
+		# returns the alleles for the first 'count' STRAINS positions (by default,
+		# SANGER_STRAINS) as a string, with NO_CALL for strains without a call
+		row = str(self.alleles[:count])
+		return row + NO_CALL * (count - len(row))
+
+	def mismatches (self, expected):
+		# compares the row to the string of 'expected' alleles (one per position, in
+		# STRAINS order) and returns a list of (strain, expected allele, allele)
+		# for each position that differs
+		row = self.asString(len(expected))
+		if row == expected:
+			return []
+		return [ (STRAINS.names[i], expected[i], row[i])
+			for i in range(len(expected)) if row[i] != expected[i] ]
+
+	def strains (self):
+		# returns the set of strains with a call
+		return set([ STRAINS.names[i] for i in self._positions() ])
+
+	def missing (self, strains = SANGER_STRAINS):
+		# returns the list of 'strains' with no call
+		return [ strain for strain in strains if self.get(strain, None) is None ]
+
+	def items (self):
+		# returns a list of (strain, allele, detail) for each call, ordered by strain
+		items = []
+		for i in self._positions():
+			strain = STRAINS.names[i]
+			items.append( (strain, self.get(strain), self.getDetail(strain)) )
+		items.sort()
+		return items
+
+	def _positions (self):
+		return [ i for i in range(len(self.alleles)) if self.alleles[i] != ord(NO_CALL) ]
+
+	def __len__ (self):
+		# number of strains with a call
+		return len(self.alleles) - self.alleles.count(NO_CALL)
+
+class ConsensusSnp (object):
 	# Is: a single consensus SNP
 	# Has: all attributes of a consensus SNP, including ID, locations,
 	#	allele calls for strains, sub SNPs, etc.
-	# Does: loads from the database all data for the SNP and exposes it
-	#	via object traversal
+	# Does: loads from the database the basic data for the SNP and exposes
+	#	it via object traversal; flanks, allele calls (as a StrainCalls
+	#	row in strainCalls), locations, and sub SNPs are loaded on first
+	#	access
+
+	flankBefore = LazyAttribute('flankBefore', '_getFlanks')
+	flankAfter = LazyAttribute('flankAfter', '_getFlanks')
+	strainCalls = LazyAttribute('strainCalls', '_getAlleleCalls')
+	subSnps = LazyAttribute('subSnps', '_getSubSnps')
+	locations = LazyAttribute('locations', '_getLocations')
 
-	def __init__ (self, consensusSnpKey):
+	def __init__ (self, consensusSnpKey, initialize = True):
 		self.consensusSnpKey = consensusSnpKey
 		self.accID = None
 		self.iupacCode = None
@@ -74,16 +264,12 @@ class ConsensusSnp:
 		self.alleleSummary = None
 		self.createdInBuild = None
 		self.updatedInBuild = None
-		self.flankBefore = None
-		self.flankAfter = None
 
 		self.orientation = None
 		self.isMultiCoord = None
-		self.alleleCalls = []
-		self.subSnps = []
-		self.locations = []
 
-		self._initialize()
+		if initialize:
+			self._initialize()
 		return
 
 	def _initialize (self):
@@ -91,26 +277,58 @@ class ConsensusSnp:
 		cmd0 = '''select s.alleleSummary, s.iupacCode, s.buildCreated,
 				s.buildUpdated, vc.term as variationType
 			from SNP_ConsensusSnp s, VOC_Term vc
-			where s._ConsensusSnp_key = %d
-				and s._VarClass_key = vc._Term_key''' % self.consensusSnpKey
-		results0 = pg_db.sql(cmd0, 'auto')
+			where s._ConsensusSnp_key = %s
+				and s._VarClass_key = vc._Term_key'''
+		results0 = datatest.runQuery(cmd0, [self.consensusSnpKey])
 		if results0:
-			self.alleleSummary = results0[0]['alleleSummary']
-			self.iupacCode = results0[0]['iupacCode']
-			self.createdInBuild = results0[0]['buildCreated']
-			self.updatedInBuild = results0[0]['buildUpdated']
-			self.variationType = results0[0]['variationType']
-		
-		# flanking sequences (5' is displayed first, then 3')
-		cmd1 = '''select _ConsensusSnp_key, is5prime, sequenceNum, flank
-			from snp_flank
-			where _ConsensusSnp_key = %d
-			order by is5prime, sequenceNum''' % self.consensusSnpKey
-		results1 = pg_db.sql(cmd1, 'auto')
+			self._setData(results0[0])
 		
+		# primary ID for the SNP
+		cmd2 = '''select accID
+			from snp_accession
+			where _MGIType_key = 30
+			and _Object_key = %s'''
+		results2 = datatest.runQuery(cmd2, [self.consensusSnpKey])
+		if results2:
+			self.accID = results2[0]['accID']
+		return
+
+	def _setEmptyRelationships(self, sections = SECTIONS):
+		# mark the lazily-loaded attributes of the given sections as loaded (and empty), so
+		# they can be filled in directly without going back to the database
+		if 'flanks' in sections:
+			self.flankBefore = None
+			self.flankAfter = None
+		if 'alleleCalls' in sections:
+			self.strainCalls = StrainCalls()
+		if 'subSnps' in sections:
+			self.subSnps = []
+		if 'locations' in sections:
+			self.locations = []
+		return
+
+	def _isLoaded(self, section):
+		# has the given section (one of SECTIONS) been loaded?
+		return SECTION_ATTRIBUTES[section] in self.__dict__
+
+	def _setData(self, row):
+		# fill in the basic SNP data from a snp_consensussnp/voc_term query row
+		self.alleleSummary = row['alleleSummary']
+		self.iupacCode = row['iupacCode']
+		self.createdInBuild = row['buildCreated']
+		self.updatedInBuild = row['buildUpdated']
+		self.variationType = row['variationType']
+		return
+
+	def _setFlanks(self, rows):
+		# fill in the flanking sequences from snp_flank rows (each side assembled by the
+		# database, though several rows per side are joined here too)
+		self.flankBefore = None
+		self.flankAfter = None
+
 		seq1 = ''
 		seq2 = ''
-		for row in results1:
+		for row in rows:
 			if row['is5prime']:
 				seq1 = seq1 + row['flank']
 			else:
@@ -120,39 +338,44 @@ class ConsensusSnp:
 			self.flankBefore = seq1
 		if seq2:
 			self.flankAfter = seq2
+		return
 
-		# primary ID for the SNP
-		cmd2 = '''select accID
-			from snp_accession
-			where _MGIType_key = 30
-			and _Object_key = %d''' % self.consensusSnpKey
-		results2 = pg_db.sql(cmd2, 'auto')
-		if results2:
-			self.accID = results2[0]['accID']
-		
-		self._getAlleleCalls()
-		self._getLocations()
-		self._getSubSnps()
+	def _getFlanks(self):
+		# flanking sequences (5' is displayed first, then 3')
+		cmd0 = '''select is5prime, string_agg(flank, '' order by sequenceNum) as flank
+			from snp_flank
+			where _ConsensusSnp_key = %s
+			group by is5prime'''
+		results0 = datatest.runQuery(cmd0, [self.consensusSnpKey])
+		self._setFlanks(results0)
 		return
 
 	def _getAlleleCalls(self):
 		cmd0 = '''select s.strain, a.allele, a.isConflict
 			from snp_consensussnp_strainallele a, prb_strain s
-			where _ConsensusSnp_key = %d
-				and a._mgdStrain_key = s._Strain_key
-				order by s.strain''' % self.consensusSnpKey
-		results0 = pg_db.sql(cmd0, 'auto')
+			where _ConsensusSnp_key = %s
+				and a._mgdStrain_key = s._Strain_key'''
+		results0 = datatest.runQuery(cmd0, [self.consensusSnpKey])
 		
+		self.strainCalls = StrainCalls()
 		for row in results0:
-			self.alleleCalls.append(ConsensusSnpAlleleCall(row['strain'], row['allele'], row['isConflict']))
+			self.strainCalls.set(row['strain'], row['allele'], row['isConflict'])
 		return
+
+	def _getAlleleCallList(self):
+		# list of ConsensusSnpAlleleCall objects (ordered by strain), built from strainCalls
+		return [ ConsensusSnpAlleleCall(strain, allele, isConflict)
+			for (strain, allele, isConflict) in self.strainCalls.items() ]
+
+	alleleCalls = property(_getAlleleCallList)
 	
 	def _getSubSnps(self):
 		cmd0 = '''select s._SubSnp_key
 			from snp_subsnp s
-			where s._ConsensusSnp_key = %d''' % self.consensusSnpKey
-		results0 = pg_db.sql(cmd0, 'auto')
+			where s._ConsensusSnp_key = %s'''
+		results0 = datatest.runQuery(cmd0, [self.consensusSnpKey])
 		
+		self.subSnps = []
 		for row in results0:
 			self.subSnps.append(SubSnp(row['_SubSnp_key']))
 		return
@@ -160,10 +383,11 @@ class ConsensusSnp:
 	def _getLocations(self):
 		cmd0 = '''select s._Coord_Cache_key, s.sequenceNum
 			from snp_coord_cache s
-			where s._ConsensusSnp_key = %d
-			order by s.sequenceNum''' % self.consensusSnpKey
-		results0 = pg_db.sql(cmd0, 'auto')
+			where s._ConsensusSnp_key = %s
+			order by s.sequenceNum'''
+		results0 = datatest.runQuery(cmd0, [self.consensusSnpKey])
 		
+		self.locations = []
 		for row in results0:
 			self.locations.append(ConsensusSnpLocation(row['_Coord_Cache_key']))
 		return
@@ -175,8 +399,14 @@ class ConsensusSnpAlleleCall:
 		self.isConflict = isConflict
 		return
 
-class ConsensusSnpLocation:
-	def __init__ (self, coordCacheKey):
+class ConsensusSnpLocation (object):
+	# Is: one genomic location of a consensus SNP
+	# Does: loads the location data on creation; associated markers are
+	#	loaded on first access
+
+	markers = LazyAttribute('markers', '_getMarkers')
+
+	def __init__ (self, coordCacheKey, initialize = True):
 		self.coordCacheKey = coordCacheKey
 		self.chromosome = None
 		self.startCoordinate = None
@@ -185,37 +415,46 @@ class ConsensusSnpLocation:
 		self.variationType = None
 		self.alleleSummary = None
 		self.iupacCode = None
-		self.markers = []
 
-		self._initialize()
+		if initialize:
+			self._initialize()
 		return
 
 	def _initialize(self):
 		cmd0 = '''select s.chromosome, s.startCoordinate, s.isMultiCoord, s.strand,
 				vc.term as variationType, s.alleleSummary, s.iupacCode
 			from snp_coord_cache s, voc_term vc
-			where s._Coord_Cache_key = %d
-				and s._VarClass_key = vc._Term_key''' % self.coordCacheKey
-		results0 = pg_db.sql(cmd0, 'auto')
+			where s._Coord_Cache_key = %s
+				and s._VarClass_key = vc._Term_key'''
+		results0 = datatest.runQuery(cmd0, [self.coordCacheKey])
 		if results0:
-			self.chromosome = results0[0]['chromosome']
-			self.alleleSummary = results0[0]['alleleSummary']
-			self.iupacCode = results0[0]['iupacCode']
-			self.variationType = results0[0]['variationType']
-			self.strand = results0[0]['strand']
-			self.isMultiCoord = results0[0]['isMultiCoord']
-			self.startCoordinate = int(results0[0]['startCoordinate'])
-			
-		cmd1 = '''select _ConsensusSnp_Marker_key
+			self._setData(results0[0])
+		return
+
+	def _getMarkers(self):
+		cmd0 = '''select _ConsensusSnp_Marker_key
 			from snp_consensussnp_marker
-			where _Coord_Cache_key = %d''' % self.coordCacheKey
-		results1 = pg_db.sql(cmd1, 'auto')
-		for row in results1:
+			where _Coord_Cache_key = %s'''
+		results0 = datatest.runQuery(cmd0, [self.coordCacheKey])
+
+		self.markers = []
+		for row in results0:
 			self.markers.append(ConsensusSnpMarker(row['_ConsensusSnp_Marker_key']))
 		return
 
+	def _setData(self, row):
+		# fill in the location data from a snp_coord_cache/voc_term query row
+		self.chromosome = row['chromosome']
+		self.alleleSummary = row['alleleSummary']
+		self.iupacCode = row['iupacCode']
+		self.variationType = row['variationType']
+		self.strand = row['strand']
+		self.isMultiCoord = row['isMultiCoord']
+		self.startCoordinate = int(row['startCoordinate'])
+		return
+
 class ConsensusSnpMarker:
-	def __init__ (self, consensusSnpMarkerKey):
+	def __init__ (self, consensusSnpMarkerKey, initialize = True):
 		self.consensusSnpMarkerKey = consensusSnpMarkerKey
 		self.markerKey = None
 		self.markerSymbol = None
@@ -230,7 +469,8 @@ class ConsensusSnpMarker:
 		self.proteinID = None
 		self.transcriptID = None
 
-		self._initialize()
+		if initialize:
+			self._initialize()
 		return
 
 	def _initialize(self):
@@ -246,75 +486,97 @@ class ConsensusSnpMarker:
 				and a.prefixPart = 'MGI:')
 			inner join voc_term fc on (c._Fxn_key = fc._Term_key)
 			left outer join snp_transcript_protein tp on (c._Transcript_Protein_key = tp._Transcript_Protein_key)
-			where c._ConsensusSnp_Marker_key = %d''' % self.consensusSnpMarkerKey
-		results0 = pg_db.sql(cmd0, 'auto')
+			where c._ConsensusSnp_Marker_key = %s'''
+		results0 = datatest.runQuery(cmd0, [self.consensusSnpMarkerKey])
 		if results0:
-			self.markerKey = results0[0]['_Marker_key']
-			self.markerSymbol = results0[0]['symbol']
-			self.markerID = results0[0]['accID']
-			self.functionClass = results0[0]['functionClass']
-			self.contigAllele = results0[0]['contig_allele']
-			self.residue = results0[0]['residue']
-			self.aaPosition = results0[0]['aa_position']
-			self.readingFrame = results0[0]['reading_frame']
-			self.distanceFrom = results0[0]['distance_from']
-			self.distanceDirection = results0[0]['distance_direction']
-			self.proteinID = results0[0]['proteinID']
-			self.transcriptID = results0[0]['transcriptID']
-		return
-
-class SubSnp:
+			self._setData(results0[0])
+		return
+
+	def _setData(self, row):
+		# fill in the marker association data from a snp_consensussnp_marker query row
+		self.markerKey = row['_Marker_key']
+		self.markerSymbol = row['symbol']
+		self.markerID = row['accID']
+		self.functionClass = row['functionClass']
+		self.contigAllele = row['contig_allele']
+		self.residue = row['residue']
+		self.aaPosition = row['aa_position']
+		self.readingFrame = row['reading_frame']
+		self.distanceFrom = row['distance_from']
+		self.distanceDirection = row['distance_direction']
+		self.proteinID = row['proteinID']
+		self.transcriptID = row['transcriptID']
+		return
+
+class SubSnp (object):
 	# Is: a single sub[mitter] SNP
 	# Has: all attributes of a subSNP, including submitter handle,
 	#	allele calls for strains, variation class, etc.
-	# Does: loads from the database all data for the subSNP and exposes it
-	#	via object traversal
+	# Does: loads from the database the basic data for the subSNP and
+	#	exposes it via object traversal; allele calls (as a StrainCalls
+	#	row in strainCalls) are loaded on first access
 
-	def __init__ (self, subSnpKey):
+	strainCalls = LazyAttribute('strainCalls', '_getAlleleCalls')
+
+	def __init__ (self, subSnpKey, initialize = True):
 		self.subSnpKey = subSnpKey
 		self.variationType = None
 		self.orientation = None
 		self.isExemplar = None
 		self.alleleSummary = None
 		self.accID = None
-		self.alleleCalls = []
 
-		self._initialize()
+		if initialize:
+			self._initialize()
 		return
 
 	def _initialize (self):
 		cmd0 = '''select s.orientation, s.isExemplar, s.alleleSummary, vc.term as variationType, a.accID
 			from snp_subsnp s
 			inner join voc_term vc on (s._VarClass_key = vc._Term_key)
-			left outer join snp_accession a on (a._MGIType_key = %d
+			left outer join snp_accession a on (a._MGIType_key = %s
 				and a._Object_key = s._SubSnp_key
-				and a._LogicalDB_key = %d)
-			where s._SubSnp_key = %d''' % (SUB_SNP_TYPE, SUBSNP_LDB, self.subSnpKey)
-		results0 = pg_db.sql(cmd0, 'auto')
+				and a._LogicalDB_key = %s)
+			where s._SubSnp_key = %s'''
+		results0 = datatest.runQuery(cmd0, [SUB_SNP_TYPE, SUBSNP_LDB, self.subSnpKey])
 		
 		if results0:
-			self.variationType = results0[0]['variationType']
-			self.orientation = results0[0]['orientation']
-			self.isExemplar = results0[0]['isExemplar']
-			self.alleleSummary = results0[0]['alleleSummary']
-			self.accID = results0[0]['accID']
-			
-		self._getAlleleCalls()
+			self._setData(results0[0])
+		return
+
+	def _setData(self, row):
+		# fill in the sub SNP data from a snp_subsnp/voc_term/snp_accession query row
+		self.variationType = row['variationType']
+		self.orientation = row['orientation']
+		self.isExemplar = row['isExemplar']
+		self.alleleSummary = row['alleleSummary']
+		self.accID = row['accID']
 		return
+
+	def _isLoaded(self, section):
+		# have the allele calls (the only section of a sub SNP) been loaded?
+		return (section == 'alleleCalls') and ('strainCalls' in self.__dict__)
 	
 	def _getAlleleCalls(self):
 		cmd0 = '''select s.strain, a.allele, p.name as population
 			from snp_subsnp_strainallele a, prb_strain s, snp_population p
-			where a._SubSnp_key = %d
+			where a._SubSnp_key = %s
 				and a._mgdStrain_key = s._Strain_key
-				and a._Population_key = p._Population_key
-			order by s.strain''' % self.subSnpKey
-		results0 = pg_db.sql(cmd0, 'auto')
+				and a._Population_key = p._Population_key'''
+		results0 = datatest.runQuery(cmd0, [self.subSnpKey])
 		
+		self.strainCalls = StrainCalls()
 		for row in results0:
-			self.alleleCalls.append(SubSnpAlleleCall(row['strain'], row['allele'], row['population']))
+			self.strainCalls.set(row['strain'], row['allele'], row['population'])
 		return
 
+	def _getAlleleCallList(self):
+		# list of SubSnpAlleleCall objects (ordered by strain), built from strainCalls
+		return [ SubSnpAlleleCall(strain, allele, population)
+			for (strain, allele, population) in self.strainCalls.items() ]
+
+	alleleCalls = property(_getAlleleCallList)
+
 class SubSnpAlleleCall:
 	def __init__ (self, strain, allele, population):
 		self.strain = strain
@@ -322,66 +584,705 @@ class SubSnpAlleleCall:
 		self.population = population
 		return
 
+class SnpCache:
+	# Is: a run-scoped identity map of ConsensusSnp and SubSnp objects
+	# Has: objects keyed by (_MGIType_key, _Object_key), an index from accID
+	#	to that key (including accIDs known not to match any SNP), a size
+	#	bound, and hit/miss/eviction counters
+	# Does: returns the same object for repeated lookups of an accID or key,
+	#	evicting the least recently used objects once the size bound is
+	#	reached.  Starts over if the database login changes (as it can in
+	#	a long-lived viewer process).
+
+	def __init__ (self, maxSize = DEFAULT_CACHE_SIZE):
+		self.login = None
+		self.maxSize = maxSize
+		self.objects = OrderedDict()	# (type, key) : object, least recently used first
+		self.accIDs = {}		# accID : (type, key), or None for unknown IDs
+		self.aliases = {}		# (type, key) : list of accIDs referring to it
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		return
+
+	def lookupID (self, accID):
+		# returns (True, object-or-None) if we know the answer for 'accID', or (False, None)
+		# if the database must be consulted
+		self.checkLogin()
+		if accID in self.accIDs:
+			objKey = self.accIDs[accID]
+			if objKey is None:
+				self.hits = self.hits + 1
+				return (True, None)
+			obj = self.lookupKey(objKey)
+			if obj is not None:
+				return (True, obj)
+		self.misses = self.misses + 1
+		return (False, None)
+
+	def lookupKey (self, objKey):
+		# returns the cached object for (_MGIType_key, _Object_key), or None if not cached
+		if objKey in self.objects:
+			self.hits = self.hits + 1
+			obj = self.objects.pop(objKey)
+			self.objects[objKey] = obj
+			return obj
+		return None
+
+	def add (self, objKey, obj, accID = None):
+		# remember 'obj' under (_MGIType_key, _Object_key) and (optionally) 'accID'
+		if self.maxSize <= 0:
+			return
+		if obj is None:
+			if accID is not None:
+				self._addAlias(accID, None)
+			return
+
+		if objKey in self.objects:
+			del self.objects[objKey]
+		self.objects[objKey] = obj
+		if accID is not None:
+			self._addAlias(accID, objKey)
+		if obj.accID is not None:
+			self._addAlias(obj.accID, objKey)
+
+		while len(self.objects) > self.maxSize:
+			(oldKey, oldObj) = self.objects.popitem(last = False)
+			for alias in self.aliases.pop(oldKey, []):
+				del self.accIDs[alias]
+			self.evictions = self.evictions + 1
+		return
+
+	def _addAlias (self, accID, objKey):
+		if accID in self.accIDs:
+			return
+		self.accIDs[accID] = objKey
+		if objKey is not None:
+			self.aliases.setdefault(objKey, []).append(accID)
+		elif len(self.accIDs) > 2 * self.maxSize:
+			# forget the unknown IDs rather than let them grow without bound
+			for (alias, key) in self.accIDs.items():
+				if key is None:
+					del self.accIDs[alias]
+			self.accIDs[accID] = None
+		return
+
+	def checkLogin (self):
+		# forget everything cached from a different database
+		if self.login != datatest.getLogin():
+			self.clear()
+			self.login = datatest.getLogin()
+		return
+
+	def clear (self):
+		self.objects.clear()
+		self.accIDs.clear()
+		self.aliases.clear()
+		return
+
+	def counters (self):
+		# returns the cache counters (see datatest.addReporter)
+		return { 'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions }
+
+	def report (self, counts = None):
+		# returns a one-line summary of the cache counters (or of 'counts', summed over
+		# worker processes), for the end-of-run report
+		if counts is not None:
+			return 'SNP cache: %d hits, %d misses, %d evictions' % (
+				counts['hits'], counts['misses'], counts['evictions'])
+		return 'SNP cache: %d hits, %d misses, %d evictions (%d of %d objects cached)' % (
+			self.hits, self.misses, self.evictions, len(self.objects), self.maxSize)
+
+class AccessionResolver:
+	# Is: a map from consensus and sub SNP accession IDs to the objects they identify
+	# Has: the IDs declared so far but not yet looked up, and the resolved
+	#	accID : [ (_MGIType_key, _Object_key), ... ] map (empty list for unknown IDs)
+	# Does: lets test modules declare the IDs they use when their suites are
+	#	built, then resolves every pending ID with a single query the first
+	#	time any ID is looked up, so later lookups and existence checks are
+	#	answered from memory (until the database login changes)
+
+	def __init__ (self):
+		self.login = None
+		self.pending = set()
+		self.resolved = {}
+		return
+
+	def checkLogin (self):
+		# forget the IDs resolved against a different database
+		if self.login != datatest.getLogin():
+			self.resolved = {}
+			self.login = datatest.getLogin()
+		return
+
+	def declare (self, accIDs):
+		# note IDs to be resolved with the next query
+		self.checkLogin()
+		for accID in accIDs:
+			if accID not in self.resolved:
+				self.pending.add(accID)
+		return
+
+	def resolve (self):
+		# look up all pending IDs (one query)
+		self.checkLogin()
+		if not self.pending:
+			return
+		accIDs = list(self.pending)
+		cmd0 = '''select accID, _MGIType_key, _Object_key
+			from snp_accession
+			where _MGIType_key in (30,31)
+				and accID = any(%s)'''
+		results0 = datatest.runQuery(cmd0, [accIDs])
+
+		# a long-lived process (the viewer) starts over rather than grow without bound
+		if len(self.resolved) + len(accIDs) > MAX_RESOLVED:
+			self.resolved = {}
+		for accID in accIDs:
+			self.resolved[accID] = []
+		for row in results0:
+			objKey = (row['_MGIType_key'], row['_Object_key'])
+			if objKey not in self.resolved[row['accID']]:
+				self.resolved[row['accID']].append(objKey)
+		self.pending.clear()
+		return
+
+	def lookup (self, accID):
+		# returns (_MGIType_key, _Object_key) for 'accID', or None if unknown
+		objKeys = self.lookupAll([accID])[accID]
+		if objKeys:
+			return objKeys[0]
+		return None
+
+	def lookupAll (self, accIDs):
+		# returns { accID : [ (_MGIType_key, _Object_key), ... ] } for the given IDs,
+		# resolving them (along with any others pending) if needed
+		self.declare(accIDs)
+		self.resolve()
+		objKeys = {}
+		for accID in accIDs:
+			objKeys[accID] = self.resolved[accID]
+		return objKeys
+
+	def exists (self, accID, mgiType = None):
+		# returns True if 'accID' identifies a SNP (of the given _MGIType_key, if specified)
+		for (objType, objKey) in self.lookupAll([accID])[accID]:
+			if mgiType in (None, objType):
+				return True
+		return False
+
+class CoordinateIndex:
+	# Is: an index of consensus SNP locations by chromosome and coordinate
+	# Has: for each chromosome, an array of location start coordinates (in
+	#	ascending order) and a parallel array of _ConsensusSnp_keys, along
+	#	with the database build they were read from
+	# Does: finds the SNPs in a region, or nearest a coordinate, by binary
+	#	search.  The arrays are built with one streamed query over
+	#	snp_coord_cache the first time they are needed, and saved in
+	#	'cacheDir' so later runs against the same build just read them.
+	#	Given 'chromosomes', only the locations on those are indexed
+	#	(and saved apart from the genome-wide arrays).
+
+	def __init__ (self, cacheDir = datatest.CACHEDIR, chromosomes = None):
+		self.cacheDir = cacheDir
+		self.only = chromosomes and sorted(set(chromosomes))	# None for all
+		self.login = None
+		self.coordinates = None		# chromosome : array('d') of start coordinates
+		self.keys = None		# chromosome : array('l') of _ConsensusSnp_keys
+		return
+
+	def region (self, chromosome, start, end):
+		# returns [ (startCoordinate, _ConsensusSnp_key), ... ] for the locations
+		# from 'start' to 'end' (inclusive) on 'chromosome', ordered by coordinate
+		(coordinates, keys) = self._arrays(chromosome)
+		lo = bisect.bisect_left(coordinates, start)
+		hi = bisect.bisect_right(coordinates, end)
+		return zip(coordinates[lo:hi], keys[lo:hi])
+
+	def count (self, chromosome, start, end):
+		# returns the number of locations from 'start' to 'end' (inclusive) on 'chromosome'
+		(coordinates, keys) = self._arrays(chromosome)
+		return bisect.bisect_right(coordinates, end) - bisect.bisect_left(coordinates, start)
+
+	def nearest (self, chromosome, coordinate, count = 10):
+		# returns the (up to) 'count' locations on 'chromosome' nearest to 'coordinate',
+		# as [ (startCoordinate, _ConsensusSnp_key), ... ] ordered by coordinate
+		(coordinates, keys) = self._arrays(chromosome)
+		lo = hi = bisect.bisect_left(coordinates, coordinate)
+		while (hi - lo < count) and ((lo > 0) or (hi < len(coordinates))):
+			if (hi == len(coordinates)) or ((lo > 0) and
+					(coordinate - coordinates[lo - 1] <= coordinates[hi] - coordinate)):
+				lo = lo - 1
+			else:
+				hi = hi + 1
+		return zip(coordinates[lo:hi], keys[lo:hi])
+
+	def chromosomes (self):
+		# returns the chromosomes with SNP locations
+		self._load()
+		return sorted(self.coordinates.keys())
+
+	def clear (self):
+		# forget the arrays (they are read again on next use)
+		self.login = None
+		self.coordinates = None
+		self.keys = None
+		return
+
+	def _arrays (self, chromosome):
+		self._load()
+		if self.only and (chromosome not in self.only):
+			raise Exception('Chromosome %s is not in this index (only %s)' % (chromosome,
+				', '.join(self.only)))
+		if chromosome in self.coordinates:
+			return (self.coordinates[chromosome], self.keys[chromosome])
+		return (array.array('d'), array.array('l'))
+
+	def _load (self):
+		# make sure the arrays are for the current database
+		if (self.coordinates is not None) and (self.login == datatest.getLogin()):
+			return
+		self.login = datatest.getLogin()
+		version = datatest.databaseVersion()
+		if not self._read(version):
+			self._build()
+			self._write(version)
+		return
+
+	def _build (self):
+		cmd0 = '''select chromosome, startCoordinate, _ConsensusSnp_key
+			from snp_coord_cache
+			%s
+			order by chromosome, startCoordinate'''
+		if self.only:
+			(cmd0, params) = (cmd0 % 'where chromosome = any(%s)', [ self.only ])
+		else:
+			(cmd0, params) = (cmd0 % '', None)
+		self.coordinates = {}
+		self.keys = {}
+		columns = [ 'chromosome', 'startCoordinate', '_ConsensusSnp_key' ]
+		for batch in datatest.streamQuery(cmd0, columns, params):
+			for (chromosome, coordinate, key) in batch:
+				if chromosome not in self.coordinates:
+					self.coordinates[chromosome] = array.array('d')
+					self.keys[chromosome] = array.array('l')
+				self.coordinates[chromosome].append(float(coordinate))
+				self.keys[chromosome].append(key)
+		return
+
+	def _path (self):
+		# file the arrays for this database are saved in, or None if they are not saved
+		if not (self.cacheDir and self.login):
+			return None
+		key = repr(self.login)
+		if self.only:
+			key = '%s|%s' % (key, ','.join(self.only))
+		return os.path.join(self.cacheDir, 'coordinates.%s.pickle' % \
+			hashlib.md5(key).hexdigest()[:12])
+
+	def _read (self, version):
+		# load the saved arrays, if they are from this build; returns True if loaded
+		path = self._path()
+		if not (path and version and os.path.exists(path)):
+			return False
+		try:
+			fp = open(path, 'rb')
+			try:
+				saved = cPickle.load(fp)
+			finally:
+				fp.close()
+		except (IOError, EOFError, cPickle.UnpicklingError):
+			return False
+		if saved.get('version') != version:
+			return False
+
+		self.coordinates = {}
+		self.keys = {}
+		for (chromosome, (coordinates, keys)) in saved['chromosomes'].items():
+			self.coordinates[chromosome] = array.array('d')
+			self.coordinates[chromosome].fromstring(coordinates)
+			self.keys[chromosome] = array.array('l')
+			self.keys[chromosome].fromstring(keys)
+		return True
+
+	def _write (self, version):
+		# save the arrays (as raw machine values), replacing any older copy
+		path = self._path()
+		if not (path and version):
+			return
+		chromosomes = {}
+		for chromosome in self.coordinates:
+			chromosomes[chromosome] = (self.coordinates[chromosome].tostring(),
+				self.keys[chromosome].tostring())
+
+		# write to a temporary file and rename, so concurrent runs never see a partial file
+		tempPath = '%s.%d' % (path, os.getpid())
+		fp = open(tempPath, 'wb')
+		cPickle.dump({ 'version' : version, 'chromosomes' : chromosomes }, fp,
+			cPickle.HIGHEST_PROTOCOL)
+		fp.close()
+		os.rename(tempPath, path)
+		return
+
+###--- globals ---###
+
+# positions of strains in StrainCalls rows
+STRAINS = StrainIndex(SANGER_STRAINS)
+
+# identity map shared by getSnpByID and getSnpsByIDs for the duration of the run
+CACHE = SnpCache()
+datatest.addReporter(CACHE.report, CACHE.counters)
+
+# accession IDs declared by the test suites, resolved in bulk
+RESOLVER = AccessionResolver()
+
+def declareIDs(accIDs):
+	# declare SNP accession IDs that a test suite will look up, so they can all be
+	# resolved with a single query before the tests run
+	RESOLVER.declare(accIDs)
+	return
+
+# consensus SNP locations by chromosome and coordinate, for region queries
+COORDINATES = CoordinateIndex()
+
+def setConcurrentLoading(concurrent):
+	# turn concurrent loading of SNP sections on or off
+	global CONCURRENT_LOADING
+	CONCURRENT_LOADING = concurrent
+	return
+
+def clearCaches():
+	# forget all SNP data held in memory (e.g. once a new build is loaded)
+	CACHE.clear()
+	RESOLVER.resolved = {}
+	COORDINATES.clear()
+	return
+
+def setCacheSize(maxSize):
+	# set the maximum number of SNP objects held in the cache (0 disables caching)
+	CACHE.maxSize = maxSize
+	if maxSize <= 0:
+		CACHE.clear()
+	return
+
 ###--- functions ---###
 
-def getSnpByID(accID):
-	# returns the ConsensusSnp or SubSnp object corresponding to the given accID, or None if no match
+def getSnpByID(accID, include = None):
+	# returns the ConsensusSnp or SubSnp object corresponding to the given accID, or None if no match;
+	# 'include' is as for getSnpsByIDs
+
+	return getSnpsByIDs([accID], include)[accID]
+
+def getSnpsByIDs(accIDs, include = None):
+	# returns a dictionary mapping each of the given accIDs to its ConsensusSnp or SubSnp object
+	# (or to None if no match).  The object graphs for all the IDs are built using a fixed number
+	# of set-based queries (one per table), regardless of how many IDs, locations, markers, and
+	# sub SNPs are involved.  'include' names the SECTIONS to load (default: all of them), e.g.
+	# ('alleleCalls', 'locations'); the basic data and ID of each SNP are always loaded.
+
+	include = _sections(include)
+	snps = {}
+	unknownIDs = []		# IDs not yet in the cache
+	for accID in accIDs:
+		if accID in snps:
+			continue
+		(found, snps[accID]) = CACHE.lookupID(accID)
+		if not found:
+			unknownIDs.append(accID)
+	if not unknownIDs:
+		_loadMissingSections(snps.values(), {}, include)
+		return snps
 
-	cmd0 = '''select _MGIType_key, _Object_key
+	consensusSnps = {}	# _ConsensusSnp_key : ConsensusSnp (new ones, to be loaded)
+	subSnps = {}		# _SubSnp_key : SubSnp (new ones, to be loaded)
+	objKeys = {}		# accID : (_MGIType_key, _Object_key)
+	for (accID, matches) in RESOLVER.lookupAll(unknownIDs).items():
+		if not matches:
+			continue
+		(objType, key) = objKeys[accID] = matches[0]
+
+		# an object already in the cache (found by another ID) is reused, not reloaded
+		cached = CACHE.lookupKey((objType, key))
+		if cached is not None:
+			snps[accID] = cached
+		elif objType == CONSENSUS_SNP_TYPE:
+			if key not in consensusSnps:
+				consensusSnps[key] = ConsensusSnp(key, False)
+				consensusSnps[key]._setEmptyRelationships(include)
+			snps[accID] = consensusSnps[key]
+		else:
+			if key not in subSnps:
+				subSnps[key] = SubSnp(key, False)
+			snps[accID] = subSnps[key]
+
+	if consensusSnps:
+		_loadConsensusSnps(consensusSnps, subSnps, include)
+	_loadMissingSections([ snp for snp in snps.values() if not (isinstance(snp, ConsensusSnp)
+		and snp.consensusSnpKey in consensusSnps) ], subSnps, include)
+
+	# add the sub SNPs first, so the requested objects are the most recently used
+	for (key, subSnp) in subSnps.items():
+		CACHE.add((SUB_SNP_TYPE, key), subSnp)
+	for accID in unknownIDs:
+		CACHE.add(objKeys.get(accID), snps[accID], accID)
+	return snps
+
+def snpsInRegion(chromosome, start, end, index = None):
+	# returns [ (startCoordinate, _ConsensusSnp_key), ... ] for the consensus SNP locations
+	# on 'chromosome' from 'start' to 'end' (inclusive), ordered by coordinate.  Each of
+	# these functions searches 'index' (a CoordinateIndex), or COORDINATES by default.
+	return (index or COORDINATES).region(chromosome, start, end)
+
+def countSnpsInRegion(chromosome, start, end, index = None):
+	# returns the number of consensus SNP locations on 'chromosome' from 'start' to 'end'
+	return (index or COORDINATES).count(chromosome, start, end)
+
+def nearestSnps(chromosome, coordinate, count = 10, index = None):
+	# returns the (up to) 'count' consensus SNP locations nearest to 'coordinate' on
+	# 'chromosome', as [ (startCoordinate, _ConsensusSnp_key), ... ] ordered by coordinate
+	return (index or COORDINATES).nearest(chromosome, coordinate, count)
+
+def _sections(include):
+	# returns the set of SECTIONS named in 'include' (all of them if None)
+	if include is None:
+		return frozenset(SECTIONS)
+	if isinstance(include, types.StringTypes):
+		include = [ include ]
+	unknown = [ section for section in include if section not in SECTIONS ]
+	if unknown:
+		raise Exception('Unknown SNP section(s): %s (expected some of %s)' % (', '.join(unknown),
+			', '.join(SECTIONS)))
+	return frozenset(include)
+
+def _loadConsensusSnps(consensusSnps, subSnps, include = SECTIONS, basic = True):
+	# fill in the given ConsensusSnp objects (dictionary keyed by _ConsensusSnp_key): their basic
+	# data (if 'basic') and the sections in 'include' (flanks, allele calls, locations and
+	# markers).  With 'subSnps', their sub SNPs are added to 'subSnps' (keyed by _SubSnp_key)
+	# for loading by _loadSubSnps().  Each section fills in different attributes and needs only
+	# the keys, so they can all be loaded at once.
+
+	keys = consensusSnps.keys()
+	sections = []
+	if basic:
+		sections.append(lambda : _loadBasicData(consensusSnps, keys))
+		sections.append(lambda : _loadPrimaryIDs(consensusSnps, keys))
+	if 'flanks' in include:
+		sections.append(lambda : _loadFlanks(consensusSnps, keys))
+	if 'alleleCalls' in include:
+		sections.append(lambda : _loadConsensusAlleleCalls(consensusSnps, keys))
+	if 'locations' in include:
+		sections.append(lambda : _loadLocations(consensusSnps, keys))
+	if 'subSnps' in include:
+		sections.append(lambda : _loadSubSnpKeys(consensusSnps, keys, subSnps))
+	_runSections(sections)
+	return
+
+def _loadMissingSections(snps, subSnps, include):
+	# load the sections in 'include' that the given SNP objects (already loaded, perhaps
+	# with fewer sections) lack, then the new SubSnp objects in 'subSnps' (keyed by
+	# _SubSnp_key) and the allele calls of all sub SNPs involved, if included
+
+	incomplete = {}		# tuple of missing sections : { _ConsensusSnp_key : ConsensusSnp }
+	for snp in snps:
+		if isinstance(snp, ConsensusSnp):
+			missing = tuple([ section for section in SECTIONS
+				if (section in include) and not snp._isLoaded(section) ])
+			if missing:
+				snp._setEmptyRelationships(missing)
+				incomplete.setdefault(missing, {})[snp.consensusSnpKey] = snp
+	for (missing, consensusSnps) in incomplete.items():
+		_loadConsensusSnps(consensusSnps, subSnps, missing, False)
+
+	# allele calls of the sub SNPs requested, or of the consensus SNPs requested
+	callsFor = {}		# _SubSnp_key : SubSnp
+	if 'alleleCalls' in include:
+		for snp in snps + subSnps.values():
+			if isinstance(snp, SubSnp):
+				related = [ snp ]
+			elif ('subSnps' in include) and (snp is not None):
+				related = snp.subSnps
+			else:
+				related = []
+			for subSnp in related:
+				if not subSnp._isLoaded('alleleCalls'):
+					callsFor[subSnp.subSnpKey] = subSnp
+
+	if subSnps or callsFor:
+		_loadSubSnps(subSnps, callsFor)
+	return
+
+def _loadBasicData(consensusSnps, keys):
+	# basic SNP data
+	cmd0 = '''select s._ConsensusSnp_key, s.alleleSummary, s.iupacCode, s.buildCreated,
+			s.buildUpdated, vc.term as variationType
+		from SNP_ConsensusSnp s, VOC_Term vc
+		where s._ConsensusSnp_key = any(%s)
+			and s._VarClass_key = vc._Term_key'''
+	for row in datatest.runQuery(cmd0, [keys]):
+		consensusSnps[row['_ConsensusSnp_key']]._setData(row)
+	return
+
+def _loadFlanks(consensusSnps, keys):
+	# flanking sequences (5' is displayed first, then 3'), with the chunks of each
+	# joined by the database
+	cmd1 = '''select _ConsensusSnp_key, is5prime, string_agg(flank, '' order by sequenceNum) as flank
+		from snp_flank
+		where _ConsensusSnp_key = any(%s)
+		group by _ConsensusSnp_key, is5prime
+		order by _ConsensusSnp_key, is5prime'''
+	for (key, rows) in _groupBy(datatest.runQuery(cmd1, [keys]), '_ConsensusSnp_key'):
+		consensusSnps[key]._setFlanks(rows)
+	return
+
+def _loadPrimaryIDs(consensusSnps, keys):
+	# primary ID for each SNP
+	cmd2 = '''select _Object_key, accID
 		from snp_accession
-		where _MGIType_key in (30,31)
-			and accID = '%s' ''' % accID
-	results0 = pg_db.sql(cmd0, 'auto')
-	
-	if not results0:
-		return None
-	if results0[0]['_MGIType_key'] == CONSENSUS_SNP_TYPE:
-		return ConsensusSnp(results0[0]['_Object_key'])
-	return SubSnp(results0[0]['_Object_key'])
+		where _MGIType_key = 30
+		and _Object_key = any(%s)'''
+	for row in datatest.runQuery(cmd2, [keys]):
+		snp = consensusSnps[row['_Object_key']]
+		if snp.accID is None:
+			snp.accID = row['accID']
+	return
+
+def _loadConsensusAlleleCalls(consensusSnps, keys):
+	# allele calls
+	cmd3 = '''select a._ConsensusSnp_key, s.strain, a.allele, a.isConflict
+		from snp_consensussnp_strainallele a, prb_strain s
+		where a._ConsensusSnp_key = any(%s)
+			and a._mgdStrain_key = s._Strain_key'''
+	for row in datatest.runQuery(cmd3, [keys]):
+		consensusSnps[row['_ConsensusSnp_key']].strainCalls.set(
+			row['strain'], row['allele'], row['isConflict'])
+	return
+
+def _loadLocations(consensusSnps, keys):
+	# locations, then the markers for those locations
+	cmd4 = '''select s._ConsensusSnp_key, s._Coord_Cache_key, s.chromosome, s.startCoordinate,
+			s.isMultiCoord, s.strand, vc.term as variationType, s.alleleSummary, s.iupacCode
+		from snp_coord_cache s, voc_term vc
+		where s._ConsensusSnp_key = any(%s)
+			and s._VarClass_key = vc._Term_key
+		order by s._ConsensusSnp_key, s.sequenceNum'''
+	locations = {}		# _Coord_Cache_key : ConsensusSnpLocation
+	for row in datatest.runQuery(cmd4, [keys]):
+		location = ConsensusSnpLocation(row['_Coord_Cache_key'], False)
+		location._setData(row)
+		location.markers = []
+		locations[location.coordCacheKey] = location
+		consensusSnps[row['_ConsensusSnp_key']].locations.append(location)
+
+	if locations:
+		cmd5 = '''select c._Coord_Cache_key, c._ConsensusSnp_Marker_key, c._Marker_key,
+				c.contig_allele, c.residue, c.aa_position, c.reading_frame,
+				c.distance_from, c.distance_direction, m.symbol, a.accID, fc.term as functionClass,
+				tp.transcriptID, tp.proteinID
+			from snp_consensussnp_marker c
+			inner join mrk_marker m on (c._Marker_key = m._Marker_key)
+			inner join acc_accession a on (c._Marker_key = a._Object_key
+				and a._MGIType_key = 2
+				and a._LogicalDB_key = 1
+				and a.preferred = 1
+				and a.prefixPart = 'MGI:')
+			inner join voc_term fc on (c._Fxn_key = fc._Term_key)
+			left outer join snp_transcript_protein tp on (c._Transcript_Protein_key = tp._Transcript_Protein_key)
+			where c._Coord_Cache_key = any(%s)
+			order by c._Coord_Cache_key, c._ConsensusSnp_Marker_key'''
+		for row in datatest.runQuery(cmd5, [locations.keys()]):
+			marker = ConsensusSnpMarker(row['_ConsensusSnp_Marker_key'], False)
+			marker._setData(row)
+			locations[row['_Coord_Cache_key']].markers.append(marker)
+	return
+
+def _loadSubSnpKeys(consensusSnps, keys, subSnps):
+	# sub SNPs (filled in later by _loadSubSnps)
+	cmd6 = '''select s._ConsensusSnp_key, s._SubSnp_key
+		from snp_subsnp s
+		where s._ConsensusSnp_key = any(%s)
+		order by s._ConsensusSnp_key, s._SubSnp_key'''
+	for row in datatest.runQuery(cmd6, [keys]):
+		key = row['_SubSnp_key']
+		if key not in subSnps:
+			subSnps[key] = SubSnp(key, False)
+		consensusSnps[row['_ConsensusSnp_key']].subSnps.append(subSnps[key])
+	return
+
+def _loadSubSnps(subSnps, callsFor):
+	# fill in the given new SubSnp objects (dictionary keyed by _SubSnp_key), and the allele
+	# calls of those in 'callsFor' (likewise)
+
+	sections = []
+	if subSnps:
+		sections.append(lambda : _loadSubSnpData(subSnps, subSnps.keys()))
+	if callsFor:
+		for subSnp in callsFor.values():
+			subSnp.strainCalls = StrainCalls()
+		sections.append(lambda : _loadSubSnpAlleleCalls(callsFor, callsFor.keys()))
+	_runSections(sections)
+	return
+
+def _loadSubSnpData(subSnps, keys):
+	cmd0 = '''select s._SubSnp_key, s.orientation, s.isExemplar, s.alleleSummary,
+			vc.term as variationType, a.accID
+		from snp_subsnp s
+		inner join voc_term vc on (s._VarClass_key = vc._Term_key)
+		left outer join snp_accession a on (a._MGIType_key = %s
+			and a._Object_key = s._SubSnp_key
+			and a._LogicalDB_key = %s)
+		where s._SubSnp_key = any(%s)'''
+	for row in datatest.runQuery(cmd0, [SUB_SNP_TYPE, SUBSNP_LDB, keys]):
+		subSnp = subSnps[row['_SubSnp_key']]
+		if subSnp.accID is None:
+			subSnp._setData(row)
+	return
+
+def _loadSubSnpAlleleCalls(subSnps, keys):
+	cmd1 = '''select a._SubSnp_key, s.strain, a.allele, p.name as population
+		from snp_subsnp_strainallele a, prb_strain s, snp_population p
+		where a._SubSnp_key = any(%s)
+			and a._mgdStrain_key = s._Strain_key
+			and a._Population_key = p._Population_key'''
+	for row in datatest.runQuery(cmd1, [keys]):
+		subSnps[row['_SubSnp_key']].strainCalls.set(
+			row['strain'], row['allele'], row['population'])
+	return
+
+def _runSections(sections):
+	# run the given loading functions, at the same time if concurrent loading is on
+	if CONCURRENT_LOADING:
+		datatest.runConcurrently(sections)
+	else:
+		for section in sections:
+			section()
+	return
+
+def _groupBy(rows, field):
+	# generates (value, list of rows) pairs for runs of consecutive rows with the same value in 'field'
+	group = []
+	for row in rows:
+		if group and (group[0][field] != row[field]):
+			yield (group[0][field], group)
+			group = []
+		group.append(row)
+	if group:
+		yield (group[0][field], group)
+	return
 
 def printVerbose(obj, indentCount = 0, tail = ''):
-	# print out a ConsensusSnp or SubSnp (or any other type of object) in a verbose format
-	objType = type(obj)
-	indent = '\t' * indentCount
-
-	if objType == types.IntType:
-		print '%s%d%s' % (indent, obj, tail)
-
-	elif objType == types.StringType:
-		print '%s%s%s' % (indent, obj, tail)
-
-	elif objType == types.NoneType:
-		print '%snull%s' % (indent, tail)
-
-	elif objType == types.ListType:
-		print '%s[' % indent
-		for item in obj:
-			printVerbose(item, indentCount + 1, ',')
-		print '%s]' % indent
-
-	elif objType == types.TupleType:
-		print '%s(' % indent
-		for item in obj:
-			printVerbose(item, indentCount + 1, ',')
-		print '%s)' % indent
-
-	elif objType == types.InstanceType:
-		print '%s{' % indent
-		contents = dir(obj)
-		for name in contents:
-			if not name.startswith('_'):
-				if type(eval('obj.%s' % name)) in [ types.StringType, types.IntType, types.NoneType ]:
-					# print value on same line for simple fields
-					print '%s%s:  ' % (indent, name),
-					printVerbose(eval('obj.%s' % name), 0, ',')
-				else:
-					print '%s%s:' % (indent, name)
-					printVerbose(eval('obj.%s' % name), indentCount + 1, ',')
-		print '%s}%s' % (indent, tail)
+	# print out a ConsensusSnp or SubSnp (or any other type of object) in a verbose format;
+	# see serializer.py for the JSON formats
+	import serializer
+	output = serializer.Serializer(sys.stdout, 'text', indentCount)
+	output.write(obj, tail)
+	output.close()
 	return
 
 def strainsWithCalls(alleleCalls):
-	# for the given list of allele calls, return a Set of the strains represented in it
+	# for the given StrainCalls row or list of allele calls, return a Set of the strains
+	# represented in it
+	if isinstance(alleleCalls, StrainCalls):
+		return alleleCalls.strains()
 	strains = set()
 	for call in alleleCalls:
 		strains.add(call.strain)
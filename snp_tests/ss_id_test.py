@@ -3,6 +3,8 @@ Test that the correct SS ID is chosen for (Sanger) consensus SNPs with multiple
 """
 
 import unittest
+import snplib
+import snpchecks
 from shared.datatest import DataTestCase, runQuery
 
 # constants
@@ -19,38 +21,18 @@ class SSIDTestCase(unittest.TestCase, DataTestCase):
 		"""
 		
 		for (consensusSnpID, subSnpID) in pairs:
-			cmd = '''select 1
-				from snp_accession
-				where _MGIType_key = 30
-					and accID = '%s'
-				limit 1''' % consensusSnpID
-			self.assertQueryCount(1, cmd, 'Unknown consensus SNP ID : %s' % consensusSnpID, 'SNP data out of date?')
-
-			cmd = '''select 1
-				from snp_accession
-				where _MGIType_key = 31
-					and accID = '%s'
-				limit 1''' % subSnpID
-			self.assertQueryCount(1, cmd, 'Unknown sub SNP ID : %s' % subSnpID, 'SNP data out of date?')
-
-			cmd = '''select 1
-				from snp_subsnp ss, snp_accession a
-				where a._MGIType_key = 30
-					and a.accID = '%s'
-					and a._Object_key = ss._ConsensusSnp_key''' % consensusSnpID
-			self.assertQueryCount(1, cmd, 'SubSNP count != 1 for: %s' % consensusSnpID)
-			
-			cmd = '''select 1
-				from snp_subsnp ss, snp_accession a, snp_accession ssa
-				where a._MGIType_key = 30
-					and a.accID = '%s'
-					and a._Object_key = ss._ConsensusSnp_key
-					and ss._SubSnp_key = ssa._Object_key
-					and ssa._MGIType_key = 31
-					and ssa.accID = '%s' ''' % (consensusSnpID, subSnpID)
-			self.assertQueryCount(1, cmd, 'Could not find ID %s for: %s' % (subSnpID, consensusSnpID))
+			self.assertDataTrue(snplib.RESOLVER.exists(consensusSnpID, snplib.CONSENSUS_SNP_TYPE),
+				'Unknown consensus SNP ID : %s' % consensusSnpID, 'SNP data out of date?')
+
+			self.assertDataTrue(snplib.RESOLVER.exists(subSnpID, snplib.SUB_SNP_TYPE),
+				'Unknown sub SNP ID : %s' % subSnpID, 'SNP data out of date?')
+
+		self.assertCheck(snpchecks.SOLE_SUB_SNP, pairs)
 
 def suite():
+	for (consensusSnpID, subSnpID) in pairs:
+		snplib.declareIDs([ consensusSnpID, subSnpID ])
+
 	suite = unittest.TestSuite()
 	suite.addTest(unittest.makeSuite(SSIDTestCase))
 	return suite
@@ -25,6 +25,7 @@ class TemplateTestCase(unittest.TestCase, DataTestCase):
 		#	self.assertQueryCount(...)
 		#	self.assertDataEquals(...)
 		#	self.assertDataTrue(...)
+		#	self.assertCheck(...)	(a table of expectations, checked by one query; see snpchecks.py)
 		# Multiple test methods can be included, but each should be named beginning with "test" so they
 		# can be automatically discovered.
 
@@ -28,10 +28,11 @@ class VocabTermTestCase(unittest.TestCase, DataTestCase):
 		for (table, field, vocab) in foreignKeys:
 			cmd = '''select 1
 				from voc_vocab
-				where name = '%s'
-				limit 1''' % vocab
-			self.assertQueryCount(1, cmd, 'Cannot find vocab : %s' % vocab)
+				where name = %s
+				limit 1'''
+			self.assertQueryCount(1, cmd, 'Cannot find vocab : %s' % vocab, params=[vocab])
 
+			# table and field are identifiers, so they are filled in here; the vocab is a parameter
 			cmd = '''with terms as (
 					select distinct %s as _Term_key
 					from %s
@@ -40,9 +41,10 @@ class VocabTermTestCase(unittest.TestCase, DataTestCase):
 				from terms a, voc_term t, voc_vocab v
 				where a._Term_key = t._Term_key
 					and t._Vocab_key = v._Vocab_key
-					and v.name != '%s'
-				limit 1''' % (field, table, vocab)
-			self.assertQueryCount(0, cmd, '%s.%s has terms other than from: %s' % (table, field, vocab))
+					and v.name != %%s
+				limit 1''' % (field, table)
+			self.assertQueryCount(0, cmd, '%s.%s has terms other than from: %s' % (table, field, vocab),
+				params=[vocab])
 			
 def suite():
 	suite = unittest.TestSuite()
@@ -0,0 +1,429 @@
+#!/usr/local/bin/python
+"""
+Simple SNP viewer: take one or more SNP IDs (Consensus SNP or Sub SNP), look
+	up the data in the database, and print it out in a simple format.
+
+Runs as a CGI script (showSnpByID.cgi), as a WSGI application in a
+	long-lived process (showSnpByID.wsgi), or under a local development
+	server, which logs the time taken by each request.
+
+SNP data only changes when a new build is loaded, so the data shown for
+	each (server..database, SNP IDs, format, sections) is kept on disk (under
+	${DATATEST_CACHEDIR}/responses) until the build changes, and sent
+	with an ETag and Last-Modified so browsers can revalidate cheaply.
+
+
+Usage: snpviewer.py [--port N]
+"""
+
+import os
+import sys
+import cgi
+import time
+import types
+import hashlib
+import StringIO
+import email.utils
+from optparse import OptionParser
+
+if __name__ == '__main__':
+	sys.path.insert(0, '/usr/local/mgi/live/lib/python')
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shared import CGI
+from shared import datatest
+from snp_tests import snplib
+from snp_tests import serializer
+
+###--- Globals ---###
+
+pairs = [
+	('bhmgidb06ld..bluebob'),
+	]
+
+# directory of saved responses (None to not save any), and the most bytes kept there
+RESPONSE_DIR = datatest.CACHEDIR and os.path.join(datatest.CACHEDIR, 'responses')
+RESPONSE_CACHE_BYTES = int(os.environ.get('DATATEST_RESPONSE_CACHE_MB', '100')) * 1024 * 1024
+
+# seconds between checks (in a long-lived process) for a new database build
+BUILD_CHECK_SECONDS = 60
+
+# pair : (build version, time the build was first seen, time of the last check)
+BUILDS = {}
+
+###--- Classes ---###
+
+class RequestProfiler:
+	# Is: a record of the time taken by each step of a request
+	# Does: stamps the time at each step, and writes the steps out to the request's own
+	#	output (not to sys.stdout, which requests handled at the same time share)
+
+	def __init__ (self):
+		self.start = time.time()
+		self.stamps = []		# (label, seconds since the previous stamp, seconds in all)
+		self.last = self.start
+		return
+
+	def stamp (self, label):
+		now = time.time()
+		self.stamps.append((label, now - self.last, now - self.start))
+		self.last = now
+		return
+
+	def write (self, out):
+		for (label, seconds, total) in self.stamps:
+			out.write('%8.3fs %8.3fs  %s\n' % (seconds, total, label))
+		return
+
+class HtmlEscaper:
+	# Is: an output stream for text shown inside <PRE>
+	# Does: escapes each chunk written to it before passing it to 'out'
+	def __init__ (self, out):
+		self.out = out
+		return
+
+	def write (self, s):
+		self.out.write(cgi.escape(s))
+		return
+
+class ResponseCache:
+	# Is: an on-disk store of rendered SNP data, shared by the viewer's processes
+	# Has: the directory holding one file per response, and the most bytes kept there
+	# Does: returns stored responses by key, stores new ones, and removes the least
+	#	recently used once they take more than 'maxBytes'.  Also remembers when
+	#	each server..database was first seen with its current build.
+
+	def __init__ (self, directory, maxBytes):
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.size = None	# bytes stored (as far as this process knows)
+		return
+
+	def get (self, key):
+		# returns the response stored under 'key', or None
+		if not self.directory:
+			return None
+		path = self._path(key)
+		try:
+			fp = open(path, 'rb')
+			try:
+				body = fp.read()
+			finally:
+				fp.close()
+			os.utime(path, None)		# recently used
+		except (IOError, OSError):
+			return None
+		return body
+
+	def put (self, key, body):
+		# store 'body' under 'key', making room if needed
+		if not self.directory:
+			return
+		try:
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			self._write(self._path(key), body)
+		except (IOError, OSError):
+			return
+		if (self.size is None) or (self.size + len(body) > self.maxBytes):
+			self.size = self.evict()
+		else:
+			self.size = self.size + len(body)
+		return
+
+	def evict (self):
+		# remove the least recently used responses until they fit in 90% of maxBytes;
+		# returns the bytes left
+		files = []
+		total = 0
+		for name in os.listdir(self.directory):
+			if name.endswith('.html'):
+				try:
+					info = os.stat(os.path.join(self.directory, name))
+				except OSError:
+					continue		# removed by another process
+				files.append( (info.st_mtime, info.st_size, name) )
+				total = total + info.st_size
+		if total > self.maxBytes:
+			files.sort()
+			for (mtime, size, name) in files:
+				if total <= 0.9 * self.maxBytes:
+					break
+				try:
+					os.remove(os.path.join(self.directory, name))
+				except OSError:
+					pass
+				total = total - size
+		return total
+
+	def buildSeen (self, pair, version):
+		# returns the time 'version' was first seen for 'pair' (now, if it is new to us)
+		if not self.directory:
+			return time.time()
+		path = os.path.join(self.directory, 'build.%s' % hashlib.md5(pair).hexdigest()[:12])
+		try:
+			fp = open(path, 'rb')
+			try:
+				if fp.read() == version:
+					return os.stat(path).st_mtime
+			finally:
+				fp.close()
+		except (IOError, OSError):
+			pass
+		try:
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			self._write(path, version)
+		except (IOError, OSError):
+			pass
+		return time.time()
+
+	def _path (self, key):
+		return os.path.join(self.directory, '%s.html' % key)
+
+	def _write (self, path, body):
+		# write to a temporary file and rename, so other processes never see a partial file
+		tempPath = '%s.%d' % (path, os.getpid())
+		fp = open(tempPath, 'wb')
+		try:
+			fp.write(body)
+		finally:
+			fp.close()
+		os.rename(tempPath, path)
+		return
+
+class SnpViewer (CGI.CGI):
+	# Is: the SNP viewer page
+	# Has: the server..database pair being viewed and a RequestProfiler for the request
+	# Does: shows the form and the data for the requested SNP IDs
+
+	def main(self):
+		try:
+			self.respond()
+		finally:
+			# forget the queries this request issued, so a long-lived process
+			# does not keep a record of every query it has ever run
+			datatest.QUERIES.drain()
+		return
+
+	def respond(self):
+		self.profiler = RequestProfiler()
+		self.profiler.stamp('Initializing')
+		self.pair = pairs[0]
+
+		parms = self.get_parms()
+		self.initializeDb(parms)
+		if self.checkCache(parms):
+			return		# the browser's copy is current
+
+		print >> self.out, '<HTML><HEAD><TITLE>Snp Viewer</TITLE></HEAD><BODY>'
+		self.showForm(parms)
+		print >> self.out, '<HR>'
+		self.showSnp(parms)
+		print >> self.out, '<HR>'
+		print >> self.out, '<PRE>'
+		self.profiler.stamp('Done')
+		self.profiler.write(self.out)
+		print >> self.out, '</PRE>'
+		print >> self.out, '</BODY></HTML>'
+		return
+
+	def initializeDb(self, parms):
+		if 'pair' in parms:
+			self.pair = parms['pair']
+
+		[server, database]= self.pair.strip().split('..')
+		datatest.setLogin(server, database)
+		self.profiler.stamp('Logged into %s..%s' % (server, database))
+		return
+
+	def buildMarker(self):
+		# returns (build version, time first seen) for the current pair, checking the
+		# database at most every BUILD_CHECK_SECONDS; data held in memory is dropped
+		# when a new build appears
+		now = time.time()
+		(version, since, checked) = BUILDS.get(self.pair, (None, None, 0))
+		if now - checked >= BUILD_CHECK_SECONDS:
+			current = datatest.databaseVersion(cache = False)
+			if current != version:
+				if version is not None:
+					datatest.RESULTS.clear()
+					snplib.clearCaches()
+				version = current
+				since = current and RESPONSES.buildSeen(self.pair, current)
+			BUILDS[self.pair] = (version, since, now)
+			self.profiler.stamp('Checked database build')
+		return (version, since)
+
+	def checkCache(self, parms):
+		# work out the key of the requested data (self.cacheKey, None if it is not cached)
+		# and send its ETag and Last-Modified; returns True (with a 304 status) if the
+		# request's If-None-Match or If-Modified-Since shows the browser has it already
+		self.cacheKey = None
+		if 'snpID' not in parms:
+			return False
+		(version, since) = self.buildMarker()
+		if version is None:
+			return False
+
+		snpIDs = ','.join(parms['snpID'].replace(',', ' ').split())
+		self.cacheKey = hashlib.md5('|'.join([ version, self.pair, snpIDs,
+			self.format(parms), ','.join(self.include(parms)) ])).hexdigest()
+		etag = 'W/"%s"' % self.cacheKey[:20]
+		self.addHeader('ETag', etag)
+		self.addHeader('Last-Modified', email.utils.formatdate(since, usegmt = True))
+		self.addHeader('Cache-Control', 'no-cache')
+
+		ifNoneMatch = self.environ.get('HTTP_IF_NONE_MATCH')
+		ifModifiedSince = self.environ.get('HTTP_IF_MODIFIED_SINCE')
+		if ifNoneMatch is not None:
+			tags = [ tag.strip() for tag in ifNoneMatch.split(',') ]
+			current = ('*' in tags) or (etag in tags) or (etag[2:] in tags)
+		elif ifModifiedSince:
+			parsed = email.utils.parsedate_tz(ifModifiedSince)
+			current = (parsed is not None) and (email.utils.mktime_tz(parsed) >= int(since))
+		else:
+			current = False
+
+		if current:
+			self.setStatus('304 Not Modified')
+			self.profiler.stamp('Not modified')
+		return current
+
+	def format(self, parms):
+		format = parms.get('format', 'text')
+		if format not in serializer.FORMATS:
+			format = 'text'
+		return format
+
+	def include(self, parms):
+		# the sections of each SNP to show (see snplib.SECTIONS), from the checked
+		# 'include' boxes; all of them if none are checked
+		include = parms.get('include', [])
+		if type(include) == types.StringType:
+			include = include.split(',')
+		include = [ section for section in snplib.SECTIONS if section in include ]
+		return include or snplib.SECTIONS
+
+	def showForm(self, parms):
+		print >> self.out, '<H3>Simple SNP Viewer</H3>'
+		print >> self.out, '<FORM ACTION="%s" METHOD="GET">' % \
+			os.path.basename(self.environ.get('SCRIPT_NAME') or 'showSnpByID.cgi')
+		print >> self.out, '<B>Server/Database:</B>'
+		print >> self.out, '<SELECT TYPE="select" NAME="pair">'
+
+		for onePair in pairs:
+			if self.pair == onePair:
+				print >> self.out, '<OPTION SELECTED>%s</OPTION>' % self.pair
+			else:
+				print >> self.out, '<OPTION>%s</OPTION>' % onePair
+
+		print >> self.out, '</SELECT>'
+
+		if 'snpID' in parms:
+			snpID = parms['snpID']
+		else:
+			snpID = ''
+
+		print >> self.out, '<B>SNP ID(s) (rs or ss):</B>'
+		print >> self.out, '<INPUT NAME="snpID" TYPE="text" SIZE="20" VALUE="%s">' % cgi.escape(snpID, True)
+
+		print >> self.out, '<B>Format:</B>'
+		print >> self.out, '<SELECT TYPE="select" NAME="format">'
+		for format in serializer.FORMATS:
+			if format == parms.get('format', 'text'):
+				print >> self.out, '<OPTION SELECTED>%s</OPTION>' % format
+			else:
+				print >> self.out, '<OPTION>%s</OPTION>' % format
+		print >> self.out, '</SELECT>'
+
+		print >> self.out, '<B>Show:</B>'
+		include = self.include(parms)
+		for section in snplib.SECTIONS:
+			if section in include:
+				checked = ' CHECKED'
+			else:
+				checked = ''
+			print >> self.out, '<INPUT NAME="include" TYPE="checkbox" VALUE="%s"%s>%s' % (section, checked, section)
+		print >> self.out, '<INPUT TYPE="submit">'
+		print >> self.out, '</FORM>'
+		self.profiler.stamp('Wrote form')
+		return
+
+	def showSnp(self, parms):
+		if 'snpID' in parms:
+			body = self.cacheKey and RESPONSES.get(self.cacheKey)
+			if body is not None:
+				self.profiler.stamp('Read saved data')
+			else:
+				out = StringIO.StringIO()
+				self.writeSnps(parms, out)
+				body = out.getvalue()
+				if self.cacheKey:
+					RESPONSES.put(self.cacheKey, body)
+			self.out.write(body)
+		else:
+			print >> self.out, 'No SNP specified'
+		return
+
+	def writeSnps(self, parms, out):
+		# allow several IDs, separated by commas and/or spaces, to be loaded in one batch
+		snpIDs = parms['snpID'].replace(',', ' ').split()
+		include = self.include(parms)
+		snps = snplib.getSnpsByIDs(snpIDs, include)
+		self.profiler.stamp('Retrieved data')
+
+		found = []
+		for snpID in snpIDs:
+			if not snps[snpID]:
+				self.profiler.stamp('Failed to find %s in db' % snpID)
+				out.write('Unknown SNP ID: %s<BR>\n' % cgi.escape(snpID))
+			else:
+				found.append(snps[snpID])
+
+		if found:
+			out.write('<PRE>\n')
+			output = serializer.Serializer(HtmlEscaper(out), self.format(parms),
+				include = include)
+			for snp in found:
+				output.write(snp)
+				self.profiler.stamp('Wrote data for %s' % snp.accID)
+			output.close()
+			out.write('</PRE>\n')
+		return
+
+###--- Functions ---###
+
+# rendered SNP data saved between requests
+RESPONSES = ResponseCache(RESPONSE_DIR, RESPONSE_CACHE_BYTES)
+
+# a request waits on the slowest section of its SNPs' data rather than on the sum of them
+snplib.setConcurrentLoading(True)
+
+# WSGI entry point (see showSnpByID.wsgi)
+application = CGI.wsgiApplication(SnpViewer)
+
+def timed(app):
+	# wrap WSGI application 'app' to report the time taken by each request on stderr
+	def timedApplication(environ, start_response):
+		start = time.time()
+		body = app(environ, start_response)
+		sys.stderr.write('%s?%s %.1fms\n' % (environ.get('PATH_INFO', ''),
+			environ.get('QUERY_STRING', ''), (time.time() - start) * 1000.0))
+		return body
+	return timedApplication
+
+###--- Main Program ---###
+
+# local development server
+if __name__ == '__main__':
+	from wsgiref.simple_server import make_server
+
+	parser = OptionParser(usage = 'Usage: %prog [--port N]')
+	parser.add_option('-p', '--port', type = 'int', default = 8080,
+		help = 'port to listen on (default 8080)')
+	(options, args) = parser.parse_args()
+
+	server = make_server('', options.port, timed(application))
+	sys.stderr.write('Serving the SNP viewer on http://localhost:%d/\n' % options.port)
+	server.serve_forever()
@@ -5,42 +5,348 @@ Test plan for ensuring that database is in a valid
 
 Reports any data components that fail to meet tests.
 Reports possible remedies (E.g. which cache loads might need to be rerun)
+
+Usage: testProdDatabase.py [--jobs N] [--split suite|test] [--import-profile]
+		[--snapshot DIR | --fixtures DIR] [suite ...]
+	suite		run only the named suites (test modules, e.g.
+			location_test); only those modules are imported
+			(default: all of SUITES)
+	--jobs N	run the tests in N worker processes, each with its
+			own database session (default: $DATATEST_JOBS, or 1 to
+			run in this process)
+	--split		unit of work handed to a worker: a whole suite
+			(test module) or a single test method (default)
+	--import-profile
+			report the time taken to import each module
+	--snapshot DIR	instead of running the suites, copy the rows they
+			read into a snapshot in DIR; set DATATEST_SNAPSHOT=DIR
+			to run them against it with no database
+	--fixtures DIR	as --snapshot, but write fixture files (one .json
+			per table, and schema.sql); set DATATEST_FIXTURES=DIR
+			to run the suites against them on SQLite
 """
 
 import sys
+
+# start timing before anything else is imported (optparse takes any unambiguous
+# prefix of an option, e.g. --import, so look for those too)
+if __name__ == '__main__' and [ arg for arg in sys.argv[1:]
+		if len(arg) > 2 and '--import-profile'.startswith(arg) ]:
+	from shared import importprofile
+	importprofile.start()
+
+import os
+import time
 import unittest
+import importlib
+import multiprocessing
+from optparse import OptionParser
 
 from shared import datatest
-from snp_tests import *
-from so_load_tests import *
 
-def master_suite():
+# test modules that ensure the database is ready for public release, in
+# the order they run
+SUITES = [
+	'snp_tests.location_test',
+	'snp_tests.function_class_translation_test',
+	'snp_tests.vocab_term_test',
+	'snp_tests.ss_id_test',
+	'snp_tests.consensus_alleles_test',
+	'snp_tests.genome_calls_test',
+	'so_load_tests.so_vocab_test',
+	]
+
+# in a worker process, the reporters' counts inherited from the parent (see
+# datatest.reporterCounts), left out of the counts the worker passes back
+INHERITED_COUNTS = {}
+
+def selectSuites(names):
+	"""
+	Return the modules in SUITES named (in full, or by the
+	module name alone) in names, or all of SUITES if names is
+	empty.  Raises KeyError for an unknown name.
+	"""
+	if not names:
+		return list(SUITES)
+	selected = []
+	for name in names:
+		matches = [ suite for suite in SUITES if name in (suite, suite.rsplit('.', 1)[-1]) ]
+		if not matches:
+			raise KeyError(name)
+		selected.extend([ suite for suite in matches if suite not in selected ])
+	return [ suite for suite in SUITES if suite in selected ]
+
+def master_suite(names=None):
 	"""
 	Define which tests to run in order to test that
-	database is ready for public release
+	database is ready for public release (only the
+	named suites, if given), importing just their modules
 	"""
 	suites = []
-
-	suites.append(location_test.suite())
-	suites.append(function_class_translation_test.suite())
-	suites.append(vocab_term_test.suite())
-	suites.append(ss_id_test.suite())
-	suites.append(consensus_alleles_test.suite())
-	suites.append(so_vocab_test.suite())
+	for name in selectSuites(names):
+		suites.append(importlib.import_module(name).suite())
 	master_suite = unittest.TestSuite(suites)
 
 	return master_suite
 
+### parallel execution ###
+
+def listTests(suite):
+	"""
+	Return the tests in suite (and any nested suites), in order
+	"""
+	tests = []
+	for test in suite:
+		if isinstance(test, unittest.TestSuite):
+			tests.extend(listTests(test))
+		else:
+			tests.append(test)
+	return tests
+
+def workUnits(suite, split):
+	"""
+	Divide the suite into lists of test IDs, one list per unit
+	of work: either one per test module or one per test method
+	"""
+	units = []
+	for test in listTests(suite):
+		if split == 'suite' and units and \
+			units[-1][-1].rsplit('.', 2)[0] == test.id().rsplit('.', 2)[0]:
+			units[-1].append(test.id())
+		else:
+			units.append([test.id()])
+	return units
+
+class OutcomeResult(unittest.TestResult):
+	"""
+	A TestResult that also notes the outcome of each test as the
+	letter unittest.TextTestRunner prints for it
+	"""
+
+	def __init__(self):
+		unittest.TestResult.__init__(self)
+		self.letters = []
+
+	def addSuccess(self, test):
+		unittest.TestResult.addSuccess(self, test)
+		self.letters.append('.')
+
+	def addError(self, test, err):
+		unittest.TestResult.addError(self, test, err)
+		self.letters.append('E')
+
+	def addFailure(self, test, err):
+		unittest.TestResult.addFailure(self, test, err)
+		self.letters.append('F')
+
+	def addSkip(self, test, reason):
+		unittest.TestResult.addSkip(self, test, reason)
+		self.letters.append('s')
+
+	def addExpectedFailure(self, test, err):
+		unittest.TestResult.addExpectedFailure(self, test, err)
+		self.letters.append('x')
+
+	def addUnexpectedSuccess(self, test):
+		unittest.TestResult.addUnexpectedSuccess(self, test)
+		self.letters.append('u')
+
+def initWorker():
+	"""
+	Start each worker with no hints inherited from the parent,
+	noting the reporters' counts it inherits
+	"""
+	global INHERITED_COUNTS
+	datatest.HINTS.clear()
+	INHERITED_COUNTS = datatest.reporterCounts()
+
+def runTests(testIDs):
+	"""
+	Run the named tests in this worker process.
+	Returns a picklable summary of the outcome.
+	"""
+	tests = unittest.defaultTestLoader.loadTestsFromNames(testIDs)
+	result = OutcomeResult()
+	tests.run(result)
+
+	# reporters whose counts cannot be summed with other workers' are reported as they are
+	reports = []
+	for reporter in datatest.REPORTERS:
+		if reporter not in datatest.COUNTERS:
+			msg = reporter()
+			if msg:
+				reports.append(msg)
+
+	def describe(outcomes):
+		return [ (str(test), test.shortDescription(), tb) for (test, tb) in outcomes ]
+
+	return {
+		'pid' : os.getpid(),
+		'testsRun' : result.testsRun,
+		'outcomes' : ''.join(result.letters),
+		'failures' : describe(result.failures),
+		'errors' : describe(result.errors),
+		'skipped' : len(result.skipped),
+		'expectedFailures' : describe(result.expectedFailures),
+		'unexpectedSuccesses' : [ str(test) for test in result.unexpectedSuccesses ],
+		'hints' : list(datatest.HINTS),
+		'reports' : reports,
+		'counts' : datatest.addCounts(datatest.reporterCounts(), INHERITED_COUNTS, -1),
+		'queries' : datatest.QUERIES.drain(),
+		}
+
+def runParallel(suite, jobs, split):
+	"""
+	Run the suite across a pool of jobs worker processes,
+	printing a report in the style of unittest.TextTestRunner.
+	Merges failures and datatest.HINTS from all workers.
+	Returns (True if all tests passed, the reporters' counts
+	summed over the workers; see datatest.reportFailures).
+	"""
+	stream = sys.stderr
+	startTime = time.time()
+
+	testsRun = 0
+	failures = []
+	errors = []
+	skipped = 0
+	expectedFailures = []
+	unexpectedSuccesses = []
+	reports = {}		# worker pid : latest (cumulative) report lines
+	counts = {}		# worker pid : latest (cumulative) reporter counts
+
+	# the workers open their own connections; close the ones this process
+	# has used (e.g. resolving SNP IDs) so none is shared with them
+	connections = datatest.getPool()
+	if connections is not None:
+		connections.closeAll()
+
+	pool = multiprocessing.Pool(jobs, initWorker)
+	try:
+		for outcome in pool.imap_unordered(runTests, workUnits(suite, split)):
+			testsRun += outcome['testsRun']
+			failures.extend(outcome['failures'])
+			errors.extend(outcome['errors'])
+			skipped += outcome['skipped']
+			expectedFailures.extend(outcome['expectedFailures'])
+			unexpectedSuccesses.extend(outcome['unexpectedSuccesses'])
+			datatest.HINTS.update(outcome['hints'])
+			reports[outcome['pid']] = outcome['reports']
+			counts[outcome['pid']] = outcome['counts']
+			datatest.QUERIES.records.extend(outcome['queries'])
+
+			stream.write(outcome['outcomes'])
+			stream.flush()
+	finally:
+		pool.close()
+		pool.join()
+
+	timeTaken = time.time() - startTime
+	stream.write('\n')
+
+	for (flavour, outcomes) in (('ERROR', errors), ('FAIL', failures)):
+		for (name, description, tb) in outcomes:
+			stream.write('=' * 70 + '\n')
+			stream.write('%s: %s\n' % (flavour, name))
+			if description:
+				stream.write(description + '\n')
+			stream.write('-' * 70 + '\n')
+			stream.write(tb + '\n')
+
+	stream.write('-' * 70 + '\n')
+	stream.write('Ran %d test%s in %.3fs (%d jobs)\n\n' % \
+		(testsRun, testsRun != 1 and 's' or '', timeTaken, jobs))
+
+	infos = []
+	if failures:
+		infos.append('failures=%d' % len(failures))
+	if errors:
+		infos.append('errors=%d' % len(errors))
+	if skipped:
+		infos.append('skipped=%d' % skipped)
+	if expectedFailures:
+		infos.append('expected failures=%d' % len(expectedFailures))
+	if unexpectedSuccesses:
+		infos.append('unexpected successes=%d' % len(unexpectedSuccesses))
+	if failures or errors:
+		stream.write('FAILED (%s)\n' % ', '.join(infos))
+	elif infos:
+		stream.write('OK (%s)\n' % ', '.join(infos))
+	else:
+		stream.write('OK\n')
+
+	for pid in sorted(reports.keys()):
+		for msg in reports[pid]:
+			datatest.log('[worker %d] %s' % (pid, msg))
+
+	total = {}
+	for workerCounts in counts.values():
+		datatest.addCounts(total, workerCounts)
+	return (not (failures or errors), total)
+
 
 if __name__ == '__main__':
 
+	parser = OptionParser(usage = 'Usage: %prog [--jobs N] [--split suite|test] [--import-profile] ' + \
+		'[--snapshot DIR | --fixtures DIR] [suite ...]')
+	parser.add_option('-j', '--jobs', type = 'int',
+		default = int(os.environ.get('DATATEST_JOBS', '1')),
+		help = 'number of worker processes (default $DATATEST_JOBS or 1)')
+	parser.add_option('--split', choices = [ 'suite', 'test' ], default = 'test',
+		help = 'unit of work per worker: suite or test (default test)')
+	parser.add_option('--import-profile', action = 'store_true', default = False,
+		help = 'report the time taken to import each module')
+	parser.add_option('--snapshot', metavar = 'DIR',
+		help = 'copy the rows the suites read into a snapshot in DIR, rather than run them')
+	parser.add_option('--fixtures', metavar = 'DIR',
+		help = 'copy the rows the suites read into fixture files in DIR, rather than run them')
+	(options, args) = parser.parse_args()
+	if options.snapshot and options.fixtures:
+		parser.error('--snapshot and --fixtures are alternatives')
+	if (options.snapshot or options.fixtures) and (datatest.SNAPSHOT_DIR or datatest.FIXTURES_DIR):
+		parser.error('--snapshot and --fixtures need a database ' + \
+			'(DATATEST_SNAPSHOT or DATATEST_FIXTURES is set)')
+
 	# run test suites
-	test_suite = master_suite()
-	runner = unittest.TextTestRunner()
-	ret = not runner.run(test_suite).wasSuccessful()
-	
+	try:
+		test_suite = master_suite(args)
+	except KeyError, e:
+		parser.error('unknown suite %s (expected one of: %s)' % (e,
+			', '.join([ suite.rsplit('.', 1)[-1] for suite in SUITES ])))
+
+	if options.import_profile:
+		from shared import importprofile
+		importprofile.report()
+
+	if options.snapshot or options.fixtures:
+		# the SNP IDs declared while building the suites are the SNPs they use
+		from shared import snapshot
+		snplib = sys.modules.get('snp_tests.snplib')
+		accIDs = snplib and set(snplib.RESOLVER.pending) or set()
+		directory = options.snapshot or options.fixtures
+		extracted = snapshot.extract(directory, accIDs, selectSuites(args),
+			fixtures = bool(options.fixtures))
+		for (table, rows) in sorted(extracted.rows.items()):
+			datatest.log('%s: %d rows' % (table, len(rows)))
+		datatest.log('%s of %s..%s written to %s' % ((options.snapshot and 'Snapshot' or 'Fixtures',) + \
+			datatest.getLogin() + (directory,)))
+		sys.exit(0)
+
+	# resolve the SNP IDs declared while building the suites (one query), so
+	# parallel workers inherit the map rather than each looking them up
+	if 'snp_tests.snplib' in sys.modules:
+		sys.modules['snp_tests.snplib'].RESOLVER.resolve()
+
+	counts = None
+	if options.jobs > 1:
+		(passed, counts) = runParallel(test_suite, options.jobs, options.split)
+		ret = not passed
+	else:
+		runner = unittest.TextTestRunner()
+		ret = not runner.run(test_suite).wasSuccessful()
+
 	# report any failures
-	datatest.reportFailures()
+	datatest.reportFailures(counts)
 
 	# return proper error code
 	sys.exit(ret)
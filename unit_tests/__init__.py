@@ -0,0 +1,4 @@
+__all__ = [
+	"datatest_test",
+	"snplib_test",
+]
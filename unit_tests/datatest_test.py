@@ -0,0 +1,120 @@
+"""
+Tests of the datatest machinery itself, needing no database.
+
+Run from the top-level directory:
+	python -m unittest discover -s unit_tests -p '*_test.py' -t .
+"""
+
+import os
+import gc
+import shutil
+import tempfile
+import unittest
+from shared import datatest
+
+###--- Classes ---###
+
+class FakeConnection(object):
+	"""
+	Stands in for a psycopg2 connection, noting in a log file each
+	process that closes it (as psycopg2 does when one is collected)
+	"""
+
+	def __init__(self, name, log):
+		self.name = name
+		self.log = log
+		self.closed = False
+
+	def close(self):
+		if not self.closed:
+			self._note('close')
+		self.closed = True
+
+	def __del__(self):
+		self.close()
+
+	def _note(self, event):
+		fp = open(self.log, 'a')
+		fp.write('%d %s %s\n' % (os.getpid(), self.name, event))
+		fp.close()
+
+class FakePool(datatest.ConnectionPool):
+	"""
+	A ConnectionPool of FakeConnections
+	"""
+
+	def __init__(self, log):
+		datatest.ConnectionPool.__init__(self, 'server', 'database')
+		self.log = log
+		self.count = 0
+
+	def connect(self):
+		self.count += 1
+		return FakeConnection('%d.%d' % (os.getpid(), self.count), self.log)
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.log = os.path.join(self.directory, 'connections.log')
+		self.login = datatest.LOGIN
+		datatest.LOGIN = ('server', 'database')
+
+	def tearDown(self):
+		datatest.LOGIN = self.login
+		shutil.rmtree(self.directory)
+
+	def testForkKeepsParentConnection(self):
+		pool = FakePool(self.log)
+		with pool.checkout() as conn:
+			pid = os.fork()
+
+		if pid == 0:
+			# the worker: query on a connection of its own, then drop all it can
+			status = 2
+			try:
+				with pool.checkout() as childConn:
+					status = (childConn is conn) and 1 or 0
+				pool.closeAll()
+				del conn, childConn
+				gc.collect()
+			finally:
+				os._exit(status)
+
+		(pid, status) = os.waitpid(pid, 0)
+		self.assertEquals(0, status, 'worker reused or failed (status %d)' % status)
+		closedByWorker = []
+		if os.path.exists(self.log):
+			closedByWorker = [ line for line in open(self.log)
+				if line.split()[0] == str(pid) and line.split()[1] == conn.name ]
+		self.assertEquals([], closedByWorker)
+
+		# the parent goes on using its connection
+		self.assertFalse(conn.closed)
+		with pool.checkout() as again:
+			self.assertTrue(again is conn)
+
+class ResultCacheTestCase(unittest.TestCase):
+
+	def testChangedRowsDoNotReachTheCache(self):
+		cache = datatest.ResultCache(maxSize=10)
+		rows = [ { 'accID' : 'rs1', 'count' : 1 } ]
+		cache.put('key', rows)
+		rows[0]['count'] = 2
+
+		hit = cache.get('key')
+		self.assertEquals([ { 'accID' : 'rs1', 'count' : 1 } ], hit)
+		hit[0]['count'] = 3
+		hit.append({ 'accID' : 'rs2', 'count' : 1 })
+		self.assertEquals([ { 'accID' : 'rs1', 'count' : 1 } ], cache.get('key'))
+
+###--- Functions ---###
+
+def suite():
+	suite = unittest.TestSuite()
+	suite.addTest(unittest.makeSuite(ResultCacheTestCase))
+	suite.addTest(unittest.makeSuite(ConnectionPoolTestCase))
+	return suite
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,139 @@
+"""
+Tests of snplib's coordinate index, over a small fixture (see
+backends.SqliteBackend) rather than a database.
+
+Run from the top-level directory:
+	python -m unittest discover -s unit_tests -p '*_test.py' -t .
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from shared import datatest
+from shared import backends
+from snp_tests import snplib
+
+###--- Globals ---###
+
+# (_Coord_Cache_key, _ConsensusSnp_key, chromosome, sequenceNum, startCoordinate)
+LOCATIONS = [
+	(1, 101, '1', 1, 5000),
+	(2, 102, '1', 1, 1000),
+	(3, 103, '1', 1, 3000),
+	(4, 104, '2', 1, 2000),
+	(5, 105, '2', 1, 2000),
+	(6, 106, 'X', 1, 7000),
+	]
+
+###--- Classes ---###
+
+class CoordinateIndexTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.fixtures = os.path.join(self.directory, 'fixtures')
+		self.cacheDir = os.path.join(self.directory, 'cache')
+		os.mkdir(self.fixtures)
+		os.mkdir(self.cacheDir)
+		self._writeFixture('mgi_dbinfo', [ 'public_version', 'snp_data_version' ],
+			[ [ 'MGI 6.01', 'dbSNP Build 146' ] ])
+		self._writeFixture('snp_coord_cache', [ '_Coord_Cache_key', '_ConsensusSnp_key',
+			'chromosome', 'sequenceNum', 'startCoordinate' ], LOCATIONS)
+
+		self.saved = (datatest.BACKEND, datatest.LOGIN, datatest.CONFIGURED)
+		self.backend = backends.SqliteBackend(fixtures=self.fixtures)
+		(datatest.BACKEND, datatest.LOGIN, datatest.CONFIGURED) = \
+			(self.backend, self.backend.login, True)
+		datatest.RESULTS.clear()
+		datatest.QUERIES.drain()
+
+	def tearDown(self):
+		self.backend.close()
+		(datatest.BACKEND, datatest.LOGIN, datatest.CONFIGURED) = self.saved
+		datatest.RESULTS.clear()
+		datatest.QUERIES.drain()
+		shutil.rmtree(self.directory)
+
+	def testSearches(self):
+		index = snplib.CoordinateIndex(self.cacheDir)
+		self.assertEquals([ '1', '2', 'X' ], index.chromosomes())
+		self.assertEquals([ (1000.0, 102), (3000.0, 103) ], index.region('1', 1000, 3000))
+		self.assertEquals(2, index.count('2', 1999, 2001))
+		self.assertEquals(0, index.count('Y', 0, 10000))
+		self.assertEquals([ (3000.0, 103), (5000.0, 101) ], index.nearest('1', 4500, 2))
+
+	def testSavedArraysAreRead(self):
+		snplib.CoordinateIndex(self.cacheDir).chromosomes()
+		self.assertEquals(1, len(self._built()))
+		self.assertEquals(1, len(os.listdir(self.cacheDir)))
+
+		index = snplib.CoordinateIndex(self.cacheDir)
+		self.assertEquals([ (1000.0, 102), (3000.0, 103) ], index.region('1', 1000, 3000))
+		self.assertEquals([], self._built())
+
+	def testChromosomesAreSavedApart(self):
+		snplib.CoordinateIndex(self.cacheDir).chromosomes()
+		index = snplib.CoordinateIndex(self.cacheDir, chromosomes = [ 'X', '2', 'X' ])
+		self.assertEquals([ '2', 'X' ], index.chromosomes())
+		self.assertEquals(2, len(self._built()))
+		self.assertEquals(2, len(os.listdir(self.cacheDir)))
+		self.assertRaises(Exception, index.region, '1', 1000, 3000)
+
+		# the same chromosomes, in any order, share a file
+		index = snplib.CoordinateIndex(self.cacheDir, chromosomes = [ '2', 'X' ])
+		self.assertEquals([ (7000.0, 106) ], index.nearest('X', 1, 1))
+		self.assertEquals([], self._built())
+
+	def testNewBuildIsIndexedAgain(self):
+		snplib.CoordinateIndex(self.cacheDir).chromosomes()
+		self.backend.execute("update mgi_dbinfo set snp_data_version = 'dbSNP Build 147'")
+		self.backend.execute("delete from snp_coord_cache where chromosome = 'X'")
+		datatest.RESULTS.clear()
+		self._built()
+
+		index = snplib.CoordinateIndex(self.cacheDir)
+		self.assertEquals([ '1', '2' ], index.chromosomes())
+		self.assertEquals(1, len(self._built()))
+
+		# and the rebuilt arrays replace the old ones
+		self.assertEquals(1, len(os.listdir(self.cacheDir)))
+		self.assertEquals([ '1', '2' ], snplib.CoordinateIndex(self.cacheDir).chromosomes())
+		self.assertEquals([], self._built())
+
+	def testDamagedFileIsIndexedAgain(self):
+		snplib.CoordinateIndex(self.cacheDir).chromosomes()
+		path = os.path.join(self.cacheDir, os.listdir(self.cacheDir)[0])
+		fp = open(path, 'rb')
+		contents = fp.read()
+		fp.close()
+		fp = open(path, 'wb')
+		fp.write(contents[:len(contents) / 2])
+		fp.close()
+		self._built()
+
+		self.assertEquals([ '1', '2', 'X' ], snplib.CoordinateIndex(self.cacheDir).chromosomes())
+		self.assertEquals(1, len(self._built()))
+		self.assertEquals([ '1', '2', 'X' ], snplib.CoordinateIndex(self.cacheDir).chromosomes())
+		self.assertEquals([], self._built())
+
+	def _writeFixture(self, table, columns, rows):
+		fp = open(os.path.join(self.fixtures, '%s.json' % table), 'w')
+		json.dump({ 'columns' : columns, 'rows' : rows }, fp)
+		fp.close()
+
+	def _built(self):
+		# the queries of snp_coord_cache since last asked
+		return [ record for record in datatest.QUERIES.drain()
+			if 'snp_coord_cache' in record[1] ]
+
+###--- Functions ---###
+
+def suite():
+	suite = unittest.TestSuite()
+	suite.addTest(unittest.makeSuite(CoordinateIndexTestCase))
+	return suite
+
+if __name__ == '__main__':
+	unittest.main()